@@ -34,5 +34,8 @@ from errors import *
 from fieldactions import FieldActions
 from fields import Field, FieldGroup
 from indexerconnection import IndexerConnection
+from profiling import SearchProfile, ProfileAggregator
 from query import Query
 from searchconnection import SearchConnection, ExternalWeightSource
+from searchpool import SearchPool, SearchRequest
+from parallel import ParallelSearchConnection
@@ -43,47 +43,92 @@ class CacheTermWeightGetter(object):
 
 
 class CacheMSetItem(object):
-    def __init__(self, conn, rank, xapid):
-        self.document = conn.get_document(xapid=xapid)._doc
+    def __init__(self, conn, rank, xapid, weight=0, percent=0, docs=None):
+        """Initialise the item.
+
+        `docs` is a dictionary of documents read by
+        SearchConnection._fetch_documents(), or None.  If the document isn't
+        in it, it's read from the database.
+
+        """
+        document = None
+        if docs is not None:
+            document = docs.get(xapid)
+        if document is None:
+            document = conn.get_document(xapid=xapid)._doc
+        self.document = document
         self.rank = rank
-        self.weight = 0
-        self.percent = 0
+        self.weight = weight
+        self.percent = percent
 
 
 class CacheSearchResultIter(object):
     """An iterator over a set of results from a search.
 
     """
-    def __init__(self, xapids, context):
+    def __init__(self, xapids, context, weights=None, docs=None):
         self.context = context
+        self.weights = weights
+        self.docs = docs
         self.it = enumerate(xapids)
 
     def next(self):
         rank, xapid = self.it.next()
-        msetitem = CacheMSetItem(self.context.conn, rank, xapid)
+        if self.weights is None:
+            msetitem = CacheMSetItem(self.context.conn, rank, xapid,
+                                     docs=self.docs)
+        else:
+            msetitem = CacheMSetItem(self.context.conn, rank, xapid,
+                                     docs=self.docs, *self.weights[rank])
         return SearchResult(msetitem, self.context)
 
 
 class CacheResultOrdering(object):
-    def __init__(self, context, xapids, startrank):
+    def __init__(self, context, xapids, startrank, weights=None):
+        """Initialise the ordering.
+
+        `weights` is a list of (weight, percent) tuples for the documents in
+        `xapids`, or None if the weights are not known.
+
+        """
         self.context = context
         self.xapids = xapids
         self.startrank = startrank
+        self.weights = weights
+
+        # Dictionary of the documents read by fetch(), keyed by xapid, or
+        # None.
+        self.docs = None
 
     def get_iter(self):
         """Get an iterator over the search results.
 
         """
-        return CacheSearchResultIter(self.xapids, self.context)
+        return CacheSearchResultIter(self.xapids, self.context, self.weights,
+                                     self.docs)
 
     def get_hit(self, index):
         """Get the hit with a given index.
 
         """
-        msetitem = CacheMSetItem(self.context.conn, index,
-                                 self.xapids[index])
+        if self.weights is None:
+            msetitem = CacheMSetItem(self.context.conn, index,
+                                     self.xapids[index], docs=self.docs)
+        else:
+            msetitem = CacheMSetItem(self.context.conn, index,
+                                     self.xapids[index], docs=self.docs,
+                                     *self.weights[index])
         return SearchResult(msetitem, self.context)
 
+    def fetch(self):
+        """Read the documents for all the hits.
+
+        The documents are read in a single pass, in docid order.
+
+        """
+        if self.docs is None:
+            self.docs = self.context.conn._fetch_documents(self.xapids)
+
     def __len__(self):
         """Get the number of items in this ordering.
 
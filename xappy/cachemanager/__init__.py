@@ -25,6 +25,7 @@ r"""cachemanager: Caches of results for particular queries.
 __docformat__ = "restructuredtext en"
 
 from generic import CacheManager, KeyValueStoreCacheManager
+from sharded import ShardedCacheManager
 try:
     from xapian_manager import \
         XapianCacheManager, \
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""sharded.py: A cache manager combining the caches of several shards.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import generic
+
+class ShardedCacheManager(generic.CacheManager):
+    """A read-only cache manager combining the caches of several shards.
+
+    This is used by a SearchConnection opened on several databases, each of
+    which has its own cache.  The document IDs it uses are those of the
+    combined database formed by adding the shard databases together, in
+    order (ie, document `docid` in shard `i` of `n` shards has the ID `(docid
+    - 1) * n + i + 1`).
+
+    A query is only treated as cached if it has the same query ID in every
+    shard, since the query ID is used to find the cached ranks stored in
+    the documents.  Statistics are summed, as are facet frequencies (ranges
+    for float facets are only combined if they are identical in each shard).
+
+    The caches only store the order of the hits in each shard, not their
+    weights, so there is no way to merge the cached orderings of the shards
+    correctly: get_hits() returns no hits, so searches for cached queries
+    are always performed on the combined database (which uses the cached
+    ranks stored in the documents of each shard).
+
+    """
+    def __init__(self, managers):
+        self.managers = list(managers)
+
+    def _combined_docid(self, shard, docid):
+        return (docid - 1) * len(self.managers) + shard + 1
+
+    def is_empty(self):
+        for manager in self.managers:
+            if not manager.is_empty():
+                return False
+        return True
+
+    def iter_queryids(self):
+        for queryid in self.managers[0].iter_queryids():
+            yield queryid
+
+    def iter_query_strs(self):
+        for query_str in self.managers[0].iter_query_strs():
+            if self.get_queryid(query_str) is not None:
+                yield query_str
+
+    def get_queryid(self, query_str):
+        result = None
+        for manager in self.managers:
+            queryid = manager.get_queryid(query_str)
+            if queryid is None:
+                return None
+            if result is None:
+                result = queryid
+            elif queryid != result:
+                return None
+        return result
+
+    def get_hits(self, queryid, startrank=0, endrank=None):
+        # The rank of a hit in one shard says nothing about how it compares
+        # with the hits of the other shards, so no combined ordering is
+        # available.
+        return []
+
+    def get_stats(self, queryid):
+        result = [0, 0, 0]
+        for manager in self.managers:
+            stats = manager.get_stats(queryid)
+            for i in xrange(3):
+                if result[i] is None or stats[i] is None:
+                    result[i] = None
+                else:
+                    result[i] += stats[i]
+        return tuple(result)
+
+    def get_facets(self, queryid):
+        result = {}
+        for manager in self.managers:
+            facets = manager.get_facets(queryid)
+            if facets is None:
+                return None
+            for fieldname, valfreqs in facets:
+                fieldfreqs = result.setdefault(fieldname, {})
+                for value, freq in valfreqs:
+                    fieldfreqs[value] = fieldfreqs.get(value, 0) + freq
+        return generic.sort_facets(result)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for manager in self.managers:
+            manager.close()
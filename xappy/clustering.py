@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""clustering.py: k-means clustering of documents using numpy.
+
+Documents are represented by vectors of a fixed number of dimensions: either
+term vectors, with each term hashed to a dimension, or the bits of sketches
+stored by the SKETCH field action.  The vectors are normalised, and
+clustered by spherical k-means, which takes time linear in the number of
+documents (for a fixed number of clusters and iterations).
+
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+import struct
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import errors
+import sketch
+
+# The default number of dimensions to hash terms into.
+DEFAULT_DIMENSIONS = 1024
+
+# The default maximum number of iterations of k-means.
+DEFAULT_ITERATIONS = 10
+
+def _check_numpy():
+    if numpy is None:
+        raise errors.SearchError("numpy is required for k-means clustering")
+
+def _feature_dimension(feature, dims):
+    """Get the dimension which a feature is hashed to.
+
+    """
+    return struct.unpack('>I', md5(feature).digest()[:4])[0] % dims
+
+def hashed_vectors(docs, dims=DEFAULT_DIMENSIONS):
+    """Build a matrix of hashed feature vectors.
+
+    `docs` is a sequence holding, for each document, a sequence of (feature,
+    weight) pairs.  Returns a numpy array with a row for each document.
+
+    """
+    _check_numpy()
+    vectors = numpy.zeros((len(docs), dims), dtype=numpy.float32)
+    dimcache = {}
+    for row, features in enumerate(docs):
+        vector = vectors[row]
+        for feature, weight in features:
+            dim = dimcache.get(feature)
+            if dim is None:
+                dim = _feature_dimension(feature, dims)
+                dimcache[feature] = dim
+            vector[dim] += weight
+    return vectors
+
+def sketch_vectors(docs):
+    """Build a matrix of vectors from sketches.
+
+    `docs` is a sequence holding, for each document, a sequence of sketches
+    (or None, for missing sketches).  Each bit of each sketch is represented
+    by a dimension, which is 1 if the bit is set, -1 if it isn't, or 0 if the
+    sketch is missing, so the dot product of two vectors is related to the
+    number of bits which differ.
+
+    """
+    _check_numpy()
+    if len(docs) == 0:
+        return numpy.zeros((0, 0), dtype=numpy.float32)
+    nsketches = len(docs[0])
+    bits = sketch.SKETCH_BITS
+    masks = numpy.array([1 << i for i in xrange(bits)], dtype=numpy.uint64)
+    vectors = numpy.zeros((len(docs), nsketches * bits), dtype=numpy.float32)
+    for row, sketches in enumerate(docs):
+        for i, value in enumerate(sketches):
+            if value is None:
+                continue
+            isset = (numpy.uint64(value) & masks) != 0
+            vectors[row, i * bits:(i + 1) * bits] = \
+                numpy.where(isset, 1.0, -1.0)
+    return vectors
+
+def _normalise(vectors):
+    """Normalise the rows of a matrix to unit length, in place.
+
+    Rows of all zeros are left unchanged.
+
+    """
+    norms = numpy.sqrt((vectors * vectors).sum(axis=1))
+    norms[norms == 0] = 1.0
+    vectors /= norms[:, numpy.newaxis]
+    return vectors
+
+def kmeans(vectors, num_clusters, maxiters=DEFAULT_ITERATIONS):
+    """Cluster a matrix of vectors with spherical k-means.
+
+    The initial centres are chosen by farthest-first traversal, starting from
+    the first vector, so the result is deterministic (and the top ranked
+    documents seed the clusters).  Clusters are then refined until no
+    assignments change, or `maxiters` iterations have been performed.
+
+    Returns a list holding the cluster number of each vector.
+
+    """
+    _check_numpy()
+    count = len(vectors)
+    if count == 0:
+        return []
+    vectors = _normalise(numpy.array(vectors, dtype=numpy.float32))
+    num_clusters = max(1, min(num_clusters, count))
+
+    # Choose the initial centres.
+    centres = [0]
+    maxsims = numpy.dot(vectors, vectors[0])
+    while len(centres) < num_clusters:
+        nextcentre = int(numpy.argmin(maxsims))
+        if maxsims[nextcentre] >= 1.0 - 1e-6:
+            # All the remaining vectors are identical to a centre.
+            break
+        centres.append(nextcentre)
+        maxsims = numpy.maximum(maxsims, numpy.dot(vectors,
+                                                   vectors[nextcentre]))
+    centres = vectors[centres]
+
+    assignments = numpy.argmax(numpy.dot(vectors, centres.T), axis=1)
+    for iteration in xrange(maxiters):
+        for cluster in xrange(len(centres)):
+            members = vectors[assignments == cluster]
+            if len(members) != 0:
+                centres[cluster] = members.sum(axis=0)
+        centres = _normalise(centres)
+        newassignments = numpy.argmax(numpy.dot(vectors, centres.T), axis=1)
+        if numpy.all(newassignments == assignments):
+            break
+        assignments = newassignments
+    return [int(cluster) for cluster in assignments]
+
+def term_weight(wdf, termfreq, doccount):
+    """Get the weight of a term in a document's vector.
+
+    This is a standard tf-idf weight.
+
+    """
+    if wdf <= 0 or termfreq <= 0:
+        return 0.0
+    return (1.0 + math.log(wdf)) * math.log(1.0 + float(doccount) / termfreq)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""cursor.py: Encoding of the cursors used by SearchConnection.search_after().
+
+A cursor records the position in a result set after the last result
+returned.  Cursors are opaque strings, which are safe to pass to (and accept
+from) untrusted clients: they are decoded without evaluating or unpickling
+anything.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import base64
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+import errors
+
+# The version of the cursor format.
+_VERSION = '1'
+
+class CursorState(object):
+    """The position recorded by a cursor.
+
+    - `offset` is the number of results returned before the cursor.
+    - `keys` is a list of the values of the sort keys of the last result
+      returned (with an empty string for a missing value), or None if the
+      search resumes from `offset` (as it does if the results aren't sorted
+      by a value).
+    - `docid` is the xapian document ID of the last result returned, which
+      orders results with equal sort keys.  This is None if `keys` is None.
+
+    """
+    def __init__(self, offset=0, keys=None, docid=None):
+        self.offset = offset
+        self.keys = keys
+        self.docid = docid
+
+def spec_hash(*params):
+    """Get a hash of the parameters of a search.
+
+    This is stored in cursors, so that a cursor used with a different search
+    can be detected.
+
+    """
+    return md5(repr(params)).hexdigest()[:16]
+
+def _pack(items):
+    return ''.join(['%d:%s' % (len(item), item) for item in items])
+
+def _unpack(data):
+    items = []
+    pos = 0
+    while pos < len(data):
+        colon = data.index(':', pos)
+        length = int(data[pos:colon])
+        if length < 0 or colon + 1 + length > len(data):
+            raise ValueError("Bad item length")
+        items.append(data[colon + 1:colon + 1 + length])
+        pos = colon + 1 + length
+    return items
+
+def encode(state, spec):
+    """Encode a CursorState as a cursor string.
+
+    `spec` is the hash of the parameters of the search, from spec_hash().
+
+    """
+    items = [_VERSION, spec, str(state.offset)]
+    if state.keys is None:
+        items.append('n')
+    else:
+        items.append(str(state.docid))
+        items.extend(state.keys)
+    return base64.urlsafe_b64encode(_pack(items))
+
+def decode(cursor, spec):
+    """Decode a cursor string to a CursorState.
+
+    Raises a SearchError if the cursor is invalid, or was returned by a search
+    with different parameters.
+
+    """
+    try:
+        items = _unpack(base64.urlsafe_b64decode(str(cursor)))
+        if len(items) < 4 or items[0] != _VERSION:
+            raise ValueError("Bad cursor format")
+        if items[1] != spec:
+            raise errors.SearchError("Cursor was returned by a different "
+                                     "search")
+        offset = int(items[2])
+        if items[3] == 'n':
+            if len(items) != 4:
+                raise ValueError("Bad cursor format")
+            keys, docid = None, None
+        else:
+            keys, docid = items[4:], int(items[3])
+    except (TypeError, ValueError), e:
+        raise errors.SearchError("Invalid cursor: %s" % e)
+    return CursorState(offset, keys, docid)
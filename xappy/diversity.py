@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""diversity.py: Reorder ranked items to diversify them by a key.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import heapq
+
+def diversify(keys, relevances, utilities=None, default_utility=0.01):
+    """Generate the positions of items, in an order diversified by key.
+
+    `keys` is a sequence holding the key (eg, the category) of each item, in
+    the original order of the items, and `relevances` is a sequence holding
+    the probability that each item is relevant (between 0 and 1).
+    `utilities` is a dictionary holding the initial utility of each key
+    (the probability that items with that key are wanted): keys which aren't
+    in it have a utility of `default_utility`.
+
+    At each step, the item with the highest score is picked from the first
+    remaining item for each key, where the score is the relevance of the item
+    multiplied by the utility of its key (ties are broken by picking the
+    earliest item).  The utility of the key of the picked item is then
+    multiplied by the probability that the item is not relevant.
+
+    The positions are generated lazily, so only the work needed for the
+    positions which are read is done: each position costs O(log(number of
+    keys)).
+
+    """
+    if utilities is None:
+        utilities = {}
+    else:
+        utilities = dict(utilities)
+
+    # The positions of the items with each key, in order.
+    bins = {}
+    for pos, key in enumerate(keys):
+        try:
+            bins[key].append(pos)
+        except KeyError:
+            bins[key] = [pos]
+
+    # A heap holding the next item for each key: the heap is ordered by
+    # negated score, then position.  The index of the next item in the bin
+    # for each key is kept in `nextitem`.
+    heap = []
+    nextitem = {}
+    for key, positions in bins.iteritems():
+        pos = positions[0]
+        score = relevances[pos] * utilities.get(key, default_utility)
+        heap.append((-score, pos, key))
+        nextitem[key] = 1
+    heapq.heapify(heap)
+
+    while len(heap) != 0:
+        negscore, pos, key = heapq.heappop(heap)
+        yield pos
+
+        utility = (1.0 - relevances[pos]) * utilities.get(key, default_utility)
+        utilities[key] = utility
+        positions = bins[key]
+        index = nextitem[key]
+        if index < len(positions):
+            nextitem[key] = index + 1
+            pos = positions[index]
+            heapq.heappush(heap, (-(relevances[pos] * utility), pos, key))
+
+class LazyOrder(object):
+    """A sequence of a known length, whose items are read from an iterator.
+
+    Items are only read from the iterator when they (or items after them) are
+    accessed.
+
+    """
+    def __init__(self, iterator, length):
+        self._iterator = iterator
+        self._length = length
+        self._items = []
+
+    def _fill(self, count):
+        """Read items from the iterator until `count` items have been read.
+
+        """
+        items = self._items
+        iterator = self._iterator
+        while len(items) < count:
+            items.append(iterator.next())
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("LazyOrder index out of range")
+        self._fill(index + 1)
+        return self._items[index]
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield self[index]
@@ -46,6 +46,18 @@ class SearchError(SearchEngineError):
 
     """
 
+class SearchTimeoutError(SearchError):
+    r"""Class used to report that a search request was not completed before
+    its deadline.
+
+    """
+
+class SearchCancelledError(SearchError):
+    r"""Class used to report that a search request was cancelled before it
+    was performed.
+
+    """
+
 
 class XapianError(SearchEngineError):
     r"""Base class for exceptions thrown by the xapian.
@@ -27,6 +27,7 @@ import collections
 import _checkxapian
 import errors
 import fields
+import geocells
 import marshall
 import xapian
 try:
@@ -34,6 +35,7 @@ try:
 except ImportError:
     pass
 import parsedate
+import sketch
 
 def _act_store_content(fieldname, doc, field, context, link_associations=True):
     """Perform the STORE_CONTENT action.
@@ -117,18 +119,58 @@ def convert_range_to_term(prefix, begin, end):
     end = xapian.sortable_serialise(end)
     return prefix + "%d" % len(begin) + begin + end
 
+# Number of bits in the keys used for automatic range terms: this is enough
+# to hold any value returned by xapian.sortable_serialise(), which is at most
+# 9 bytes long.
+TRIE_KEY_BITS = 72
+
+def convert_value_to_trie_key(value):
+    """Convert a float to an integer key for automatic range terms.
+
+    The keys are in the same order as the values.
+
+    """
+    value = xapian.sortable_serialise(value)
+    value += '\x00' * (TRIE_KEY_BITS // 8 - len(value))
+    return long(value.encode('hex'), 16)
+
+def convert_trie_cell_to_term(prefix, shift, cell):
+    """Get the term for a cell of the automatic range terms.
+
+    The cell holds all keys `k` for which `k >> shift == cell`.
+
+    """
+    return prefix + "t%d:%x" % (shift, cell)
+
+def get_trie_shifts(precision_step):
+    """Get the shifts of the cells for which automatic range terms are stored.
+
+    """
+    return range(precision_step, TRIE_KEY_BITS, precision_step)
+
 def _add_range_terms_for_value(doc, value, ranges, prefix):
     for (begin, end) in ranges:
         if begin <= value <= end:
             doc._doc.add_term(convert_range_to_term(prefix, begin, end), 0)
 
-def _range_accel_act(doc, val, ranges=None, _range_accel_prefix=None):
+def _add_trie_terms_for_value(doc, value, precision_step, prefix):
+    key = convert_value_to_trie_key(value)
+    for shift in get_trie_shifts(precision_step):
+        doc._doc.add_term(convert_trie_cell_to_term(prefix, shift,
+                                                    key >> shift), 0)
+
+def _range_accel_act(doc, val, ranges=None, _range_accel_prefix=None,
+                     precision_step=None):
     if ranges:
         assert _range_accel_prefix
         val = float(val)
-        _add_range_terms_for_value(doc, val, ranges, _range_accel_prefix)
+        if ranges == 'auto':
+            _add_trie_terms_for_value(doc, val, precision_step,
+                                      _range_accel_prefix)
+        else:
+            _add_range_terms_for_value(doc, val, ranges, _range_accel_prefix)
 
-def _act_facet(fieldname, doc, field, context, type=None, ranges=None, _range_accel_prefix=None):
+def _act_facet(fieldname, doc, field, context, type=None, ranges=None, _range_accel_prefix=None, precision_step=None):
     """Perform the FACET action.
 
     """
@@ -154,7 +196,8 @@ def _act_facet(fieldname, doc, field, context, type=None, ranges=None, _range_ac
             add_field_assoc(doc, fieldname, context.currfield_assoc,
                             value=(marshalled_value, 'facet'),
                             weight=field.weight)
-        _range_accel_act(doc, field.value, ranges, _range_accel_prefix)
+        _range_accel_act(doc, field.value, ranges, _range_accel_prefix,
+                         precision_step)
 
 
 def _act_weight(fieldname, doc, field, context, type=None):
@@ -165,7 +208,8 @@ def _act_weight(fieldname, doc, field, context, type=None):
     value = xapian.sortable_serialise(value)
     doc.add_value(fieldname, value, 'weight')
 
-def _act_geolocation(fieldname, doc, field, context):
+def _act_geolocation(fieldname, doc, field, context, cells=None,
+                     _cell_prefix=None):
     """Perform the GEOLOCATION action.
 
     """
@@ -175,6 +219,12 @@ def _act_geolocation(fieldname, doc, field, context):
         coord = xapian.LatLongCoord.parse_latlong(field.value)
         coords.insert(coord)
         doc.add_value(fieldname, coords.serialise(), 'loc')
+        if cells:
+            assert _cell_prefix
+            doc._doc.add_term(geocells.marker_term(_cell_prefix), 0)
+            for term in geocells.point_terms(_cell_prefix, coord.latitude,
+                                             coord.longitude):
+                doc._doc.add_term(term, 0)
 
 def _get_imgterms(conn, fieldname):
     """Get an ImgTerms object for a given field.
@@ -214,6 +264,29 @@ def _act_imgseek(fieldname, doc, field, context, terms=True, buckets=None):
             imgsigs.insert(imgsig)
             doc.add_value(fieldname, imgsigs.serialise(), 'imgseek')
 
+def _act_sketch(fieldname, doc, field, context, language=None):
+    """Perform the SKETCH action.
+
+    The counts used to build the sketch are kept in the context, so that the
+    sketch covers all the instances of the field in the document.
+
+    """
+    termgen = xapian.TermGenerator()
+    if language is not None:
+        termgen.set_stemmer(xapian.Stem(language))
+    tmpdoc = xapian.Document()
+    termgen.set_document(tmpdoc)
+    termgen.index_text_without_positions(field.value)
+
+    counts = context.sketch_counts.get(fieldname)
+    if counts is None:
+        counts = [0] * sketch.SKETCH_BITS
+        context.sketch_counts[fieldname] = counts
+    sketch.add_terms(counts, ((item.term, item.wdf)
+                              for item in tmpdoc.termlist()))
+    doc.add_value(fieldname, sketch.serialise(sketch.make_sketch(counts)),
+                  'sketch')
+
 def _act_index_freetext(fieldname, doc, field, context, weight=1,
                         language=None, stop=None, spell=False,
                         nopos=False,
@@ -343,7 +416,7 @@ class SortableMarshaller(object):
                             (sorttype, fieldname))
 
 
-def _act_sort_and_collapse(fieldname, doc, field, context, type=None, ranges=None, _range_accel_prefix=None):
+def _act_sort_and_collapse(fieldname, doc, field, context, type=None, ranges=None, _range_accel_prefix=None, precision_step=None):
     """Perform the SORTABLE action.
 
     """
@@ -355,7 +428,8 @@ def _act_sort_and_collapse(fieldname, doc, field, context, type=None, ranges=Non
                         value=(marshalled_value, 'collsort'),
                         weight=field.weight)
     doc.add_value(fieldname, marshalled_value, 'collsort')
-    _range_accel_act(doc, field.value, ranges, _range_accel_prefix)
+    _range_accel_act(doc, field.value, ranges, _range_accel_prefix,
+                     precision_step)
 
 def _act_colour(fieldname, doc, field, context):
     doc.add_term(fieldname, field.value, 
@@ -380,6 +454,7 @@ class ActionContext(object):
         self.current_position = 0
         self.currfield_assoc = None
         self.currfield_group = None
+        self.sketch_counts = {}
 
 class FieldActions(object):
     """An object describing the actions to be performed on a field.
@@ -437,7 +512,18 @@ class FieldActions(object):
           YYYY-MM-DD).
 
       - 'ranges' is only valid if 'type' is 'float', in which case it
-        should be a list of float pairs.
+        should be a list of float pairs.  Terms are stored for each of these
+        ranges which a value falls in, which are used to speed up range
+        searches.  Alternatively, 'ranges' may be 'auto', in which case
+        terms are stored for ranges of several sizes, generated
+        automatically, such that any range search can be performed using a
+        small number of these terms (and a check on the values of documents
+        near the ends of the range).
+      - 'precision_step' is only valid if 'ranges' is 'auto'.  It controls
+        the sizes of the automatically generated ranges: each range is
+        divided into 2 ** precision_step ranges at the next smaller size.
+        Smaller values mean that more terms are stored for each document,
+        but fewer terms are needed for each range search.  The default is 4.
 
     - `COLLAPSE`: index the content of the field such that it can be used to
       "collapse" result sets, such that only the highest result with each value
@@ -454,13 +540,25 @@ class FieldActions(object):
         - 'string' - the facet values are exact binary strings.
         - 'float' - the facet values are floating point numbers.
 
+      - 'ranges' and 'precision_step' may be supplied for 'float' facets, as
+        for SORTABLE.
+
     - `WEIGHT`: the field represents a document weight, which can be used at
       search time as part of the ranking formula.  The values in the field
       should be (string representations of) floating point numbers.
 
     - `GEOLOCATION`: index geolocation information.  Fields supplied should be
       latitude-longitude values, and will be searchable by distance from the
-      point.
+      point.  The following parameter may be supplied:
+
+      - 'cells', if True, causes terms to be indexed for the cells of a
+        latitude-longitude grid which contain each location, at several
+        resolutions.  query_distance() uses these terms when a maximum range
+        is given, so that only documents near the centre are examined.  The
+        terms are only used once every document with a location in the
+        field has them: if 'cells' is set for a field of an index which
+        already holds documents, the documents must be reindexed (replaced)
+        before searches are accelerated.
 
     - `IMGSEEK`: Index an image for similarity searching. Fields
       supplied must be a url that references the image data. The image
@@ -479,6 +577,14 @@ class FieldActions(object):
       normalised so that they sum to (approximately) 1000, so that
       weights across different documents can be meaningfully compared.
 
+    - `SKETCH`: store a sketch (a 64 bit SimHash) of the terms in the field in
+      a value slot.  The sketch is used by the similarity-based reordering of
+      search results, instead of comparing the termlists of the documents.
+      One optional parameter may be supplied:
+
+      - 'language' is the language to use when splitting the field into terms,
+        as for INDEX_FREETEXT.
+
     """
 
     # See the class docstring for the meanings of the following constants.
@@ -492,6 +598,7 @@ class FieldActions(object):
     GEOLOCATION = 9
     IMGSEEK = 10
     COLOUR = 11
+    SKETCH = 12
 
     # Sorting and collapsing store the data in a value, but the format depends
     # on the sort type.  Easiest way to implement is to treat them as the same
@@ -529,6 +636,7 @@ class FieldActions(object):
                           FieldActions.GEOLOCATION,
                           FieldActions.IMGSEEK,
                           FieldActions.COLOUR,
+                          FieldActions.SKETCH,
                          ):
             raise errors.IndexerError("Unknown field action: %r" % action)
 
@@ -553,13 +661,29 @@ class FieldActions(object):
                                    "as exact text: cannot mark for indexing "
                                    "as free text as well" % self._fieldname)
 
+        if 'precision_step' in kwargs and kwargs.get('ranges') != 'auto':
+            raise errors.IndexerError("precision_step for field %r is only "
+                                      "valid with ranges='auto'" %
+                                      self._fieldname)
+
         if (action in (FieldActions.SORTABLE,
                        FieldActions.COLLAPSE,
                        FieldActions.FACET) and
             kwargs.get('type') == 'float' and 'ranges' in kwargs):
 
-            kwargs['ranges'] = [(float(begin), float(end))
-                                for (begin, end) in kwargs['ranges']]
+            if kwargs['ranges'] == 'auto':
+                try:
+                    precision_step = int(kwargs.get('precision_step', 4))
+                except ValueError:
+                    precision_step = 0
+                if not 1 <= precision_step <= 16:
+                    raise errors.IndexerError("precision_step for field %r "
+                                              "must be an integer between "
+                                              "1 and 16" % self._fieldname)
+                kwargs['precision_step'] = precision_step
+            else:
+                kwargs['ranges'] = [(float(begin), float(end))
+                                    for (begin, end) in kwargs['ranges']]
 
             if action == FieldActions.FACET:
                 oldactions = self._actions.get(action)
@@ -570,7 +694,9 @@ class FieldActions(object):
                 for oldaction in oldactions:
                     old_accel_prefix = oldaction.get('_range_accel_prefix')
                     if old_accel_prefix is not None:
-                        if oldaction.get('ranges') == kwargs['ranges']:
+                        if oldaction.get('ranges') == kwargs['ranges'] and \
+                           oldaction.get('precision_step') == \
+                           kwargs.get('precision_step'):
                             kwargs['_range_accel_prefix'] = old_accel_prefix
 
         # Fields cannot be indexed as more than one type for "SORTABLE": to
@@ -636,6 +762,23 @@ class FieldActions(object):
                 for purpose in purposes:
                     field_mappings.add_slot(self._fieldname, purpose, slotnum=slotnum)
 
+        if action == FieldActions.GEOLOCATION:
+            # Only one GEOLOCATION action is kept for a field, since each
+            # action stores the location; an action with cell terms replaces
+            # one without.
+            oldactions = self._actions.get(action, ())
+            if kwargs.get('cells'):
+                for oldaction in oldactions:
+                    if '_cell_prefix' in oldaction:
+                        return
+                kwargs['cells'] = True
+                kwargs['_cell_prefix'] = field_mappings._genPrefix()
+                self._actions[action] = []
+            else:
+                kwargs.pop('cells', None)
+                if len(oldactions) != 0:
+                    return
+
         # Make an entry for the action
         if action not in self._actions:
             self._actions[action] = []
@@ -685,12 +828,13 @@ class FieldActions(object):
         INDEX_EXACT: ('INDEX_EXACT', (), _act_index_exact, {'prefix': True}, ),
         INDEX_FREETEXT: ('INDEX_FREETEXT', ('weight', 'language', 'stop', 'spell', 'nopos', 'allow_field_specific', 'search_by_default', ),
             _act_index_freetext, {'prefix': True, }, ),
-        SORTABLE: ('SORTABLE', ('type', 'ranges'), None, {'slot': 'collsort',}, ),
+        SORTABLE: ('SORTABLE', ('type', 'ranges', 'precision_step'), None, {'slot': 'collsort',}, ),
         COLLAPSE: ('COLLAPSE', (), None, {'slot': 'collsort',}, ),
-        FACET: ('FACET', ('type', 'ranges'), _act_facet, {'prefix': True, 'slot': 'facet',}, ),
+        FACET: ('FACET', ('type', 'ranges', 'precision_step'), _act_facet, {'prefix': True, 'slot': 'facet',}, ),
         WEIGHT: ('WEIGHT', (), _act_weight, {'slot': 'weight',}, ),
-        GEOLOCATION: ('GEOLOCATION', (), _act_geolocation, {'slot': 'loc'}, ),
+        GEOLOCATION: ('GEOLOCATION', ('cells', ), _act_geolocation, {'slot': 'loc'}, ),
         IMGSEEK: ('IMGSEEK', ('terms', 'buckets'), _act_imgseek, {'prefix': True, 'slot': 'imgseek',},),
+        SKETCH: ('SKETCH', ('language', ), _act_sketch, {'slot': 'sketch',}, ),
         SORT_AND_COLLAPSE: ('SORT_AND_COLLAPSE', ('type', ), _act_sort_and_collapse, {'slot': 'collsort',}, ),
     }
 
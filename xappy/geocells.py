@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""geocells.py: Grid cells for accelerating geolocation searches.
+
+The surface of the earth is divided into a grid of latitude and longitude
+cells at several levels: at level `L`, there are 2**L rows and 2**L columns
+of cells, so each cell covers 180 / 2**L degrees of latitude and 360 / 2**L
+degrees of longitude.  A term is indexed for the cell containing each
+location at each of the levels in CELL_LEVELS, so that the documents near a
+point can be found by searching for the cells around it.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+
+# The levels of the grid at which cell terms are indexed.  The cells at the
+# finest level are roughly 20 metres high.
+CELL_LEVELS = range(2, 21, 2)
+
+# The radius of the earth, in metres.  This is slightly smaller than the
+# radius used by default by xapian's GreatCircleMetric, so that the cells
+# found for a distance always include all the points within that distance.
+EARTH_RADIUS = 6371000.0
+
+# The maximum number of cells to use to cover an area.
+MAX_COVER_CELLS = 32
+
+def marker_term(prefix):
+    """Get the term indexed for every document which has cell terms.
+
+    Comparing its frequency with the number of documents with a location shows
+    whether all the located documents have cell terms.
+
+    """
+    return prefix
+
+def cell_term(prefix, level, row, col):
+    """Get the term for a cell.
+
+    """
+    return prefix + "%d:%x:%x" % (level, row, col)
+
+def _row(level, lat):
+    """Get the row of the cell holding a latitude.
+
+    """
+    rows = 1 << level
+    row = int(math.floor((lat + 90.0) * rows / 180.0))
+    return min(max(row, 0), rows - 1)
+
+def _col(level, lon):
+    """Get the column of the cell holding a longitude.
+
+    Columns wrap around at the antimeridian, so any longitude is allowed.
+
+    """
+    cols = 1 << level
+    return int(math.floor((lon + 180.0) * cols / 360.0)) % cols
+
+def point_terms(prefix, lat, lon):
+    """Get the cell terms to index for a location.
+
+    """
+    return [cell_term(prefix, level, _row(level, lat), _col(level, lon))
+            for level in CELL_LEVELS]
+
+def _bounds(lat, lon, radius):
+    """Get the bounds of the area within a distance of a point.
+
+    Returns (lat_lo, lat_hi, lon_lo, lon_hi): the longitudes may be outside
+    the range -180 to 180 if the area crosses the antimeridian, and are None
+    if the area covers all longitudes (ie, if it includes a pole).
+
+    """
+    angle = radius / EARTH_RADIUS
+    dlat = math.degrees(angle)
+    lat_lo = lat - dlat
+    lat_hi = lat + dlat
+    if lat_lo <= -90.0 or lat_hi >= 90.0 or angle >= math.pi / 2:
+        return max(lat_lo, -90.0), min(lat_hi, 90.0), None, None
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angle) /
+                                           math.cos(math.radians(lat)))))
+    return lat_lo, lat_hi, lon - dlon, lon + dlon
+
+def _cells_in_bounds(level, lat_lo, lat_hi, lon_lo, lon_hi):
+    """Get the (row, col) pairs of the cells covering an area.
+
+    """
+    cols = 1 << level
+    rows = range(_row(level, lat_lo), _row(level, lat_hi) + 1)
+    if lon_lo is None:
+        colnums = range(cols)
+    else:
+        col_lo = int(math.floor((lon_lo + 180.0) * cols / 360.0))
+        col_hi = int(math.floor((lon_hi + 180.0) * cols / 360.0))
+        if col_hi - col_lo + 1 >= cols:
+            colnums = range(cols)
+        else:
+            colnums = [col % cols for col in xrange(col_lo, col_hi + 1)]
+    return [(row, col) for row in rows for col in colnums]
+
+def covering_cells(lat, lon, radius, maxcells=MAX_COVER_CELLS):
+    """Get the cells covering the area within a distance of a point.
+
+    `radius` is the distance in metres.  The cells are taken from the finest
+    level at which no more than `maxcells` cells are needed.
+
+    Returns a tuple (level, cells), where cells is a list of (row, col)
+    pairs.  Returns None if the area covers the whole earth.
+
+    """
+    if radius >= math.pi * EARTH_RADIUS:
+        return None
+    lat_lo, lat_hi, lon_lo, lon_hi = _bounds(lat, lon, radius)
+    for level in reversed(CELL_LEVELS):
+        # Estimate the number of cells before listing them, to avoid listing
+        # huge numbers of cells at the finer levels.
+        size = 1 << level
+        nrows = (lat_hi - lat_lo) * size / 180.0 + 2
+        if lon_lo is None:
+            ncols = size
+        else:
+            ncols = (lon_hi - lon_lo) * size / 360.0 + 2
+        if nrows * ncols > maxcells * 4 and level != CELL_LEVELS[0]:
+            continue
+        cells = _cells_in_bounds(level, lat_lo, lat_hi, lon_lo, lon_hi)
+        if len(cells) <= maxcells or level == CELL_LEVELS[0]:
+            return level, cells
+    return None
+
+def covering_terms(prefix, centres, radius, maxcells=MAX_COVER_CELLS):
+    """Get the cell terms covering the area within a distance of some points.
+
+    `centres` is a sequence of (latitude, longitude) pairs.  Returns None if
+    the area covers the whole earth.
+
+    """
+    terms = set()
+    for lat, lon in centres:
+        cover = covering_cells(lat, lon, radius, maxcells)
+        if cover is None:
+            return None
+        level, cells = cover
+        for row, col in cells:
+            terms.add(cell_term(prefix, level, row, col))
+    return sorted(terms)
@@ -51,6 +51,41 @@ def _allocate_id(index, next_docid):
             break
     return idstr, next_docid
 
+def _get_term_prefix(term):
+    """Get the prefix of a term (ie, the leading upper case characters).
+
+    """
+    pos = 0
+    for char in term:
+        if not char.isupper():
+            break
+        pos += 1
+    return term[:pos]
+
+class _ExpandDecider(xapian.ExpandDecider):
+    """An expand decider which accepts only terms with the given prefixes.
+
+    """
+    def __init__(self, prefixes):
+        xapian.ExpandDecider.__init__(self)
+        self._prefixes = prefixes
+
+    def __call__(self, term):
+        return _get_term_prefix(term) in self._prefixes
+
+def _get_next_docid(index, next_docid):
+    """Get the next docid to allocate.
+
+    `next_docid` is the value read from the configuration: the value stored
+    separately is used instead if it is higher (which it will be if IDs have
+    been allocated since the configuration was last changed).
+
+    """
+    stored = index.get_metadata('_xappy_next_docid')
+    if stored:
+        next_docid = max(next_docid, int(stored))
+    return next_docid
+
 class IndexerConnection(object):
     """A connection to the search engine for indexing.
 
@@ -109,6 +144,7 @@ class IndexerConnection(object):
         self._next_docid = 0
         self._imgterms_cache = {}
         self._config_modified = False
+        self._next_docid_modified = False
         try:
             self._load_config()
         except:
@@ -117,6 +153,15 @@ class IndexerConnection(object):
             self._index = None
             raise
 
+        # The number of top terms to store for each document (or None if top
+        # terms have never been stored), and the IDs of the documents whose
+        # top terms need to be updated at the next flush.
+        self._top_terms_count = None
+        count = self._index.get_metadata('_xappy_top_terms_count')
+        if count:
+            self._top_terms_count = int(count)
+        self._top_terms_pending = set()
+
         # Set management of the memory used.
         # This can be removed once Xapian implements this itself.
         self._mem_buffered = 0
@@ -167,6 +212,89 @@ class IndexerConnection(object):
 
         self._max_mem = max_mem
 
+    def set_top_terms_count(self, count):
+        """Set the number of "top" terms to store for each document.
+
+        If `count` is greater than 0, then whenever documents are added or
+        replaced, the `count` most significant terms for each document (as
+        returned by SearchConnection.significant_terms(), over all the fields
+        indexed for freetext searching) are calculated when changes are
+        flushed, and stored alongside the database.  query_similar() and
+        significant_terms() then use these stored terms for single documents,
+        instead of performing an expand, when they ask for no more terms than
+        are available.
+
+        Note that the stored terms are calculated using the term statistics
+        at the time the document was indexed, so may differ slightly from
+        those which an expand would return later.
+
+        Setting `count` to 0 (the default) stops terms being calculated for
+        new documents; the terms stored for documents which are replaced or
+        deleted are removed, but other stored terms will still be used.
+
+        """
+        if self._index is None:
+            raise errors.IndexerError("IndexerConnection has been closed")
+        count = int(count)
+        if count < 0:
+            raise errors.IndexerError("Top terms count must not be negative")
+        self._top_terms_count = count
+        self._index.set_metadata('_xappy_top_terms_count', str(count))
+
+    def _store_top_terms(self):
+        """Store the top terms for the documents changed since the last flush.
+
+        """
+        prefixes = {}
+        for field in self._field_actions:
+            actions = self._field_actions[field]._actions
+            if FieldActions.INDEX_FREETEXT in actions:
+                prefixes[self._field_mappings.get_prefix(field)] = field
+        decider = _ExpandDecider(prefixes)
+        enq = xapian.Enquire(self._index)
+        for id in self._top_terms_pending:
+            terms = ()
+            xapdoc, xapid = self._get_xapdoc(id)
+            if xapid is not None and self._top_terms_count > 0:
+                rset = xapian.RSet()
+                rset.add_document(xapid)
+                eset = enq.get_eset(self._top_terms_count, rset, 0, 1.0,
+                                    decider)
+                terms = [item.term for item in eset]
+            if terms:
+                self._index.set_metadata('_xappy_top_terms:' + id,
+                                         cPickle.dumps(terms, 2))
+            else:
+                self._remove_top_terms(id)
+        self._top_terms_pending = set()
+
+    def _remove_top_terms(self, id):
+        """Remove the stored top terms for a document, if there are any.
+
+        """
+        key = '_xappy_top_terms:' + id
+        if self._index.get_metadata(key):
+            # Setting the metadata to an empty string removes the entry.
+            self._index.set_metadata(key, '')
+
+    def _get_id_for_xapid(self, xapid):
+        """Get the xappy document ID of the document with a given xapid.
+
+        Returns None if there is no such document.
+
+        """
+        try:
+            termlist = self._index.get_document(int(xapid)).termlist()
+        except xapian.DocNotFoundError:
+            return None
+        try:
+            term = termlist.skip_to('Q').term
+        except StopIteration:
+            return None
+        if not term.startswith('Q'):
+            return None
+        return term[1:]
+
     def _store_config(self):
         """Store the configuration for the database.
 
@@ -186,9 +314,22 @@ class IndexerConnection(object):
                                      self._next_docid,
                                     ), 2)
         self._index.set_metadata('_xappy_config', config_str)
+        self._store_next_docid()
 
         self._config_modified = False
 
+    def _store_next_docid(self):
+        """Store the next docid to allocate.
+
+        This is stored separately from the rest of the configuration (as well
+        as in it), so that allocating IDs doesn't change the stored
+        configuration; this allows search connections to avoid parsing the
+        configuration again when only the next docid has changed.
+
+        """
+        self._index.set_metadata('_xappy_next_docid', str(self._next_docid))
+        self._next_docid_modified = False
+
     def _load_config(self):
         """Load the configuration for the database.
 
@@ -197,6 +338,7 @@ class IndexerConnection(object):
 
         config_str = self._index.get_metadata('_xappy_config')
         if len(config_str) == 0:
+            self._next_docid = _get_next_docid(self._index, self._next_docid)
             return
 
         try:
@@ -223,8 +365,10 @@ class IndexerConnection(object):
             self._facet_hierarchy = {}
             self._facet_query_table = {}
         self._field_mappings = fieldmappings.FieldMappings(mappings)
+        self._next_docid = _get_next_docid(self._index, self._next_docid)
 
         self._config_modified = False
+        self._next_docid_modified = False
 
         # Open the cachemanager if there is an internal one.
         if self._index.get_metadata('_xappy_hasintcache'):
@@ -353,7 +497,7 @@ class IndexerConnection(object):
         if orig_id is None:
             id, self._next_docid = _allocate_id(self._index,
                                                 self._next_docid)
-            self._config_modified = True
+            self._next_docid_modified = True
             document.id = id
         else:
             id = orig_id
@@ -363,6 +507,8 @@ class IndexerConnection(object):
         # Add the document.
         xapdoc = document.prepare()
         self._index.add_document(xapdoc)
+        if self._top_terms_count:
+            self._top_terms_pending.add(id)
 
         if self._max_mem is not None:
             self._mem_buffered += self._get_bytes_used_by_doc_terms(xapdoc)
@@ -402,7 +548,7 @@ class IndexerConnection(object):
             else:
                 id, self._next_docid = _allocate_id(self._index,
                                                     self._next_docid)
-                self._config_modified = True
+                self._next_docid_modified = True
                 document.id = id
 
         # Process the document if we havn't already.
@@ -426,6 +572,21 @@ class IndexerConnection(object):
                             continue
                         xapdoc.add_value(value.num, value.value)
 
+        if self._top_terms_count is not None:
+            ids = [id]
+            if xapid is not None:
+                oldid = self._get_id_for_xapid(xapid)
+                if oldid is not None:
+                    ids.append(oldid)
+            for changedid in ids:
+                if self._top_terms_count:
+                    self._top_terms_pending.add(changedid)
+                else:
+                    # No terms are calculated, so just remove any which were
+                    # stored for the old document.
+                    self._remove_top_terms(changedid)
+                    self._top_terms_pending.discard(changedid)
+
         if xapid is None:
             self._index.replace_document('Q' + id, xapdoc)
         else:
@@ -697,6 +858,14 @@ class IndexerConnection(object):
         if self._index.get_metadata('_xappy_hascache'):
             self._remove_cached_items(id, xapid)
 
+        # Remove any stored top terms.
+        if self._top_terms_count is not None:
+            if xapid is not None:
+                id = self._get_id_for_xapid(xapid)
+            if id is not None:
+                self._remove_top_terms(id)
+                self._top_terms_pending.discard(id)
+
         # Now, remove the actual document.
         if xapid is None:
             assert id is not None
@@ -802,6 +971,10 @@ class IndexerConnection(object):
             raise errors.IndexerError("IndexerConnection has been closed")
         if self._config_modified:
             self._store_config()
+        elif self._next_docid_modified:
+            self._store_next_docid()
+        if self._top_terms_pending:
+            self._store_top_terms()
         self._index.flush()
         self._mem_buffered = 0
         if self.cache_manager is not None:
@@ -844,6 +1017,7 @@ class IndexerConnection(object):
             self._field_actions = None
             self._field_mappings = None
             self._config_modified = False
+            self._next_docid_modified = False
 
         if self.cache_manager is not None:
             self.cache_manager.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""lrucache.py: A cache which discards the least recently used entries.
+
+"""
+__docformat__ = "restructuredtext en"
+
+class LRUCache(object):
+    """A cache which discards the least recently used entries when full.
+
+    Each entry has a size, calculated by `sizefn` (by default, each entry has
+    a size of 1), and entries are discarded when the total size of the
+    entries exceeds `maxsize`.  Keys may be pinned, in which case their
+    entries are never discarded to make room for others (though they are
+    still removed by clear()).
+
+    """
+    # Indices of the fields of the entries, which are stored as lists in a
+    # circular doubly linked list (in order of use, least recently used
+    # first), so that entries can be moved and removed in constant time.
+    _PREV, _NEXT, _KEY, _VALUE, _SIZE = range(5)
+
+    def __init__(self, maxsize, sizefn=None):
+        self.maxsize = maxsize
+        self.sizefn = sizefn
+        self._entries = {}
+        self._root = self._make_root()
+        self._pinned = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _make_root():
+        """Make the sentinel entry for an empty linked list.
+
+        """
+        root = [None, None, None, None, 0]
+        root[0] = root[1] = root
+        return root
+
+    def _unlink(self, entry):
+        """Remove an entry from the linked list.
+
+        """
+        prev, next = entry[self._PREV], entry[self._NEXT]
+        prev[self._NEXT] = next
+        next[self._PREV] = prev
+
+    def _append(self, entry):
+        """Add an entry to the most recently used end of the linked list.
+
+        """
+        root = self._root
+        last = root[self._PREV]
+        entry[self._PREV] = last
+        entry[self._NEXT] = root
+        last[self._NEXT] = entry
+        root[self._PREV] = entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        """Get a list of the keys in the cache.
+
+        """
+        return self._entries.keys()
+
+    def get(self, key, default=None):
+        """Get the value for a key, or `default` if it's not in the cache.
+
+        """
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._unlink(entry)
+        self._append(entry)
+        return entry[self._VALUE]
+
+    def set(self, key, value):
+        """Set the value for a key.
+
+        Least recently used unpinned entries are discarded if necessary to
+        keep the total size within the limit.  If the entry is too big to fit
+        in the cache, and the key isn't pinned, it isn't stored.
+
+        """
+        self.remove(key)
+        if self.sizefn is None:
+            size = 1
+        else:
+            size = self.sizefn(value)
+        if size > self.maxsize and key not in self._pinned:
+            return
+        entry = [None, None, key, value, size]
+        self._entries[key] = entry
+        self._append(entry)
+        self.size += size
+        self._evict()
+
+    def remove(self, key):
+        """Remove the entry for a key, if there is one.
+
+        """
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            return
+        self._unlink(entry)
+        self.size -= entry[self._SIZE]
+
+    def _evict(self):
+        """Discard entries until the total size is within the limit.
+
+        Pinned entries are skipped, so this takes time proportional to the
+        number of pinned entries, plus the number of entries discarded.
+
+        """
+        root = self._root
+        entry = root[self._NEXT]
+        while self.size > self.maxsize and entry is not root:
+            next = entry[self._NEXT]
+            key = entry[self._KEY]
+            if key not in self._pinned:
+                del self._entries[key]
+                self._unlink(entry)
+                self.size -= entry[self._SIZE]
+                self.evictions += 1
+            entry = next
+
+    def pin(self, key):
+        """Pin a key, so that its entry is never discarded to make room.
+
+        """
+        self._pinned.add(key)
+
+    def unpin(self, key):
+        """Unpin a key.
+
+        """
+        self._pinned.discard(key)
+        self._evict()
+
+    def is_pinned(self, key):
+        """Check whether a key is pinned.
+
+        """
+        return key in self._pinned
+
+    def clear(self):
+        """Remove all the entries (but leave the pinned keys pinned).
+
+        """
+        # Break the links between the entries, so that they're freed at once
+        # rather than by the cycle collector.
+        for entry in self._entries.itervalues():
+            entry[self._PREV] = entry[self._NEXT] = None
+        self._entries = {}
+        self._root = self._make_root()
+        self.size = 0
+
+    def get_stats(self):
+        """Get statistics about the use of the cache.
+
+        Returns a dict holding the number of `hits`, `misses` and `evictions`,
+        the `hit_rate` (the proportion of lookups which were hits, or None if
+        there have been no lookups), the number of `entries` and of `pinned`
+        keys, and the total `size` and `maxsize` of the cache.
+
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            hit_rate = None
+        else:
+            hit_rate = float(self.hits) / lookups
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': hit_rate,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'pinned': len(self._pinned),
+            'size': self.size,
+            'maxsize': self.maxsize,
+        }
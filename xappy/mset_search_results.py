@@ -26,12 +26,16 @@ __docformat__ = "restructuredtext en"
 
 import _checkxapian
 
+import clustering
+from diversity import diversify, LazyOrder
 import errors
 from fieldactions import FieldActions
+import heapq
 from indexerconnection import IndexerConnection
 import math
 import re
 from searchresults import SearchResult
+import sketch
 import xapian
 
 class MSetTermWeightGetter(object):
@@ -45,6 +49,33 @@ class MSetTermWeightGetter(object):
         return self.mset.get_termweight(term)
 
 
+def _fetch_mset_documents(mset, indices=None):
+    """Read the documents for the items in an MSet.
+
+    If `indices` is None, the documents for all the items are read.
+    Otherwise, it is a list of the indices in the MSet of the items to read
+    the documents for.
+
+    MSet.fetch() allows the backend to read all the documents in one batch;
+    the data of each document is then read in docid order, so that the
+    documents are read in a single ordered pass over the database, rather than
+    in rank order.  The documents are cached by the MSet, so reading them for
+    each hit later doesn't read them again.
+
+    """
+    if indices is None:
+        if hasattr(mset, 'fetch'):
+            mset.fetch()
+        items = [(item.docid, item) for item in mset]
+    else:
+        # Only some of the items are needed, so they aren't fetched in a
+        # batch (which would read the documents for all the items).
+        items = [(item.docid, item)
+                 for item in (mset.get_hit(index) for index in indices)]
+    items.sort()
+    for docid, item in items:
+        item.document.get_data()
+
 class MSetSearchResultIter(object):
     """An iterator over a set of results from a search.
 
@@ -76,6 +107,12 @@ class MSetResultOrdering(object):
         msetitem = self.mset.get_hit(index)
         return SearchResult(msetitem, self.context)
 
+    def fetch(self):
+        """Read the documents for all the hits.
+
+        """
+        _fetch_mset_documents(self.mset)
+
     def get_startrank(self):
         return self.mset.get_firstitem()
 
@@ -88,7 +125,8 @@ class MSetResultOrdering(object):
         """
         return len(self.mset)
 
-    def _cluster(self, num_clusters, maxdocs, fields, assume_single_value):
+    def _cluster(self, num_clusters, maxdocs, fields, assume_single_value,
+                 method='singlelink'):
         """Cluster results based on similarity.
 
         Note: this method is experimental, and will probably disappear or
@@ -98,7 +136,15 @@ class MSetResultOrdering(object):
         too few results, there will be exaclty this number of clusters in the
         result.
 
+        `method` is 'singlelink' to use xapian's single-link clusterer, or
+        'kmeans' to use _cluster_kmeans().
+
         """
+        if method == 'kmeans':
+            return self._cluster_kmeans(num_clusters, maxdocs, fields,
+                                        assume_single_value)
+        if method != 'singlelink':
+            raise errors.SearchError("Unknown clustering method: %r" % method)
         clusterer = xapian.ClusterSingleLink()
         xapclusters = xapian.ClusterAssignments()
         docsim = xapian.DocSimCosine()
@@ -145,6 +191,80 @@ class MSetResultOrdering(object):
             clusters[clusterid].append(item.rank)
         return clusters
 
+    def _cluster_kmeans(self, num_clusters, maxdocs, fields,
+                        assume_single_value):
+        """Cluster the top `maxdocs` results with k-means.
+
+        A vector is built for each document in a single pass over the results:
+        if all the `fields` have the SKETCH action, the vectors are made from
+        the sketches; otherwise, they are made by hashing the terms in the
+        fields (or the value, if _get_singlefield_slot() finds one), weighted
+        by tf-idf.  The vectors are then clustered by clustering.kmeans(),
+        which needs numpy.
+
+        Only the top `maxdocs` results are assigned to clusters.  Clusters are
+        numbered in order of their highest ranked document.
+
+        """
+        end = min(len(self.mset), maxdocs)
+        slots = None
+        if fields is not None:
+            slots = self._get_sketch_slots(fields)
+
+        if slots is not None:
+            docs = []
+            for i in xrange(end):
+                doc = self.mset.get_hit(i).document
+                docs.append([sketch.unserialise(doc.get_value(slot))
+                             for slot in slots])
+            vectors = clustering.sketch_vectors(docs)
+        else:
+            slotnum = None
+            decider = None
+            if fields is not None:
+                slotnum = self._get_singlefield_slot(fields,
+                                                     assume_single_value)
+                if slotnum is None:
+                    decider = self._make_expand_decider(fields)
+
+            db = self._conn._index
+            doccount = db.get_doccount()
+            termfreqs = {}
+            docs = []
+            for i in xrange(end):
+                doc = self.mset.get_hit(i).document
+                if slotnum is not None:
+                    docs.append(((doc.get_value(slotnum), 1.0),))
+                    continue
+                features = []
+                for item in doc.termlist():
+                    term = item.term
+                    if decider is not None and not decider(term):
+                        continue
+                    termfreq = termfreqs.get(term)
+                    if termfreq is None:
+                        termfreq = db.get_termfreq(term)
+                        termfreqs[term] = termfreq
+                    features.append((term, clustering.term_weight(item.wdf,
+                                                                  termfreq,
+                                                                  doccount)))
+                docs.append(features)
+            vectors = clustering.hashed_vectors(docs)
+
+        assignments = clustering.kmeans(vectors, num_clusters)
+        idmap = {}
+        clusters = {}
+        for i, clusterid in enumerate(assignments):
+            try:
+                clusterid = idmap[clusterid]
+            except KeyError:
+                newid = len(idmap)
+                idmap[clusterid] = newid
+                clusters[newid] = []
+                clusterid = newid
+            clusters[clusterid].append(self.mset.get_firstitem() + i)
+        return clusters
+
     def _reorder_by_collapse(self, highest_possible_percentage):
         """Reorder the result by the values in the slot used to collapse on.
 
@@ -163,11 +283,28 @@ class MSetResultOrdering(object):
         if self.collapse_max == 1:
             # No reordering to do - we're already fully diverse according to
             # the values in the slot.
-            return
+            return self
+
+        keys = [self.mset.get_hit(i).collapse_key
+                for i in xrange(len(self.mset))]
+        return self._reorder_by_keys(keys, highest_possible_percentage)
+
+    def _reorder_by_keys(self, keys, highest_possible_percentage):
+        """Reorder the result to diversify the values of a key.
+
+        `keys` is a sequence holding the key (eg, category) of each hit, in
+        the current order.  See diversity.diversify() for details of the
+        reordering; the new order is calculated lazily, as hits are accessed.
+
+        `highest_possible_percentage` is as for _reorder_by_collapse().
+
+        """
+        if self.mset.get_firstitem() != 0:
+            raise errors.SearchError("startrank must be zero to reorder by diversity")
 
         if self.mset.get_firstitem() + len(self.mset) <= 1:
             # No reordering to do - 0 or 1 items.
-            return
+            return self
 
         topweight = self.mset.get_hit(0).weight
         toppct = self.mset.get_hit(0).percent
@@ -176,7 +313,7 @@ class MSetResultOrdering(object):
             # FIXME - perhaps we should pick items from each bin in turn until
             # the bins run out?  Not sure this is useful in any real situation,
             # though.
-            return
+            return self
 
         maxweight = topweight * 100.0 * 100.0 / highest_possible_percentage / float(toppct)
 
@@ -185,23 +322,15 @@ class MSetResultOrdering(object):
         utilities = {}
         pqc_sum = 0.0
 
-        # key is the collapse key, value is a list of (rank, weight) tuples,
-        # in that collapse bin.
-        collapse_bins = {}
-
-        # Fill collapse_bins.
-        for i in xrange(self.mset.get_firstitem() + len(self.mset)):
-            hit = self.mset.get_hit(i)
-            category = hit.collapse_key
-            try:
-                l = collapse_bins[category]
-            except KeyError:
-                l = []
-                collapse_bins[category] = l
-                if i < 100:
-                    utilities[category] = hit.weight
-                    pqc_sum += hit.weight
-            l.append((i, hit.weight / maxweight))
+        # The probability that each hit is relevant.
+        relevances = []
+        for i in xrange(len(self.mset)):
+            weight = self.mset.get_hit(i).weight
+            category = keys[i]
+            if i < 100 and category not in utilities:
+                utilities[category] = weight
+                pqc_sum += weight
+            relevances.append(weight / maxweight)
 
         pqc_sum /= 0.99 # Leave 1% probability for other categories
 
@@ -211,39 +340,8 @@ class MSetResultOrdering(object):
                          for (k, v)
                          in utilities.iteritems())
 
-        # Calculate scores for the potential next hits.  These are the top
-        # weighted hits in each category.
-        potentials = {}
-        for category, l in collapse_bins.iteritems():
-            wt = l[0][1] # weight of the top item
-            score = wt * utilities.get(category, 0.01) # current utility of the category
-            potentials[category] = (l[0][0], score, wt)
-
-        new_order = []
-        while len(collapse_bins) != 0:
-            # The potential next hits are the ones at the top of each
-            # collapse_bin.
-
-            # Pick the next category to use, by finding the maximum score
-            # (breaking ties by choosing the highest ranked one in the original
-            # order).
-            next_cat, (next_i, next_score, next_wt) = max(potentials.iteritems(), key=lambda x: (x[1][1], -x[1][0]))
-
-            # Update the utility of the chosen category
-            utilities[next_cat] = (1.0 - next_wt) * utilities.get(next_cat, 0.01)
-            
-            # Move the newly picked item from collapse_bins to new_order
-            new_order.append(next_i)
-            l = collapse_bins[next_cat]
-            if len(l) <= 1:
-                del collapse_bins[next_cat]
-                del potentials[next_cat]
-            else:
-                collapse_bins[next_cat] = l[1:]
-                wt = l[1][1] # weight of the top item
-                potentials[next_cat] = (l[1][0],
-                                        wt * utilities.get(next_cat, 0.01), wt)
-
+        new_order = LazyOrder(diversify(keys, relevances, utilities),
+                              len(self.mset))
         return ReorderedMSetResultOrdering(self.mset, new_order, self.context)
 
     def _reorder_by_clusters(self, clusters):
@@ -338,11 +436,27 @@ class MSetResultOrdering(object):
         """
         if self.mset.get_firstitem() != 0:
             raise errors.SearchError("startrank must be zero to reorder by similiarity")
-        ds = xapian.DocSimCosine()
-        ds.set_termfreqsource(xapian.DatabaseTermFreqSource(self._conn._index))
-
+        end = min(self.mset.get_firstitem() + len(self.mset), maxcount)
+        slots = None
         if fields is not None:
-            ds.set_expand_decider(self._make_expand_decider(fields))
+            slots = self._get_sketch_slots(fields)
+        if slots is not None:
+            # All the fields have sketches, so compare those instead of the
+            # termlists.  Comparing sketches is cheap, so each document is
+            # compared with all the documents already chosen.
+            similarity = self._make_sketch_similarity(slots, end)
+            compare_all = True
+        else:
+            ds = xapian.DocSimCosine()
+            ds.set_termfreqsource(xapian.DatabaseTermFreqSource(self._conn._index))
+
+            if fields is not None:
+                ds.set_expand_decider(self._make_expand_decider(fields))
+            def similarity(hit1, hit2):
+                return ds.similarity(hit1.document, hit2.document)
+            # Comparing termlists is expensive, so each document is only
+            # compared with the previous document chosen.
+            compare_all = False
 
         tophits = []
         nottophits = []
@@ -351,7 +465,6 @@ class MSetResultOrdering(object):
 
         sim_count = 0
         new_order = []
-        end = min(self.mset.get_firstitem() + len(self.mset), maxcount)
         for i in xrange(end):
             if full:
                 new_order.append(i)
@@ -363,9 +476,13 @@ class MSetResultOrdering(object):
 
             # Compare each incoming hit to tophits
             maxsim = 0.0
-            for tophit in tophits[-1:]:
+            if compare_all:
+                compared = tophits
+            else:
+                compared = tophits[-1:]
+            for tophit in compared:
                 sim_count += 1
-                sim = ds.similarity(hit.document, tophit.document)
+                sim = similarity(hit, tophit)
                 if sim > maxsim:
                     maxsim = sim
 
@@ -401,10 +518,104 @@ class MSetResultOrdering(object):
             return self
 
 
+    def _get_sketch_slots(self, fields):
+        """Get the slots holding the sketches of the specified fields.
+
+        Returns None unless all the fields have the SKETCH action.
+
+        """
+        if isinstance(fields, basestring):
+            fields = [fields]
+        if len(fields) == 0:
+            return None
+        slots = []
+        for field in fields:
+            try:
+                actions = self._conn._field_actions[field]._actions
+            except KeyError:
+                return None
+            if FieldActions.SKETCH not in actions:
+                return None
+            slots.append(self._conn._field_mappings.get_slot(field, 'sketch'))
+        return slots
+
+    def _make_sketch_similarity(self, slots, end):
+        """Make a function to get the similarity of two hits from sketches.
+
+        The similarity is the average of the similarity of the sketches in
+        each of `slots`, where a missing sketch has a similarity of 0.  The
+        sketches of the first `end` hits are read once, when the function is
+        made.
+
+        """
+        sketches = self._read_sketches(slots, end)
+        def similarity(hit1, hit2):
+            sim = 0.0
+            for sketch1, sketch2 in zip(sketches[hit1.rank],
+                                        sketches[hit2.rank]):
+                if sketch1 is not None and sketch2 is not None:
+                    sim += sketch.similarity(sketch1, sketch2)
+            return sim / len(slots)
+        return similarity
+
+    def _read_sketches(self, slots, end):
+        """Read the sketches of the first `end` hits.
+
+        Returns a list, indexed by rank, holding a list of the sketches in
+        each of `slots` for each hit (with None for a missing sketch).  The
+        values are read from the value streams for the slots, in order of
+        document ID, so the documents themselves don't need to be read.
+
+        """
+        index = self._conn._index
+        docids = [(self.mset.get_hit(rank).docid, rank)
+                  for rank in xrange(end)]
+        docids.sort()
+        sketches = [[None] * len(slots) for rank in xrange(end)]
+        for num, slot in enumerate(slots):
+            if not hasattr(index, 'valuestream'):
+                # backwards compatibility
+                for docid, rank in docids:
+                    value = self.mset.get_hit(rank).document.get_value(slot)
+                    sketches[rank][num] = sketch.unserialise(value)
+                continue
+            stream = index.valuestream(slot)
+            item = None
+            try:
+                for docid, rank in docids:
+                    if item is None or item.docid < docid:
+                        if hasattr(stream, 'skip_to'):
+                            item = stream.skip_to(docid)
+                        else:
+                            # backwards compatibility
+                            item = stream.next()
+                            while item.docid < docid:
+                                item = stream.next()
+                    if item.docid == docid:
+                        sketches[rank][num] = sketch.unserialise(item.value)
+            except StopIteration:
+                # No more values in the slot.
+                pass
+        return sketches
+
 class ResultStats(object):
     def __init__(self, mset, cache_stats):
         self.mset = mset
         self.cache_stats = list(cache_stats)
+        self.partial = False
+
+    def set_partial(self, upper_bound=None, estimated=None):
+        """Mark the statistics as coming from a match which was stopped early.
+
+        `upper_bound` and `estimated` replace the values from the mset, if
+        supplied (but values from the cache are always kept).
+
+        """
+        self.partial = True
+        if upper_bound is not None and self.cache_stats[1] is None:
+            self.cache_stats[1] = upper_bound
+        if estimated is not None and self.cache_stats[2] is None:
+            self.cache_stats[2] = estimated
 
     def get_lower_bound(self):
         if self.cache_stats[0] is None:
@@ -440,10 +651,13 @@ class ReorderedMSetSearchResultIter(object):
 
 
 class ReorderedMSetResultOrdering(object):
-    def __init__(self, mset, mset_order, context):
+    def __init__(self, mset, mset_order, context, startrank=None):
         self.mset = mset
         self.mset_order = mset_order
         self.context = context
+        # If set, the rank to report for the first item, when mset_order holds
+        # a page of results, rather than a reordering of the whole mset.
+        self.startrank = startrank
 
     def get_iter(self):
         """Get an iterator over the search results.
@@ -459,10 +673,23 @@ class ReorderedMSetResultOrdering(object):
         msetitem = self.mset.get_hit(self.mset_order[index])
         return SearchResult(msetitem, self.context)
 
+    def fetch(self):
+        """Read the documents for all the hits.
+
+        Only the documents for the items of the mset in the ordering are
+        read.
+
+        """
+        _fetch_mset_documents(self.mset, self.mset_order)
+
     def get_startrank(self):
+        if self.startrank is not None:
+            return self.startrank
         return self.mset.get_firstitem()
 
     def get_endrank(self):
+        if self.startrank is not None:
+            return self.startrank + len(self.mset_order)
         return self.mset.get_firstitem() + len(self.mset)
 
     def __len__(self):
@@ -482,67 +709,297 @@ class NoFacetResults(object):
     def get_facets(self):
         raise errors.SearchError("Facet selection wasn't enabled when the search was run")
 
+    def get_facet(self, field):
+        raise errors.SearchError("Facet selection wasn't enabled when the search was run")
+
+    def get_facet_intervals(self, field):
+        raise errors.SearchError("Facet selection wasn't enabled when the search was run")
+
     def get_suggested_facets(self, maxfacets, required_facets):
         raise errors.SearchError("Facet selection wasn't enabled when the search was run")
 
 
+_facet_option_names = ('top_k', 'min_count', 'sort', 'quantiles')
+
+def _check_facet_options(facet_options):
+    """Check that the options for calculating facets are valid.
+
+    """
+    for field, options in facet_options.iteritems():
+        for name in options:
+            if name not in _facet_option_names:
+                raise errors.SearchError("Unknown facet option for field "
+                                         "%r: %r" % (field, name))
+        if options.get('sort', 'value') not in ('value', 'count'):
+            raise errors.SearchError("Unknown facet sort order for field "
+                                     "%r: %r" % (field, options['sort']))
+        quantiles = options.get('quantiles')
+        if quantiles is not None and \
+           (not isinstance(quantiles, (int, long)) or quantiles < 2):
+            raise errors.SearchError("Quantile sketch size for field %r "
+                                     "must be an integer of at least 2: %r" %
+                                     (field, quantiles))
+
+def _select_facet_values(items, options):
+    """Select the values of a facet to return.
+
+    `items` is an iterable of (value, frequency) pairs, and `options` is the
+    dictionary of options for the facet (see the `facet_options` parameter of
+    SearchConnection.search()).
+
+    Returns a tuple of (values, count), where `values` is a tuple of the
+    selected (value, frequency) pairs, and `count` is the number of values
+    with at least the minimum frequency (including those not selected).
+
+    """
+    min_count = options.get('min_count', 0)
+    top_k = options.get('top_k')
+    sort = options.get('sort', 'value')
+    if top_k is None:
+        selected = [item for item in items if item[1] >= min_count]
+        count = len(selected)
+        if sort == 'count':
+            selected.sort(key=lambda item: item[1], reverse=True)
+    else:
+        # Only the top_k most frequent values are kept, so that facets with
+        # very many values don't need a list of all the values to be built.
+        counter = [0]
+        def counted(items):
+            for item in items:
+                if item[1] >= min_count:
+                    counter[0] += 1
+                    yield item
+        selected = heapq.nlargest(top_k, counted(items),
+                                  key=lambda item: item[1])
+        count = counter[0]
+        if sort == 'value':
+            selected.sort()
+    return tuple(selected), count
+
+def _facet_score(count, desired_num_of_categories):
+    """Get the score of a facet with `count` values.
+
+    Lower scores are better: facets with close to the desired number of
+    values are preferred, and facets with only one value score very badly.
+
+    """
+    if count <= 1:
+        return 1000
+    return math.fabs(count - desired_num_of_categories)
+
+def _float_facet_ranges(values, desired_num_of_categories):
+    """Calculate the ranges for a float facet.
+
+    `values` is a dictionary mapping from the serialised values to their
+    frequencies (or, for old versions of xapian, the matchspy which counted
+    them).  Returns a sorted list of ((start, end), frequency) pairs.
+
+    """
+    if hasattr(xapian, 'UnbiasedNumericRanges'):
+        ranges = xapian.UnbiasedNumericRanges(values,
+                                              desired_num_of_categories)
+    else:
+        ranges = xapian.NumericRanges(values, desired_num_of_categories)
+    return sorted(ranges.get_ranges_as_dict().iteritems())
+
+def _facet_count_interval(count, sample_rate, z=1.96):
+    """Get a confidence interval for a facet count estimated from a sample.
+
+    `count` is the estimated count (the count in the sample, divided by the
+    `sample_rate`), and `z` is the number of standard deviations to include
+    (1.96 gives an approximate 95% confidence interval).  The count in the
+    sample is treated as binomially distributed, using the normal
+    approximation.
+
+    Returns a tuple of (lower, upper) bounds.
+
+    """
+    sampled = count * sample_rate
+    spread = z * math.sqrt(sampled * (1.0 - sample_rate)) / sample_rate
+    return (max(0, int(math.floor(count - spread))),
+            int(math.ceil(count + spread)))
+
 class FacetResults(object):
     """The result of counting facets.
 
+    The values for each facet are calculated from the matchspies when they're
+    first requested, so facets which are never read aren't calculated.
+
     """
     def __init__(self, facetspies, facetfields, facethierarchy, facetassocs,
-                 desired_num_of_categories, cache_facets):
+                 desired_num_of_categories, cache_facets, facet_options=None,
+                 precomputed_facets=None, sample_rate=None,
+                 counted_facets=None):
         self.facetspies = facetspies
         self.facetfields = facetfields
         self.facethierarchy = facethierarchy
         self.facetassocs = facetassocs
-
-        self.facetvalues = {}
-        self.facetscore = {}
+        self.desired_num_of_categories = desired_num_of_categories
+        if facet_options is None:
+            facet_options = {}
+        else:
+            _check_facet_options(facet_options)
+        self.facet_options = facet_options
+
+        # The proportion of the matching documents which the matchspies were
+        # run on, or None if they were run on all the matching documents.
+        self.sample_rate = sample_rate
+
+        # The values and scores of the facets which have been calculated,
+        # keyed by field name.
+        self._facetvalues = {}
+        self._facetscore = {}
+
+        # The facets which haven't been calculated yet, keyed by field name.
+        # The values are (slot, facettype, cached values) tuples: the slot is
+        # None for facets read from the cache (for which the facettype is
+        # None), precomputed by a facet view (for which the facettype is
+        # 'precomputed'), or supplied as counts of each value (for which the
+        # facettype is the type of the field, and the cached values are a
+        # dictionary of counts).
+        self._pending = {}
         for field, slot, facettype in facetfields:
+            self._pending[field] = (slot, facettype, None)
+
+        # The SearchProfile in which to record the time spent calculating
+        # each facet, or None.
+        self.profile = None
+        self._sampled_fields = set([field for field, slot, facettype
+                                    in facetfields])
+        if counted_facets is not None:
+            for fieldname, facettype, valuecounts in counted_facets:
+                self._pending[fieldname] = (None, facettype, valuecounts)
+                self._sampled_fields.add(fieldname)
+        if precomputed_facets is not None:
+            for fieldname, values in precomputed_facets:
+                self._pending[fieldname] = (None, 'precomputed', values)
+        if cache_facets is not None:
+            for fieldname, values in cache_facets:
+                self._pending[fieldname] = (None, None, values)
+
+    def _calc_facet(self, field):
+        """Calculate the values and score of a facet.
+
+        If the search was profiled, the time taken is recorded as a
+        "facet_calc" phase.
+
+        """
+        if self.profile is not None:
+            self.profile.time_phase('facet_calc', self._calc_facet_values,
+                                    field)
+        else:
+            self._calc_facet_values(field)
+
+    def _calc_facet_values(self, field):
+        """Calculate the values and score of a facet, without profiling.
+
+        """
+        slot, facettype, cached = self._pending.pop(field)
+        options = self.facet_options.get(field, {})
+        if slot is None and facettype in (None, 'precomputed'):
+            values, count = _select_facet_values(cached, options)
+            if facettype is None:
+                score = 0
+            else:
+                score = _facet_score(count, self.desired_num_of_categories)
+        elif slot is None:
+            values, score = self._calc_counted_facet_value(facettype, cached,
+                self.desired_num_of_categories, options)
+        else:
             values, score = self._calc_facet_value(slot, facettype,
-                                                  desired_num_of_categories)
-            self.facetvalues[field] = values
-            self.facetscore[field] = score
+                                                   self.desired_num_of_categories,
+                                                   options)
+            if facettype != 'float':
+                # The matchspy isn't needed any more, so free it.
+                self.facetspies.pop(slot, None)
+        self._facetvalues[field] = values
+        self._facetscore[field] = score
 
-        if cache_facets is not None:
-            self.facetvalues.update(cache_facets)
-            self.facetscore.update((fieldname, 0)
-                                   for fieldname, _ in cache_facets)
+    def _calc_all_facets(self):
+        """Calculate all the facets which haven't been calculated yet.
+
+        """
+        for field in self._pending.keys():
+            self._calc_facet(field)
+
+    def _get_facetvalues(self):
+        self._calc_all_facets()
+        return self._facetvalues
+    facetvalues = property(_get_facetvalues, doc=
+    """A dictionary mapping from field name to the values of each facet.
+
+    """)
+
+    def _get_facetscore(self):
+        self._calc_all_facets()
+        return self._facetscore
+    facetscore = property(_get_facetscore, doc=
+    """A dictionary mapping from field name to the score of each facet.
+
+    """)
 
-    def _calc_facet_value(self, slot, facettype, desired_num_of_categories):
+    def _calc_facet_value(self, slot, facettype, desired_num_of_categories,
+                          options=None):
         """Calculate the facet value for a given slot, and return it.
 
         """
+        if options is None:
+            options = {}
         facetspy = self.facetspies.get(slot, None)
         if facetspy is None:
             return (), 0
         else:
             if facettype == 'float':
-                if hasattr(xapian, 'UnbiasedNumericRanges'):
-                    try:
-                        # backwards compatibility
-                        ranges = xapian.UnbiasedNumericRanges(
-                            facetspy.get_values(), desired_num_of_categories)
-                    except AttributeError:
-                        ranges = xapian.UnbiasedNumericRanges(
-                            facetspy, desired_num_of_categories)
-                else:
-                    ranges = xapian.NumericRanges(facetspy.get_values(),
-                                                  desired_num_of_categories)
-                values = tuple(sorted(ranges.get_ranges_as_dict().iteritems()))
+                try:
+                    values = facetspy.get_values()
+                except AttributeError:
+                    # backwards compatibility
+                    values = facetspy
+                items = _float_facet_ranges(values, desired_num_of_categories)
             else:
                 try:
-                    values = tuple((item.term, item.termfreq)
-                                   for item in facetspy.values())
+                    items = ((item.term, item.termfreq)
+                             for item in facetspy.values())
                 except AttributeError:
                     # backwards compatibility
-                    values = facetspy.get_values_as_dict()
-                    values = tuple(sorted(values.iteritems()))
-            score = math.fabs(len(values) - desired_num_of_categories)
-            if len(values) <= 1:
-                score = 1000
-            return values, score
+                    items = facetspy.get_values_as_dict()
+                    items = sorted(items.iteritems())
+            return self._select_counted_values(items,
+                                               desired_num_of_categories,
+                                               options)
+
+    def _calc_counted_facet_value(self, facettype, valuecounts,
+                                  desired_num_of_categories, options):
+        """Calculate the facet value from the counts of each value.
+
+        `valuecounts` is a dictionary mapping from the values (serialised,
+        for float facets) to their frequencies, as counted by matchspies (for
+        example, the sum of the counts from several worker processes, or the
+        weighted values kept by quantile sketches).
+
+        """
+        if facettype == 'float':
+            items = _float_facet_ranges(valuecounts, desired_num_of_categories)
+        else:
+            items = sorted(valuecounts.iteritems())
+        return self._select_counted_values(items, desired_num_of_categories,
+                                           options)
+
+    def _select_counted_values(self, items, desired_num_of_categories,
+                               options):
+        """Select the values to return from counted (value, frequency) pairs.
+
+        Returns a tuple of (values, score).
+
+        """
+        if self.sample_rate is not None:
+            # Scale the counts from the sample up to estimates of the
+            # counts for all the matches.
+            rate = self.sample_rate
+            items = [(value, int(round(count / rate)))
+                     for value, count in items]
+        values, count = _select_facet_values(items, options)
+        return values, _facet_score(count, desired_num_of_categories)
 
     def get_facets(self):
         """Get all the calculated facets.
@@ -553,6 +1010,32 @@ class FacetResults(object):
         """
         return self.facetvalues
 
+    def get_facet(self, field):
+        """Get the values calculated for a single facet.
+
+        Only this facet is calculated, if it hasn't been already.  Raises
+        KeyError if the facet wasn't calculated by the search.
+
+        """
+        if field in self._pending:
+            self._calc_facet(field)
+        return self._facetvalues[field]
+
+    def get_facet_intervals(self, field):
+        """Get confidence intervals for the counts of a single facet.
+
+        Returns a tuple of (value, (lower, upper)) pairs, in the same order
+        as get_facet().  The bounds are an approximate 95% confidence
+        interval if the facet was counted on a sample of the matches, and
+        are both equal to the count otherwise.
+
+        """
+        values = self.get_facet(field)
+        if self.sample_rate is None or field not in self._sampled_fields:
+            return tuple([(value, (count, count)) for value, count in values])
+        return tuple([(value, _facet_count_interval(count, self.sample_rate))
+                      for value, count in values])
+
     def get_suggested_facets(self, maxfacets, required_facets):
         """Get the suggested facets.  Parameters and return value are as for
         `SearchResults.get_suggested_facets()`.
@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""parallel.py: Searching using several worker processes.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import threading
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+import errors
+from cache_search_results import CacheResultOrdering
+from mset_search_results import FacetResults, NoFacetResults, ResultStats, \
+         MSetTermWeightGetter
+from query import Query
+from searchconnection import SearchConnection, _DocidRangePostingSource
+from searchresults import SearchResults, SearchResultContext
+import xapian
+
+def _worker_search(conn, query, begin, end, endrank, kwargs, sample_rate):
+    """Perform the part of a search allocated to a worker.
+
+    The worker searches the documents with IDs from `begin` to `end` in its
+    database, or all the documents if `begin` is None (when the worker has
+    its own set of shards).
+
+    If `sample_rate` is not None, facets are counted on that proportion of
+    the matches (so that all the workers use the same proportion), and the
+    counts returned are those for the sample.  Otherwise, facets are counted
+    on all the matches.
+
+    Returns a dict holding the hits found, the statistics for the search, and
+    the facet counts.  The facet counts are the counts of each value from the
+    matchspies, so that they can be summed: the facet options (other than
+    'quantiles', which controls how values are counted) are applied once the
+    counts have been summed.
+
+    """
+    query = conn.query_from_evalable(query)
+    facet_options = kwargs.get('facet_options')
+    if facet_options is not None:
+        kwargs = dict(kwargs)
+        kwargs['facet_options'] = dict(
+            (field, {'quantiles': options['quantiles']})
+            for field, options in facet_options.iteritems()
+            if options.get('quantiles') is not None)
+    if sample_rate is None and 'facet_sample_size' in kwargs:
+        kwargs = dict(kwargs)
+        del kwargs['facet_sample_size']
+    if begin is not None:
+        source = _DocidRangePostingSource(begin, end)
+        query = query.filter(Query(xapian.Query(source), _refs=[source],
+                                   _conn=conn))
+    conn._facet_sample_rate = sample_rate
+    try:
+        results = conn.search(query, 0, endrank, **kwargs)
+    finally:
+        conn._facet_sample_rate = None
+
+    keymaker = None
+    if kwargs.get('sortby') is not None:
+        keymaker = conn._make_sort_keymaker(kwargs['sortby'])
+    collapse_slotnum = None
+    if kwargs.get('collapse') is not None:
+        collapse_slotnum = conn._field_mappings.get_slot(kwargs['collapse'],
+                                                         'collsort')
+    hits = []
+    for result in results:
+        sortkey = collapsekey = None
+        if keymaker is not None:
+            sortkey = keymaker(result._doc)
+        if collapse_slotnum is not None:
+            collapsekey = result._doc.get_value(collapse_slotnum)
+        hits.append((result._doc.get_docid(), result.weight, result.percent,
+                     sortkey, collapsekey))
+
+    facets = {}
+    facetresults = results._facets
+    if not isinstance(facetresults, NoFacetResults):
+        for field, slot, facettype in facetresults.facetfields:
+            facetspy = facetresults.facetspies[slot]
+            try:
+                values = [(item.term, item.termfreq)
+                          for item in facetspy.values()]
+            except AttributeError:
+                # backwards compatibility
+                values = facetspy.get_values_as_dict().items()
+            facets[field] = (facettype, values)
+
+    return {
+        'hits': hits,
+        'stats': (results.matches_lower_bound,
+                  results.matches_upper_bound,
+                  results.matches_estimated),
+        'partial': results.is_partial,
+        'facets': facets,
+        'sample_rate': results.facet_sample_rate,
+    }
+
+def _worker_reopen(conn):
+    """Reopen a worker's connection.
+
+    """
+    conn.reopen()
+
+def _worker_main(indexpath, pipe):
+    """The main loop of a worker process.
+
+    Requests are read from `pipe`, as tuples of (function, args): the function
+    is called with the worker's connection and the args, and a tuple of
+    (True, return value) or (False, exception) is sent back.  The loop ends
+    when None is read.
+
+    """
+    conn = SearchConnection(indexpath)
+    try:
+        while True:
+            try:
+                request = pipe.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            func, args = request
+            try:
+                reply = (True, func(conn, *args))
+            except Exception, e:
+                reply = (False, e)
+            try:
+                pipe.send(reply)
+            except Exception, e:
+                # The reply couldn't be pickled.
+                pipe.send((False, errors.SearchError(str(e))))
+    finally:
+        conn.close()
+
+class ParallelSearchConnection(object):
+    """A connection which splits each search across several processes.
+
+    Xapian performs each search in a single thread, so the time taken by a
+    search on a large database is limited by the speed of a single core.  A
+    ParallelSearchConnection starts a number of worker processes, each with
+    its own connection to the database, and divides the documents in the
+    database between them by document ID.  Each search is sent to all the
+    workers, which search their part of the database in parallel, and the
+    results are then merged.
+
+    For a single database, the workers each open the whole database, so the
+    statistics used for weighting are those of the whole database, and the
+    weights calculated are the same as for a normal search.  If several
+    shards are given, the shards are divided between the workers instead
+    (so at most one worker is used for each shard), and each worker opens
+    only its own shards.  The weights are then calculated from the
+    statistics of each worker's shards, so may differ slightly from those of
+    a normal search over all the shards, unless the shards have similar
+    contents.  The numbers of matching documents and facet counts returned
+    by the workers are summed.  Percentages are calculated separately by each
+    worker, so are only approximate.  The ranges returned for float facets
+    are calculated from the combined counts of each value, in the same way as
+    for a normal search.
+
+    Queries are sent to the workers in serialised form, so must be
+    serialisable (see Query.evalable_repr()).  The `conn` member is a normal
+    SearchConnection to the database, which should be used to build the
+    queries, and may be used for any other operations.
+
+    """
+    def __init__(self, indexpath, processes=None):
+        """Open a connection, and start the worker processes.
+
+        - `indexpath` is the path to the database, or a list of paths to
+          shards, as for SearchConnection.
+        - `processes` is the number of worker processes to use.  If None,
+          one process is used for each CPU.  No more processes than shards
+          are used when searching several shards.
+
+        """
+        if multiprocessing is None:
+            raise errors.SearchError("ParallelSearchConnection requires the "
+                                     "multiprocessing module")
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes < 1:
+            raise errors.SearchError("At least one process is needed")
+        self.conn = SearchConnection(indexpath)
+        self._lock = threading.Lock()
+        self._workers = []
+
+        # If there are several shards, the indices of the shards opened by
+        # each worker; otherwise None.
+        self._worker_shards = None
+        if not isinstance(indexpath, basestring) and len(indexpath) > 1:
+            processes = min(processes, len(indexpath))
+            self._worker_shards = [range(i, len(indexpath), processes)
+                                   for i in xrange(processes)]
+        try:
+            for i in xrange(processes):
+                if self._worker_shards is None:
+                    workerpath = indexpath
+                else:
+                    workerpath = [indexpath[shard]
+                                  for shard in self._worker_shards[i]]
+                parent_pipe, child_pipe = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_worker_main,
+                                                  args=(workerpath,
+                                                        child_pipe))
+                process.daemon = True
+                process.start()
+                child_pipe.close()
+                self._workers.append((process, parent_pipe))
+        except:
+            self.close()
+            raise
+
+    def _call_workers(self, calls):
+        """Call functions in the workers, and wait for the results.
+
+        `calls` is a list of (worker number, function, args) tuples.  Returns
+        a list of the return values, in the same order.  If any of the calls
+        raised an exception, the first such exception is raised (after all
+        the calls have finished).
+
+        """
+        if self._workers is None:
+            raise errors.SearchError("ParallelSearchConnection has been "
+                                     "closed")
+        self._lock.acquire()
+        try:
+            for workernum, func, args in calls:
+                self._workers[workernum][1].send((func, args))
+            replies = []
+            for workernum, func, args in calls:
+                try:
+                    replies.append(self._workers[workernum][1].recv())
+                except EOFError:
+                    replies.append((False, errors.SearchError(
+                        "Worker process %d exited unexpectedly" % workernum)))
+        finally:
+            self._lock.release()
+        for ok, value in replies:
+            if not ok:
+                raise value
+        return [value for ok, value in replies]
+
+    def _get_docid_ranges(self):
+        """Divide the document IDs between the workers.
+
+        Returns a list of (worker number, begin, end) tuples, for each worker
+        which has a non-empty range of document IDs.
+
+        """
+        lastdocid = self.conn._index.get_lastdocid()
+        numworkers = len(self._workers)
+        result = []
+        for workernum in xrange(numworkers):
+            begin = lastdocid * workernum // numworkers + 1
+            end = lastdocid * (workernum + 1) // numworkers
+            if begin <= end:
+                result.append((workernum, begin, end))
+        return result
+
+    def _get_combined_docid(self, workernum, docid):
+        """Get the document ID in the combined shards of a worker's docid.
+
+        Xapian interleaves the document IDs of the shards in a combined
+        database, so this maps a document ID in the shards opened by a worker
+        to the document ID in all the shards.
+
+        """
+        shards = self._worker_shards[workernum]
+        shard = shards[(docid - 1) % len(shards)]
+        sharddocid = (docid - 1) // len(shards) + 1
+        return (sharddocid - 1) * len(self.conn._shards) + shard + 1
+
+    def search(self, query, startrank, endrank, **kwargs):
+        """Perform a search, using all the worker processes.
+
+        - `query` is the query to perform: either a Query object which can be
+          serialised, or a serialised query (as returned by
+          Query.evalable_repr()).
+        - `startrank` and `endrank` are as for SearchConnection.search().
+
+        Any other keyword arguments are passed to SearchConnection.search()
+        in each of the workers.
+
+        Returns a SearchResults object, as for SearchConnection.search().
+
+        """
+        if isinstance(query, Query):
+            serialised = query.evalable_repr()
+            if serialised is None:
+                raise errors.SearchError("Query cannot be serialised, so "
+                                         "cannot be used with a "
+                                         "ParallelSearchConnection")
+        elif isinstance(query, basestring):
+            serialised = query
+            query = self.conn.query_from_evalable(query)
+        else:
+            raise errors.SearchError("Unsupported query type for "
+                                     "ParallelSearchConnection: %r" % query)
+
+        # Work out the proportion of the matches to count facets on, so that
+        # all the workers use the same proportion.
+        sample_rate = None
+        if kwargs.get('getfacets') and \
+           kwargs.get('facet_sample_size') is not None:
+            sample_rate = self.conn._get_facet_sample_rate(query,
+                kwargs['facet_sample_size'])
+
+        if self._worker_shards is None:
+            ranges = self._get_docid_ranges()
+        else:
+            ranges = [(workernum, None, None)
+                      for workernum in xrange(len(self._workers))]
+        calls = [(workernum, _worker_search,
+                  (serialised, begin, end, endrank, kwargs, sample_rate))
+                 for workernum, begin, end in ranges]
+        replies = self._call_workers(calls)
+
+        # Merge the hits, in the order of the sort key (if any), then weight,
+        # then docid.
+        hits = []
+        for (workernum, begin, end), reply in zip(ranges, replies):
+            if self._worker_shards is None:
+                hits.extend(reply['hits'])
+            else:
+                hits.extend([(self._get_combined_docid(workernum, hit[0]),)
+                             + hit[1:] for hit in reply['hits']])
+        if kwargs.get('sortby') is not None:
+            hits.sort(key=lambda hit: (hit[3], -hit[1], hit[0]))
+        else:
+            hits.sort(key=lambda hit: (-hit[1], hit[0]))
+        if kwargs.get('collapse') is not None:
+            collapse_max = kwargs.get('collapse_max', 1)
+            collapse_counts = {}
+            collapsed = []
+            for hit in hits:
+                if not hit[4]:
+                    # Documents with no collapse key are never collapsed.
+                    collapsed.append(hit)
+                    continue
+                count = collapse_counts.get(hit[4], 0)
+                if count < collapse_max:
+                    collapse_counts[hit[4]] = count + 1
+                    collapsed.append(hit)
+            hits = collapsed
+        hits = hits[startrank:endrank]
+
+        # Sum the statistics.
+        cache_stats = [0, 0, 0]
+        partial = False
+        for reply in replies:
+            for i in xrange(3):
+                cache_stats[i] += reply['stats'][i]
+            if reply['partial']:
+                partial = True
+        stats = ResultStats(None, cache_stats)
+        if partial:
+            stats.set_partial()
+
+        # Sum the facet counts.
+        if kwargs.get('getfacets'):
+            desired_num_of_categories = \
+                kwargs.get('facet_desired_num_of_categories', 7)
+            facettypes = {}
+            facetcounts = {}
+            for reply in replies:
+                for field, (facettype, values) in reply['facets'].iteritems():
+                    facettypes[field] = facettype
+                    counts = facetcounts.setdefault(field, {})
+                    for value, freq in values:
+                        counts[value] = counts.get(value, 0) + freq
+            counted_facets = [(field, facettypes[field], counts)
+                              for field, counts in facetcounts.iteritems()]
+            # The workers may not have sampled (for example, if searching
+            # several shards), in which case the counts are exact.
+            if len(replies) == 0 or replies[0]['sample_rate'] is None:
+                sample_rate = None
+
+            facet_hierarchy = None
+            if kwargs.get('usesubfacets'):
+                facet_hierarchy = self.conn._facet_hierarchy
+            query_type = kwargs.get('query_type')
+            facets = FacetResults({}, [], facet_hierarchy,
+                                  self.conn._facet_query_table.get(query_type),
+                                  desired_num_of_categories, None,
+                                  kwargs.get('facet_options'),
+                                  sample_rate=sample_rate,
+                                  counted_facets=counted_facets)
+        else:
+            facets = NoFacetResults()
+
+        # Get the term weights from an empty search, for use when calculating
+        # relevant data for the results.
+        enq = self.conn._make_enquire(query)
+        while True:
+            try:
+                mset = enq.get_mset(0, 0)
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.conn.reopen()
+        context = SearchResultContext(self.conn, self.conn._field_mappings,
+                                      MSetTermWeightGetter(mset), query)
+        ordering = CacheResultOrdering(context,
+                                       [hit[0] for hit in hits],
+                                       startrank,
+                                       [(hit[1], hit[2]) for hit in hits])
+        return SearchResults(self.conn, query, self.conn._field_mappings,
+                             facets, ordering, stats, context)
+
+    def get_document(self, docid=None, xapid=None):
+        """Get a document, as for SearchConnection.get_document().
+
+        """
+        return self.conn.get_document(docid, xapid)
+
+    def reopen(self):
+        """Reopen the connection, and the connections in the workers.
+
+        """
+        if self._workers is None:
+            raise errors.SearchError("ParallelSearchConnection has been "
+                                     "closed")
+        self.conn.reopen()
+        self._call_workers([(workernum, _worker_reopen, ())
+                            for workernum in xrange(len(self._workers))])
+
+    def close(self):
+        """Close the connection, and stop the worker processes.
+
+        It is permissible to call close() multiple times, but only the first
+        call will have any effect.
+
+        """
+        if self._workers is None:
+            return
+        workers = self._workers
+        self._workers = None
+        for process, pipe in workers:
+            try:
+                pipe.send(None)
+            except (IOError, OSError):
+                pass
+        for process, pipe in workers:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+            pipe.close()
+        self.conn.close()
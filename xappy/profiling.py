@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""profiling.py: Record the time spent in each phase of a search.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+import os
+import sys
+import threading
+import time
+
+def _make_thread_cpu_clock():
+    """Make a function returning the cpu time used by the calling thread.
+
+    Returns None if the platform has no per-thread cpu clock which can be
+    read.
+
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+    except ImportError:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    # The clock ID of CLOCK_THREAD_CPUTIME_ID on linux.
+    clock_id = 3
+    for libname in ('rt', 'c'):
+        path = ctypes.util.find_library(libname)
+        if path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def thread_cpu_clock():
+            ts = timespec()
+            if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+                raise OSError("clock_gettime failed")
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        try:
+            thread_cpu_clock()
+        except OSError:
+            continue
+        return thread_cpu_clock
+    return None
+
+def _process_cpu_clock():
+    """Get the cpu time used by the whole process.
+
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+_cpu_clock = _make_thread_cpu_clock()
+
+# True if the cpu times recorded are for the thread doing the work, False if
+# they're for the whole process (and so include the work of other threads).
+CPU_TIME_PER_THREAD = _cpu_clock is not None
+if _cpu_clock is None:
+    _cpu_clock = _process_cpu_clock
+
+class SearchProfile(object):
+    """A breakdown of the time spent in each phase of a search.
+
+    `phases` is a list of (name, wall time, cpu time) tuples, in the order in
+    which the phases happened (times are in seconds).  The cpu time is that
+    used by the thread which performed the phase if the platform supports
+    it, or otherwise that used by the whole process (which includes the
+    work of any other threads, such as those of a SearchPool, at the same
+    time): `CPU_TIME_PER_THREAD` in this module records which.  The phases
+    recorded by SearchConnection.search() are:
+
+     - "facet_fields": working out which fields to calculate facets for.
+     - "cache_lookup": reading hits, statistics and facets from the cache
+       manager.
+     - "enquire_setup": preparing the match (including the facet matchspies).
+     - "match": running the match.
+     - "facets": counting facets on a sample of the matches (if requested)
+       and preparing the facet results.
+     - "facet_calc": calculating the values of a facet from its matchspy.
+       This is recorded once for each facet, when its values are first
+       requested (which may be after the search has returned).
+     - "results": building the result set.
+     - "materialise": reading the documents for the hits (this is only
+       recorded if SearchResults.prefetch() is called).
+
+    `documents_examined` is the number of documents which the match examined
+    (or None if this couldn't be counted), and `matchspy_counts` is a
+    dictionary mapping from each facet field name to the number of documents
+    its matchspy examined.
+
+    """
+    def __init__(self, aggregator=None):
+        self.phases = []
+        self.documents_examined = None
+        self.matchspy_counts = {}
+        self._aggregator = aggregator
+        self._current = None
+
+    def start_phase(self, name):
+        """Start timing a phase, ending any phase currently being timed.
+
+        """
+        self.end_phase()
+        self._current = (name, time.time(), _cpu_clock())
+
+    def end_phase(self):
+        """End the phase currently being timed, if there is one.
+
+        """
+        if self._current is None:
+            return
+        name, wall, cpu = self._current
+        self._current = None
+        self.add_phase(name, time.time() - wall, _cpu_clock() - cpu)
+
+    def add_phase(self, name, wall, cpu):
+        """Record the time spent in a phase.
+
+        """
+        self.phases.append((name, wall, cpu))
+        if self._aggregator is not None:
+            self._aggregator.add_phase(name, wall, cpu)
+
+    def time_phase(self, name, func, *args):
+        """Call a function, recording the time it takes as a phase.
+
+        Unlike start_phase(), this doesn't end the phase currently being
+        timed, so it may be used for work done outside the sequence of
+        phases (such as work done lazily after a search has returned).
+
+        Returns the result of the function.
+
+        """
+        wall, cpu = time.time(), _cpu_clock()
+        try:
+            return func(*args)
+        finally:
+            self.add_phase(name, time.time() - wall, _cpu_clock() - cpu)
+
+    def get_phase(self, name):
+        """Get the (wall time, cpu time) spent in a named phase.
+
+        """
+        wall, cpu = 0.0, 0.0
+        for phase, phase_wall, phase_cpu in self.phases:
+            if phase == name:
+                wall += phase_wall
+                cpu += phase_cpu
+        return wall, cpu
+
+    def _get_total_wall(self):
+        return sum(wall for name, wall, cpu in self.phases)
+    total_wall = property(_get_total_wall, doc=
+    """The total wall time spent in all the phases.
+
+    """)
+
+    def _get_total_cpu(self):
+        return sum(cpu for name, wall, cpu in self.phases)
+    total_cpu = property(_get_total_cpu, doc=
+    """The total cpu time spent in all the phases.
+
+    """)
+
+    def __repr__(self):
+        return '<SearchProfile(%s)>' % ', '.join(
+            '%s=%.6f' % (name, wall) for name, wall, cpu in self.phases)
+
+class _NullSearchProfile(object):
+    """A search profile which records nothing.
+
+    This is used when a search isn't being profiled.
+
+    """
+    documents_examined = None
+    matchspy_counts = {}
+
+    def start_phase(self, name):
+        pass
+
+    def end_phase(self):
+        pass
+
+    def add_phase(self, name, wall, cpu):
+        pass
+
+    def time_phase(self, name, func, *args):
+        return func(*args)
+
+class ProfileAggregator(object):
+    """Collect the phase timings of many searches.
+
+    An aggregator may be passed to SearchConnection.set_profile_aggregator(),
+    after which the times of the phases of each search on the connection are
+    added to it (as are the times spent parsing queries with query_parse()).
+    The same aggregator may be shared by several connections, in several
+    threads.
+
+    Only the most recent `maxsamples` times are kept for each phase.
+
+    """
+    def __init__(self, maxsamples=1000):
+        self.maxsamples = maxsamples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, wall, cpu):
+        """Add the time spent in a phase.
+
+        """
+        self._lock.acquire()
+        try:
+            samples = self._samples.setdefault(name, [])
+            samples.append((wall, cpu))
+            if len(samples) > self.maxsamples:
+                del samples[:len(samples) - self.maxsamples]
+        finally:
+            self._lock.release()
+
+    def phases(self):
+        """Get a list of the names of the phases which have been recorded.
+
+        """
+        self._lock.acquire()
+        try:
+            return sorted(self._samples.keys())
+        finally:
+            self._lock.release()
+
+    def percentiles(self, name, percentiles=(50, 90, 99), cpu=False):
+        """Get percentiles of the time spent in a phase.
+
+        Returns a dictionary mapping from each of the requested percentiles
+        to the corresponding time (or an empty dictionary if the phase hasn't
+        been recorded).  Wall times are used, unless `cpu` is True.
+
+        """
+        self._lock.acquire()
+        try:
+            samples = self._samples.get(name, ())
+            if cpu:
+                times = sorted(sample[1] for sample in samples)
+            else:
+                times = sorted(sample[0] for sample in samples)
+        finally:
+            self._lock.release()
+        if len(times) == 0:
+            return {}
+        result = {}
+        for percentile in percentiles:
+            rank = int(math.ceil(percentile / 100.0 * len(times))) - 1
+            result[percentile] = times[min(max(rank, 0), len(times) - 1)]
+        return result
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Get a summary of the times spent in each phase.
+
+        Returns a dictionary mapping from phase name to a dictionary holding
+        the number of times recorded (`count`), and the percentiles of the
+        wall times (`wall`) and cpu times (`cpu`), as returned by
+        percentiles().
+
+        """
+        result = {}
+        for name in self.phases():
+            result[name] = {
+                'count': len(self._samples[name]),
+                'wall': self.percentiles(name, percentiles),
+                'cpu': self.percentiles(name, percentiles, cpu=True),
+            }
+        return result
+
+    def clear(self):
+        """Discard all the recorded times.
+
+        """
+        self._lock.acquire()
+        try:
+            self._samples = {}
+        finally:
+            self._lock.release()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""quantiles.py: Bounded memory quantile sketches, for numeric facets.
+
+A sketch keeps a sample of the items added to it, in which each kept item
+stands for a number of the added items (its weight).  The sketch used here
+is a KLL sketch: items are added to the lowest of a stack of levels, and when
+a level fills up its items are sorted and every other item is promoted to the
+next level (where items have twice the weight).  The number of kept items is
+bounded by about three times the size parameter, however many items are
+added, and the rank of any item is estimated to within a small fraction of
+the number of items added.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+import random
+import xapian
+
+class QuantileSketch(object):
+    """A KLL quantile sketch.
+
+    `k` is the size parameter: larger values give more accurate estimates,
+    but use more memory.  Items may be of any type which can be sorted.
+
+    """
+    # The factor by which the capacity of each level shrinks, moving down
+    # from the top level.
+    _shrink = 2.0 / 3.0
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.count = 0
+        self._levels = [[]]
+        self._size = 0
+        self._maxsize = 0
+        # The random choices are seeded, so that the same items always
+        # produce the same sketch.
+        self._random = random.Random(seed)
+        self._update_maxsize()
+
+    def _capacity(self, level):
+        """Get the number of items which a level may hold.
+
+        """
+        depth = len(self._levels) - level - 1
+        return int(math.ceil(self.k * self._shrink ** depth)) + 1
+
+    def _update_maxsize(self):
+        self._maxsize = sum([self._capacity(level)
+                             for level in xrange(len(self._levels))])
+
+    def add(self, item):
+        """Add an item to the sketch.
+
+        """
+        self._levels[0].append(item)
+        self._size += 1
+        self.count += 1
+        if self._size >= self._maxsize:
+            self._compress()
+
+    def _compress(self):
+        """Compact the lowest full level, moving half its items up a level.
+
+        """
+        for level in xrange(len(self._levels)):
+            items = self._levels[level]
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self._levels):
+                self._levels.append([])
+                self._update_maxsize()
+            items.sort()
+            kept = []
+            if len(items) % 2 == 1:
+                kept.append(items.pop())
+            offset = self._random.randint(0, 1)
+            self._levels[level + 1].extend(items[offset::2])
+            self._levels[level] = kept
+            self._size -= len(items) // 2
+            if self._size < self._maxsize:
+                break
+
+    def __len__(self):
+        """Get the number of items kept by the sketch.
+
+        """
+        return self._size
+
+    def weighted_items(self):
+        """Get the items kept by the sketch, with their weights.
+
+        Returns a list of (item, weight) pairs, in ascending order of item,
+        with only one pair for each distinct item.  The weights add up to the
+        number of items added to the sketch.
+
+        """
+        weighted = []
+        for level, items in enumerate(self._levels):
+            weight = 1 << level
+            weighted.extend([(item, weight) for item in items])
+        weighted.sort()
+        result = []
+        for item, weight in weighted:
+            if len(result) != 0 and result[-1][0] == item:
+                result[-1][1] += weight
+            else:
+                result.append([item, weight])
+        return [tuple(pair) for pair in result]
+
+    def quantile(self, fraction):
+        """Get the estimated item at a given fraction through the items.
+
+        Returns None if no items have been added.
+
+        """
+        target = fraction * self.count
+        seen = 0
+        item = None
+        for item, weight in self.weighted_items():
+            seen += weight
+            if seen >= target:
+                break
+        return item
+
+class _ValueCount(object):
+    """A value and its frequency, as returned by QuantileMatchSpy.values().
+
+    """
+    __slots__ = ('term', 'termfreq')
+
+    def __init__(self, term, termfreq):
+        self.term = term
+        self.termfreq = termfreq
+
+class QuantileMatchSpy(xapian.MatchSpy):
+    """A match spy which keeps a quantile sketch of the values in a slot.
+
+    The values in the slot must be sortable serialised numbers (as stored for
+    float facets).  Unlike ValueCountMatchSpy, the memory used doesn't grow
+    with the number of distinct values, so this is suitable for facets with
+    very many values (such as prices).
+
+    """
+    def __init__(self, slot, k=200):
+        xapian.MatchSpy.__init__(self)
+        self.slot = slot
+        self.total = 0
+        self.sketch = QuantileSketch(k)
+
+    def __call__(self, doc, wt):
+        self.total += 1
+        value = doc.get_value(self.slot)
+        if value:
+            self.sketch.add(value)
+
+    def get_total(self):
+        """Get the number of documents seen by the match spy.
+
+        """
+        return self.total
+
+    def values(self):
+        """Get the values kept by the sketch, with their estimated frequencies.
+
+        """
+        return [_ValueCount(value, weight)
+                for value, weight in self.sketch.weighted_items()]
+
+    def get_values(self):
+        """Get a dictionary mapping the kept values to their estimated counts.
+
+        This has the same form as the result of ValueCountMatchSpy's
+        get_values(), so the ranges are calculated in the same way as for
+        exactly counted float facets.
+
+        """
+        return dict(self.sketch.weighted_items())
@@ -25,32 +25,67 @@ r"""searchconnection.py: A connection to the search engine for searching.
 __docformat__ = "restructuredtext en"
 
 import _checkxapian
+import array
+import bisect
 import os as _os
+import re
 import cPickle as _cPickle
 import math
 import inspect
 import itertools
-
+import threading
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 import xapian
 from cache_search_results import CacheResultOrdering
 import cachemanager
+import cursor as _cursor
 from datastructures import UnprocessedDocument, ProcessedDocument
 from fieldactions import ActionContext, FieldActions, \
          ActionSet, SortableMarshaller, convert_range_to_term, \
-         _get_imgterms
+         convert_value_to_trie_key, convert_trie_cell_to_term, \
+         TRIE_KEY_BITS, _get_imgterms
 import fieldmappings
 import errors
+import geocells
+import lrucache
 from indexerconnection import IndexerConnection, PrefixedTermIter, \
-         DocumentIter, SynonymIter, _allocate_id
+         DocumentIter, SynonymIter, _allocate_id, _get_next_docid, \
+         _ExpandDecider, _get_term_prefix
+from profiling import SearchProfile, _NullSearchProfile
+from quantiles import QuantileMatchSpy
 from query import Query
 from searchresults import SearchResults, SearchResultContext
 from mset_search_results import FacetResults, NoFacetResults, \
-         MSetResultOrdering, ResultStats, MSetTermWeightGetter
+         MSetResultOrdering, ResultStats, MSetTermWeightGetter, \
+         ReorderedMSetResultOrdering, _check_facet_options
 
 class ExternalWeightSource(object):
     """A source of extra weight information for searches.
 
+    Subclasses should implement either get_weight(), which is called for each
+    document with a ProcessedDocument, or get_weights(), which is called for
+    batches of documents with just the values of the documents which are
+    needed.  The latter is much faster, since the documents don't need to be
+    read: to use it, set `slots` to a list of (fieldname, purpose) tuples,
+    naming the values needed (where purpose is as for
+    ProcessedDocument.get_value(), eg 'collsort').
+
     """
+    # The values needed by get_weights(), or None to use get_weight().
+    slots = None
+
+    # The number of documents to pass to each call to get_weights().
+    batch_size = 1000
+
     def get_maxweight(self):
         """Get the maximum weight that the weight source can return.
 
@@ -65,6 +100,741 @@ class ExternalWeightSource(object):
         """
         return NotImplementedError("Subclasses should implement this method")
 
+    def get_weights(self, xapids, values):
+        """Get the weights associated with a batch of documents.
+
+        `xapids` is a list of the xapian document IDs of the documents, in
+        ascending order.  `values` is a list holding, for each entry in
+        `slots`, a list of the values (in serialised form) for the
+        documents, in the same order as `xapids`.  Documents with no value
+        have the empty string as their value.
+
+        Should return a sequence (eg, a list or a numpy array) of the weights
+        of the documents, in the same order as `xapids`.
+
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
+class _DifferenceWeightSource(ExternalWeightSource):
+    """An external weight source for exact difference searches.
+
+    The weights are calculated for batches of documents, from the values
+    read from the value stream.  If numpy is installed and the difference
+    function is a formula which can be applied to arrays, it is evaluated
+    once for each batch.
+
+    """
+    def __init__(self, field, purpose, val, difference_func):
+        self.slots = [(field, purpose)]
+        self.val = val
+        self.formula = None
+        if isinstance(difference_func, basestring):
+            if numpy is not None:
+                self.formula = compile(difference_func, '<difference_func>',
+                                       'eval')
+            difference_func = eval('lambda x, y: ' + difference_func)
+        self.difference_func = difference_func
+
+    def get_maxweight(self):
+        return 1.0
+
+    def get_weights(self, xapids, values):
+        floats = [xapian.sortable_unserialise(value) for value in values[0]]
+        if self.formula is not None:
+            y = numpy.array(floats, dtype=float)
+            try:
+                differences = eval(self.formula, {}, {'x': self.val, 'y': y})
+                differences = numpy.asarray(differences, dtype=float) + \
+                              numpy.zeros(len(floats))
+            except Exception:
+                # The formula can't be applied to an array, for example
+                # because it uses max() or a conditional expression.
+                differences = None
+            if differences is not None and differences.shape == y.shape:
+                return 1.0 / (numpy.abs(differences) + 1.0)
+            self.formula = None
+        func, val = self.difference_func, self.val
+        return [1.0 / (abs(func(val, x)) + 1.0) for x in floats]
+
+# Cache of parsed configurations, shared by all the SearchConnections in the
+# process, keyed by the raw configuration string.  The parsed configurations
+# are never modified by a SearchConnection, so can safely be shared.
+_config_cache = {}
+_config_cache_order = []
+_config_cache_lock = threading.Lock()
+_config_cache_maxsize = 16
+
+def _parse_config(config_str):
+    """Parse the configuration of a database.
+
+    Returns a tuple of (field_actions, field_mappings, facet_hierarchy,
+    facet_query_table, next_docid).  The result is cached, so parsing the same
+    configuration again is cheap: the result must not be modified.
+
+    """
+    _config_cache_lock.acquire()
+    try:
+        try:
+            result = _config_cache[config_str]
+            _config_cache_order.remove(config_str)
+            _config_cache_order.append(config_str)
+            return result
+        except KeyError:
+            pass
+    finally:
+        _config_cache_lock.release()
+
+    # Note: this code is basically duplicated in the IndexerConnection
+    # class.  Move it to a shared location.
+    if len(config_str) == 0:
+        return (ActionSet(), fieldmappings.FieldMappings(), {}, {}, 0)
+
+    field_actions = ActionSet()
+    try:
+        (actions,
+         mappings,
+         facet_hierarchy,
+         facet_query_table,
+         next_docid) = _cPickle.loads(config_str)
+        field_actions.actions = actions
+        # Backwards compatibility; there used to only be one parent.
+        for key in facet_hierarchy:
+            parents = facet_hierarchy[key]
+            if isinstance(parents, basestring):
+                parents = [parents]
+                facet_hierarchy[key] = parents
+    except ValueError:
+        # Backwards compatibility - configuration used to lack _facet_hierarchy and _facet_query_table
+        (actions,
+         mappings,
+         next_docid) = _cPickle.loads(config_str)
+        field_actions.actions = actions
+        facet_hierarchy = {}
+        facet_query_table = {}
+    result = (field_actions, fieldmappings.FieldMappings(mappings),
+              facet_hierarchy, facet_query_table, next_docid)
+
+    _config_cache_lock.acquire()
+    try:
+        if config_str not in _config_cache:
+            _config_cache[config_str] = result
+            _config_cache_order.append(config_str)
+            while len(_config_cache_order) > _config_cache_maxsize:
+                del _config_cache[_config_cache_order.pop(0)]
+    finally:
+        _config_cache_lock.release()
+    return result
+
+def _configs_compatible(config1, config2):
+    """Check whether two parsed configurations are compatible.
+
+    Configurations are compatible if they have the same actions for each
+    field, and the same prefixes and slots are used for each field.
+
+    """
+    actions1, mappings1 = config1[:2]
+    actions2, mappings2 = config2[:2]
+    if mappings1._prefixes != mappings2._prefixes or \
+       mappings1._slots != mappings2._slots:
+        return False
+    if set(actions1) != set(actions2):
+        return False
+    for field in actions1:
+        if actions1[field]._actions != actions2[field]._actions:
+            return False
+    return True
+
+class _BatchExternalWeightPostingSource(xapian.PostingSource):
+    """A posting source reading weights in batches from an
+    ExternalWeightSource.
+
+    The documents are read in blocks, and the values needed for each block
+    are read from the value streams for the slots, so the documents
+    themselves don't need to be read.
+
+    """
+    def __init__(self, wtsource, slots):
+        xapian.PostingSource.__init__(self)
+        self.wtsource = wtsource
+        self.slots = slots
+
+    def init(self, xapdb):
+        self.doccount = xapdb.get_doccount()
+        self.alldocs = xapdb.postlist('')
+        self.streams = [xapdb.valuestream(slot) for slot in self.slots]
+        self.items = [None] * len(self.slots)
+        self.docids = []
+        self.weights = []
+        self.pos = 0
+        self.ended = False
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return 0
+    def get_termfreq_est(self): return self.doccount
+    def get_termfreq_max(self): return self.doccount
+
+    def _read_values(self, num, docids):
+        """Read the values in a slot for a list of documents.
+
+        `num` is the index of the slot in self.slots.
+
+        """
+        stream = self.streams[num]
+        if stream is None:
+            # No more values in the slot.
+            return [''] * len(docids)
+        item = self.items[num]
+        result = []
+        for docid in docids:
+            try:
+                if item is None or item.docid < docid:
+                    if hasattr(stream, 'skip_to'):
+                        item = stream.skip_to(docid)
+                    else:
+                        # backwards compatibility
+                        item = stream.next()
+                        while item.docid < docid:
+                            item = stream.next()
+            except StopIteration:
+                # No more values in the slot.
+                self.streams[num] = None
+                result.extend([''] * (len(docids) - len(result)))
+                break
+            if item.docid == docid:
+                result.append(item.value)
+            else:
+                result.append('')
+        self.items[num] = item
+        return result
+
+    def _load_block(self, docid):
+        """Load the block of documents starting with the first document whose
+        ID is at least `docid`.
+
+        """
+        docids = []
+        try:
+            docids.append(self.alldocs.skip_to(docid).docid)
+            while len(docids) < self.wtsource.batch_size:
+                docids.append(self.alldocs.next().docid)
+        except StopIteration:
+            pass
+        self.docids = docids
+        self.pos = 0
+        if len(docids) == 0:
+            self.weights = []
+            self.ended = True
+            return
+        values = [self._read_values(num, docids)
+                  for num in xrange(len(self.slots))]
+        self.weights = self.wtsource.get_weights(docids, values)
+        if len(self.weights) != len(docids):
+            raise errors.SearchError("ExternalWeightSource.get_weights() "
+                                     "returned the wrong number of weights")
+
+    def next(self, minweight):
+        if len(self.docids) == 0:
+            self._load_block(1)
+            return
+        self.pos += 1
+        if self.pos == len(self.docids):
+            self._load_block(self.docids[-1] + 1)
+
+    def skip_to(self, docid, minweight):
+        if len(self.docids) != 0:
+            if docid <= self.docids[self.pos]:
+                return
+            if docid <= self.docids[-1]:
+                self.pos = bisect.bisect_left(self.docids, docid, self.pos)
+                return
+        self._load_block(docid)
+
+    def at_end(self):
+        return self.ended
+
+    def get_docid(self):
+        return self.docids[self.pos]
+
+    def get_maxweight(self):
+        return self.wtsource.get_maxweight()
+
+    def get_weight(self):
+        return float(self.weights[self.pos])
+
+class _DeadlinePostingSource(xapian.PostingSource):
+    """A posting source which matches all documents until a deadline passes.
+
+    This is used to filter a query, so that the match stops (returning the
+    results found so far) once the deadline has passed.  It is only used if
+    xapian doesn't support setting a time limit on the match directly.
+
+    """
+    # Number of documents to check between each check of the time.
+    _check_interval = 64
+
+    def __init__(self, deadline):
+        xapian.PostingSource.__init__(self)
+        self.deadline = deadline
+        self.expired = False
+        self.current = 0
+        self.lastdocid = 0
+        self.doccount = 0
+
+    def init(self, xapdb):
+        self.lastdocid = xapdb.get_lastdocid()
+        self.doccount = xapdb.get_doccount()
+        self.current = 0
+        self.calls = 0
+        self.ended = False
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return 0
+    def get_termfreq_est(self): return self.doccount
+    def get_termfreq_max(self): return self.doccount
+
+    def next(self, minweight):
+        self.skip_to(self.current + 1, minweight)
+
+    def skip_to(self, docid, minweight):
+        if docid > self.current:
+            self.current = docid
+        if self.current > self.lastdocid:
+            self.ended = True
+            return
+        self.calls += 1
+        if self.calls % self._check_interval == 0 and \
+           time.time() >= self.deadline:
+            self.expired = True
+            self.ended = True
+
+    def at_end(self):
+        return self.ended
+
+    def get_docid(self):
+        return self.current
+
+    def get_maxweight(self):
+        return 0
+
+    def get_weight(self):
+        return 0
+
+def _make_hashable(fields):
+    """Convert a field name, or list of field names, to a hashable form.
+
+    """
+    if fields is None or isinstance(fields, basestring):
+        return fields
+    return tuple(fields)
+
+def _array_size(arr):
+    """Get the size of an array, in bytes.
+
+    """
+    return arr.itemsize * len(arr)
+
+class _DocidSetPostingSource(xapian.PostingSource):
+    """A posting source which matches a fixed set of documents.
+
+    The documents are given as a sorted array of xapian document IDs, which
+    is searched with a binary search when skipping.  All documents are given
+    a weight of 0.
+
+    """
+    def __init__(self, docids):
+        xapian.PostingSource.__init__(self)
+        self.docids = docids
+        self.pos = -1
+
+    def init(self, xapdb):
+        self.pos = -1
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return len(self.docids)
+    def get_termfreq_est(self): return len(self.docids)
+    def get_termfreq_max(self): return len(self.docids)
+
+    def next(self, minweight):
+        self.pos += 1
+
+    def skip_to(self, docid, minweight):
+        if self.pos < 0:
+            self.pos = bisect.bisect_left(self.docids, docid)
+        elif self.pos < len(self.docids) and self.docids[self.pos] < docid:
+            self.pos = bisect.bisect_left(self.docids, docid, self.pos)
+
+    def at_end(self):
+        return self.pos >= len(self.docids)
+
+    def get_docid(self):
+        return self.docids[self.pos]
+
+    def get_maxweight(self):
+        return 0
+
+    def get_weight(self):
+        return 0
+
+class _DocidRangePostingSource(xapian.PostingSource):
+    """A posting source which matches all documents in a range of docids.
+
+    This is used to filter a query, for example so that it only returns
+    documents in the part of the database allocated to a parallel search
+    worker.
+
+    """
+    def __init__(self, begin, end):
+        xapian.PostingSource.__init__(self)
+        self.begin = begin
+        self.end = end
+        self.current = 0
+
+    def init(self, xapdb):
+        self.end = min(self.end, xapdb.get_lastdocid())
+        self.current = self.begin - 1
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return 0
+    def get_termfreq_est(self): return max(0, self.end - self.begin + 1)
+    def get_termfreq_max(self): return max(0, self.end - self.begin + 1)
+
+    def next(self, minweight):
+        self.current += 1
+
+    def skip_to(self, docid, minweight):
+        if docid > self.current:
+            self.current = max(docid, self.begin)
+
+    def at_end(self):
+        return self.current > self.end
+
+    def get_docid(self):
+        return self.current
+
+    def get_maxweight(self):
+        return 0
+
+    def get_weight(self):
+        return 0
+
+# The position of the lowest set bit in each non-zero byte value.
+_lowest_bit = [0] * 256
+for _byte in xrange(1, 256):
+    while not (_byte >> _lowest_bit[_byte]) & 1:
+        _lowest_bit[_byte] += 1
+del _byte
+
+_nonzero_byte_re = re.compile('[^\x00]')
+
+class _DocidBitmap(object):
+    """A compressed set of xapian document IDs.
+
+    Sparse sets are held as a sorted array of document IDs, and dense sets as
+    a bitmap with a bit for each document ID, whichever is smaller.
+
+    """
+    def __init__(self, docids, lastdocid):
+        """Make the set from a sorted array of document IDs.
+
+        """
+        self.count = len(docids)
+        bitmap_size = lastdocid // 8 + 1
+        if _array_size(docids) <= bitmap_size:
+            self.docids = docids
+            self.bitmap = None
+            self.nbytes = _array_size(docids)
+        else:
+            bits = array.array('B', '\0' * bitmap_size)
+            for docid in docids:
+                bits[docid >> 3] |= 1 << (docid & 7)
+            self.docids = None
+            self.bitmap = bits.tostring()
+            self.nbytes = bitmap_size
+
+    def posting_source(self):
+        """Get a posting source which matches the documents in the set.
+
+        """
+        if self.bitmap is None:
+            return _DocidSetPostingSource(self.docids)
+        return _DocidBitmapPostingSource(self.bitmap, self.count)
+
+if 'facets' not in _checkxapian.missing_features:
+    class _DocidCollector(xapian.MatchSpy):
+        """A match spy which collects the IDs of the documents it sees.
+
+        `ordered` is set to False if the documents aren't seen in ascending
+        order of ID.
+
+        """
+        def __init__(self):
+            xapian.MatchSpy.__init__(self)
+            self.docids = array.array('I')
+            self.ordered = True
+            self.last = 0
+
+        def __call__(self, doc, wt):
+            docid = doc.get_docid()
+            if docid < self.last:
+                self.ordered = False
+            self.last = docid
+            self.docids.append(docid)
+
+def _bitmap_size(bitmap):
+    """Get the size of a _DocidBitmap, in bytes.
+
+    """
+    return bitmap.nbytes
+
+class _DocidBitmapPostingSource(xapian.PostingSource):
+    """A posting source which matches the documents set in a bitmap.
+
+    The bitmap is a string, holding a bit for each document ID (with the
+    lowest bit of the first byte representing document ID 0).  All documents
+    are given a weight of 0.
+
+    """
+    def __init__(self, bitmap, count):
+        xapian.PostingSource.__init__(self)
+        self.bitmap = bitmap
+        self.count = count
+        self.current = 0
+        self.ended = False
+
+    def init(self, xapdb):
+        self.current = 0
+        self.ended = False
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return self.count
+    def get_termfreq_est(self): return self.count
+    def get_termfreq_max(self): return self.count
+
+    def next(self, minweight):
+        self.skip_to(self.current + 1, minweight)
+
+    def skip_to(self, docid, minweight):
+        if docid <= self.current:
+            return
+        bitmap = self.bitmap
+        pos = docid >> 3
+        if pos < len(bitmap):
+            bits = ord(bitmap[pos]) >> (docid & 7)
+            if bits:
+                self.current = docid + _lowest_bit[bits]
+                return
+            m = _nonzero_byte_re.search(bitmap, pos + 1)
+            if m is not None:
+                pos = m.start()
+                self.current = pos * 8 + _lowest_bit[ord(bitmap[pos])]
+                return
+        self.ended = True
+
+    def at_end(self):
+        return self.ended
+
+    def get_docid(self):
+        return self.current
+
+    def get_maxweight(self):
+        return 0
+
+    def get_weight(self):
+        return 0
+
+# Matches a weight scaling factor at the start of the description of a
+# query, as produced by OP_SCALE_WEIGHT.
+_scale_weight_re = re.compile(r'^-?[0-9.]+(?:e[-+]?[0-9]+)? \* ')
+
+# Matches the suffix of the description of a single term query holding the
+# within query frequency and position of the term.
+_term_suffix_re = re.compile(r'^(?:#[0-9]+)?(?:@[0-9]+)?(?::\(pos=[0-9]+\))?$')
+
+def _get_single_term(xapq):
+    """Get the term of a query which matches the documents containing a term.
+
+    Scaled weights, and the positions and within query frequency of terms,
+    are ignored, since they don't change which documents match.  Returns ''
+    for a query matching all documents, or None if the query isn't a single
+    term.
+
+    """
+    if hasattr(xapq, 'get_type'):
+        # Newer versions of xapian allow the query to be walked directly.
+        while xapq.get_type() == xapian.Query.OP_SCALE_WEIGHT:
+            xapq = xapq.get_subquery(0)
+        if xapq.get_type() == xapian.Query.LEAF_MATCH_ALL:
+            return ''
+        if xapq.get_type() != xapian.Query.LEAF_TERM:
+            return None
+        return list(xapq)[0]
+
+    # Otherwise, the structure of the query has to be read from its
+    # description.
+    description = xapq.get_description()
+    if description == xapian.Query('').get_description():
+        return ''
+    terms = list(xapq)
+    if len(terms) != 1:
+        return None
+    term = terms[0]
+    prefix = 'Xapian::Query('
+    if not description.startswith(prefix) or not description.endswith(')'):
+        return None
+    desc = description[len(prefix):-1]
+    while True:
+        match = _scale_weight_re.match(desc)
+        if match is None:
+            break
+        desc = desc[match.end():]
+        if desc.startswith('(') and desc.endswith(')'):
+            desc = desc[1:-1]
+    if not desc.startswith(term):
+        return None
+    if _term_suffix_re.match(desc[len(term):]) is None:
+        return None
+    return term
+
+_hash_mask = (1 << 64) - 1
+
+def _sample_hash(seed, docid):
+    """Hash a document ID, with a seed, to a 64 bit integer.
+
+    This is the finaliser of the SplitMix64 generator, which mixes the bits
+    of consecutive inputs thoroughly.
+
+    """
+    z = (seed + docid * 0x9E3779B97F4A7C15) & _hash_mask
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _hash_mask
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _hash_mask
+    return z ^ (z >> 31)
+
+class _SamplePostingSource(xapian.PostingSource):
+    """A posting source which matches a random sample of the documents.
+
+    Each document is matched with probability `rate`.  The document IDs are
+    divided into blocks, each holding `_block_samples` sampled documents on
+    average, and the sampled documents in a block are found by taking
+    geometrically distributed steps through it, drawn from a hash of the
+    block number seeded with `seed`.  The same seed therefore always gives
+    the same sample, however the posting source is accessed.  Moving to the
+    next sampled document, and check(), only need the sample for one block,
+    so take constant time however many documents are skipped, and when
+    filtering a query which matches few documents, only the blocks holding
+    those documents are sampled.  All documents are given a weight of 0.
+
+    """
+    # The average number of sampled documents in each block of IDs.
+    _block_samples = 16
+
+    def __init__(self, rate, seed):
+        xapian.PostingSource.__init__(self)
+        self.rate = rate
+        self.seed = seed
+        self.blocksize = max(1, int(math.ceil(self._block_samples / rate)))
+        if rate >= 1:
+            self.logq = float('-inf')
+        else:
+            self.logq = math.log(1.0 - rate)
+        self.block = None
+        self.blockdocids = []
+        self.lastdocid = 0
+        self.doccount = 0
+        self.current = 0
+
+    def init(self, xapdb):
+        self.lastdocid = xapdb.get_lastdocid()
+        self.doccount = xapdb.get_doccount()
+        self.current = 0
+
+    def reset(self, xapdb):
+        # backwards compatibility
+        self.init(xapdb)
+
+    def get_termfreq_min(self): return 0
+    def get_termfreq_est(self): return int(self.doccount * self.rate)
+    def get_termfreq_max(self): return self.doccount
+
+    def _get_block(self, block):
+        """Get a sorted list of the sampled document IDs in a block.
+
+        """
+        if block != self.block:
+            blockseed = _sample_hash(self.seed, block)
+            docid = block * self.blocksize
+            end = docid + self.blocksize
+            docids = []
+            draw = 0
+            while True:
+                # The gap to the next sampled document is geometrically
+                # distributed: u is uniform in (0, 1].
+                u = (_sample_hash(blockseed, draw) + 1) / 18446744073709551616.0
+                draw += 1
+                docid += int(math.log(u) / self.logq) + 1
+                if docid > end:
+                    break
+                docids.append(docid)
+            self.block = block
+            self.blockdocids = docids
+        return self.blockdocids
+
+    def _move_to(self, docid):
+        """Move to the first document in the sample at or after `docid`.
+
+        """
+        while docid <= self.lastdocid:
+            block = (docid - 1) // self.blocksize
+            docids = self._get_block(block)
+            pos = bisect.bisect_left(docids, docid)
+            if pos < len(docids):
+                docid = docids[pos]
+                break
+            docid = (block + 1) * self.blocksize + 1
+        self.current = docid
+
+    def next(self, minweight):
+        self._move_to(self.current + 1)
+
+    def skip_to(self, docid, minweight):
+        if docid > self.current:
+            self._move_to(docid)
+
+    def check(self, docid, minweight):
+        # Position on the document, and report whether it's in the sample:
+        # if not, next() will be called to move on.
+        if docid > self.current:
+            self.current = docid
+        docids = self._get_block((self.current - 1) // self.blocksize)
+        pos = bisect.bisect_left(docids, self.current)
+        return pos < len(docids) and docids[pos] == self.current
+
+    def at_end(self):
+        return self.current > self.lastdocid
+
+    def get_docid(self):
+        return self.current
+
+    def get_maxweight(self):
+        return 0
+
+    def get_weight(self):
+        return 0
+
 class SearchConnection(object):
     """A connection to the search engine for searching.
 
@@ -80,6 +850,43 @@ class SearchConnection(object):
 
     _index = None
 
+    # The raw configuration string which the configuration was last loaded
+    # from.
+    _config_str = None
+
+    # The maximum total size (in bytes) of the resolved document ID sets
+    # cached by query_id_set().
+    _id_set_cache_size = 16 * 1024 * 1024
+
+    # The maximum total size (in bytes) of the filters cached by
+    # query_cached_filter().
+    _filter_cache_size = 32 * 1024 * 1024
+
+    # The maximum number of expand results cached for query_similar() and
+    # significant_terms().
+    _expand_cache_size = 1000
+
+    # The maximum number of spelling corrections cached by spell_correct().
+    _spell_cache_size = 10000
+
+    # The maximum number of facets cached for facet views (see
+    # add_facet_view()).
+    _facet_view_cache_size = 1000
+
+    # The ProfileAggregator which profiles of all searches are added to, or
+    # None.
+    _profile_aggregator = None
+
+    # The slot used by the matchspy which counts the documents examined when
+    # profiling a search.  No values are ever stored in this slot.
+    _profile_slot = 0xfffffffe
+
+    # If not None, the proportion of the matches to count facets on when a
+    # facet_sample_size is given to search(), instead of a proportion
+    # calculated from the number of matches.  This is set by the workers of a
+    # ParallelSearchConnection, so that they all use the same proportion.
+    _facet_sample_rate = None
+
     # Slots after this number are used for the cache manager.
     # FIXME - don't hard-code this - put it in the settings instead?
     _cache_manager_slot_start = 10000
@@ -91,13 +898,31 @@ class SearchConnection(object):
         particular database open at a given time (regardless of whether there
         is a connection for indexing open as well).
 
+        `indexpath` may also be a list of paths, to search several databases
+        (or "shards") together, as if they were a single database.  The
+        shards must all have compatible configurations (ie, the same field
+        actions, with the same prefixes and slots); this will be the case if
+        they were all set up in the same way.  Statistics for weighting and
+        facets are calculated over the combined database.  Document IDs
+        (ie, xapids) refer to the combined database: use get_shard() to map
+        them back to the shard which holds the document.
+
         If the database doesn't exist, an exception will be raised.
 
         """
         self.cache_manager = None
         self._indexpath = indexpath
         self._close_handlers = []
-        self._index = xapian.Database(indexpath)
+        if isinstance(indexpath, basestring):
+            self._index = xapian.Database(indexpath)
+            self._shards = [self._index]
+        else:
+            if len(indexpath) == 0:
+                raise errors.SearchError("No databases specified")
+            self._shards = [xapian.Database(path) for path in indexpath]
+            self._index = xapian.Database()
+            for shard in self._shards:
+                self._index.add_database(shard)
         try:
             # Read the actions.
             self._load_config()
@@ -108,6 +933,38 @@ class SearchConnection(object):
             raise
         self._imgterms_cache = {}
 
+        # Map from an MD5 digest of a sorted tuple of document IDs to the
+        # sorted array of xapids for those documents, for the current
+        # revision of the database.  The digest is used so that large sets
+        # of IDs aren't kept in the cache (uncounted by its size limit).
+        self._id_set_cache = lrucache.LRUCache(self._id_set_cache_size,
+                                               _array_size)
+
+        # Map from the serialised form of a filter query to a _DocidBitmap
+        # holding the documents which match it, for the current revision of
+        # the database.
+        self._filter_cache = lrucache.LRUCache(self._filter_cache_size,
+                                               _bitmap_size)
+
+        # Map from (ids, prefixes, number of terms) to the terms returned by
+        # an expand, for the current revision of the database.
+        self._expand_cache = lrucache.LRUCache(self._expand_cache_size)
+
+        # Map from the arguments to spell_correct() to the corrected query
+        # string, for the current revision of the database.
+        self._spell_cache = lrucache.LRUCache(self._spell_cache_size)
+
+        # Map from facet view name to the serialised form of the view's query.
+        self._facet_views = {}
+
+        # The serialised form of query_all(), or None if not yet calculated.
+        self._query_all_key = None
+
+        # Map from (serialised view query, field name, desired number of
+        # categories, quantile sketch size) to the values of the facet for the
+        # view, for the current revision of the database.
+        self._facet_view_cache = lrucache.LRUCache(self._facet_view_cache_size)
+
     def __del__(self):
         self.close()
 
@@ -156,72 +1013,134 @@ class SearchConnection(object):
     def _load_config(self):
         """Load the configuration for the database.
 
+        The parsed configuration is shared with other connections with the
+        same configuration (see _parse_config()), so it is only parsed again
+        if the configuration has changed.
+
         """
-        # Note: this code is basically duplicated in the IndexerConnection
-        # class.  Move it to a shared location.
         assert self._index is not None
 
+        # Note that the shards share their internals with self._index, so
+        # they're reopened whenever it is.
         while True:
             try:
-                config_str = self._index.get_metadata('_xappy_config')
+                config_strs = tuple([shard.get_metadata('_xappy_config')
+                                     for shard in self._shards])
                 break
             except xapian.DatabaseModifiedError, e:
                 # Don't call self.reopen() since that calls _load_config()!
                 self._index.reopen()
 
-        if len(config_str) == 0:
-            self._field_actions = ActionSet()
-            self._field_mappings = fieldmappings.FieldMappings()
-            self._next_docid = 0
-            self._facet_hierarchy = {}
-            self._facet_query_table = {}
-            return
-
-        try:
-            (actions,
-             mappings,
+        if config_strs != self._config_str:
+            config = _parse_config(config_strs[0])
+            for num in xrange(1, len(config_strs)):
+                if not _configs_compatible(config,
+                                           _parse_config(config_strs[num])):
+                    raise errors.SearchError("Configuration of database %r "
+                                             "is not compatible with that "
+                                             "of database %r" %
+                                             (self._indexpath[num],
+                                              self._indexpath[0]))
+            (self._field_actions,
+             self._field_mappings,
              self._facet_hierarchy,
              self._facet_query_table,
-             self._next_docid) = _cPickle.loads(config_str)
-            self._field_actions = ActionSet()
-            self._field_actions.actions = actions
-            # Backwards compatibility; there used to only be one parent.
-            for key in self._facet_hierarchy:
-                parents = self._facet_hierarchy[key]
-                if isinstance(parents, basestring):
-                    parents = [parents]
-                    self._facet_hierarchy[key] = parents
-        except ValueError:
-            # Backwards compatibility - configuration used to lack _facet_hierarchy and _facet_query_table
-            (actions,
-             mappings,
-             self._next_docid) = _cPickle.loads(config_str)
-            self._field_actions = ActionSet()
-            self._field_actions.actions = actions
-            self._facet_hierarchy = {}
-            self._facet_query_table = {}
-        self._field_mappings = fieldmappings.FieldMappings(mappings)
+             self._config_next_docid) = config
+            self._config_str = config_strs
+
+        self._next_docid = max([_get_next_docid(shard, self._config_next_docid)
+                                for shard in self._shards])
+        if len(config_strs[0]) == 0:
+            return
+
+        if len(self._shards) > 1:
+            self._load_shard_cache_managers()
+            return
 
         if self._index.get_metadata('_xappy_hascache'):
-            self.cache_manager = cachemanager.XapianCacheManager(self._indexpath)
-            # Make the cache manager use the same index connection as this
-            # index, since it's subordinate to it.
-            self.cache_manager.db = self._index
-            self.cache_manager.writable = False
+            if not isinstance(self.cache_manager,
+                              cachemanager.XapianCacheManager) or \
+               self.cache_manager.db is not self._index:
+                self.cache_manager = cachemanager.XapianCacheManager(self._indexpath)
+                # Make the cache manager use the same index connection as this
+                # index, since it's subordinate to it.
+                self.cache_manager.db = self._index
+                self.cache_manager.writable = False
+
+    def _load_shard_cache_managers(self):
+        """Set the cache manager to combine the caches of the shards.
+
+        This is only done if every shard has a cache.
+
+        """
+        if isinstance(self.cache_manager, cachemanager.ShardedCacheManager):
+            return
+        for shard in self._shards:
+            if not shard.get_metadata('_xappy_hascache'):
+                return
+        managers = []
+        for path, shard in zip(self._indexpath, self._shards):
+            manager = cachemanager.XapianCacheManager(path)
+            manager.db = shard
+            manager.writable = False
+            managers.append(manager)
+        self.cache_manager = cachemanager.ShardedCacheManager(managers)
+
+    def get_shard(self, xapid):
+        """Get the shard which holds a document.
+
+        `xapid` is the xapian document ID of the document in this connection
+        (for example, as returned by `SearchResult.get_xapid()`).
+
+        Returns a tuple of (shard, shard_xapid), where `shard` is the index of
+        the shard in the list of paths passed when the connection was created
+        (always 0 if a single path was passed), and `shard_xapid` is the
+        xapian document ID of the document in that shard.
+
+        """
+        numshards = len(self._shards)
+        return (xapid - 1) % numshards, (xapid - 1) // numshards + 1
+
+    def _get_combined_xapid(self, shard, shard_xapid):
+        """Get the xapian document ID for a document in a shard.
+
+        """
+        return (shard_xapid - 1) * len(self._shards) + shard + 1
 
     def reopen(self):
         """Reopen the connection.
 
         This updates the revision of the index which the connection references
-        to the latest flushed revision.
+        to the latest flushed revision.  The data cached by the connection is
+        discarded, unless the revision is unchanged.
 
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
+        revision = self._get_revision()
         self._index.reopen()
+        if revision is None or revision != self._get_revision():
+            # The cached data may be out of date.
+            self._id_set_cache.clear()
+            self._filter_cache.clear()
+            self._expand_cache.clear()
+            self._spell_cache.clear()
+            self._facet_view_cache.clear()
         # Re-read the actions.
         self._load_config()
 
+    def _get_revision(self):
+        """Get the revision of the database which the connection references.
+
+        Returns None if the revision isn't available (if xapian doesn't
+        support getting it, or when searching several shards).
+
+        """
+        if len(self._shards) > 1 or \
+           not hasattr(self._index, 'get_revision'):
+            return None
+        return self._index.get_revision()
+
     def close(self):
         """Close the connection to the database.
 
@@ -254,6 +1173,7 @@ class SearchConnection(object):
             # case in __init__.
             pass
         self._index = None
+        self._shards = None
         self._indexpath = None
         self._field_actions = None
         self._field_mappings = None
@@ -335,7 +1255,7 @@ class SearchConnection(object):
             raise errors.SearchError("SearchConnection has been closed")
         return Query(query) * multiplier
 
-    def query_filter(self, query, filter, exclude=False):
+    def query_filter(self, query, filter, exclude=False, cache=False):
         """Filter a query with another query.
 
         If exclude is False (or not specified), documents will only match the
@@ -354,10 +1274,15 @@ class SearchConnection(object):
         - `filter`: The filter to apply to the query.
         - `exclude`: If True, the sense of the filter is reversed - only
           documents which do not match the second query will be returned.
+        - `cache`: If True, the documents matching the filter are cached, as
+          for query_cached_filter().  This is worthwhile for filters which
+          are used repeatedly.
 
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
+        if cache:
+            filter = self.query_cached_filter(filter)
         try:
             if exclude:
                 return query.and_not(filter)
@@ -366,6 +1291,118 @@ class SearchConnection(object):
         except TypeError:
             raise errors.SearchError("Filter must be a Xapian Query object")
 
+    def query_cached_filter(self, filter):
+        """A query which matches the same documents as a cached filter query.
+
+        The first time a filter is used, the documents which match it are
+        found, and stored in a compressed bitmap (or, for sparse filters, a
+        sorted list of document IDs).  Subsequent uses of the same filter
+        (until the connection is reopened) use the stored documents instead
+        of running the filter query again.  The resulting query returns a
+        weight of 0 for each document, so should be used as a filter (for
+        example, with query_filter()).
+
+        Filters are identified by their serialised form, so only serialisable
+        queries may be cached.  The cache is limited in size; the least
+        recently used filters are discarded when it is full, unless they have
+        been pinned with pin_filter().
+
+        When searching several shards, the filter is returned unchanged,
+        since the matching can't then be done in python.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        key = self._get_filter_key(filter)
+        serialised = "conn.query_cached_filter(%s)" % key
+        if len(self._shards) > 1:
+            return Query(filter, _conn=self, _serialised=serialised)
+        bitmap = self._filter_cache.get(key)
+        if bitmap is None:
+            bitmap = self._materialise_filter(filter)
+            self._filter_cache.set(key, bitmap)
+        ps = bitmap.posting_source()
+        return Query(xapian.Query(ps), _refs=[ps], _conn=self,
+                     _serialised=serialised)
+
+    def pin_filter(self, filter):
+        """Pin a filter in the cache used by query_cached_filter().
+
+        The documents matching a pinned filter are never discarded to make
+        room in the cache.  This is useful for filters which are known to be
+        used frequently.  The documents are still recalculated (the next time
+        the filter is used) when the connection is reopened.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        self._filter_cache.pin(self._get_filter_key(filter))
+
+    def unpin_filter(self, filter):
+        """Unpin a filter pinned by pin_filter().
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        self._filter_cache.unpin(self._get_filter_key(filter))
+
+    def get_filter_cache_stats(self):
+        """Get statistics about the cache used by query_cached_filter().
+
+        Returns a dict holding the number of `hits`, `misses` and `evictions`,
+        the `hit_rate` (the proportion of lookups which were hits, or None if
+        there have been no lookups), the number of `entries` and of `pinned`
+        filters, and the total `size` and `maxsize` of the cache, in bytes.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        return self._filter_cache.get_stats()
+
+    def _get_filter_key(self, filter):
+        """Get the key used to store a filter in the filter cache.
+
+        """
+        if not isinstance(filter, Query):
+            raise errors.SearchError("Filter must be a Xapian Query object")
+        key = filter.evalable_repr()
+        if key is None:
+            raise errors.SearchError("Only serialisable filters may be "
+                                     "cached")
+        return key
+
+    def _materialise_filter(self, filter):
+        """Find the documents matching a filter, as a _DocidBitmap.
+
+        The document IDs are collected by a match spy, during a match which
+        returns no items, so that no MSet items need to be built for them.
+
+        """
+        while True:
+            try:
+                enq = xapian.Enquire(self._index)
+                enq.set_query(filter._get_xapian_query())
+                weight = xapian.BoolWeight()
+                enq.set_weighting_scheme(weight)
+                enq.set_docid_order(enq.ASCENDING)
+                doccount = self._index.get_doccount()
+                if 'facets' in _checkxapian.missing_features:
+                    # backwards compatibility
+                    mset = enq.get_mset(0, doccount)
+                    docids = array.array('I', [item.docid for item in mset])
+                else:
+                    spy = _DocidCollector()
+                    enq.add_matchspy(spy)
+                    enq.get_mset(0, 0, doccount)
+                    docids = spy.docids
+                    if not spy.ordered:
+                        docids = array.array('I', sorted(docids))
+                lastdocid = self._index.get_lastdocid()
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        return _DocidBitmap(docids, lastdocid)
+
     def query_adjust(self, primary, secondary):
         """Adjust the weights of one query with a secondary query.
 
@@ -476,8 +1513,108 @@ class SearchConnection(object):
             return q, self._RANGE_EXACT
         return q, self._RANGE_SUPERSET
 
+    def _get_precision_step(self, field, prefix):
+        """Get the precision step for automatic range terms with a prefix.
+
+        """
+        for kwargslist in self._field_actions[field]._actions.itervalues():
+            for kwargs in kwargslist:
+                if kwargs.get('_range_accel_prefix') == prefix:
+                    return kwargs.get('precision_step', 4)
+        raise errors.SearchError("Internal xappy error, no precision_step for "
+                                 "field: " + field)
+
+    def _build_range_query_trie(self, field, prefix, begin, end,
+                                conservative, exact, query_ranges):
+        """Build a range query using automatically generated range terms.
+
+        The range is divided into the largest cells which fit inside it; any
+        parts of the range not covered by a whole cell of the smallest size
+        lie in the (at most two) smallest cells which hold the ends of the
+        range.  If `exact` is true, these edge cells are included, but
+        filtered by checking the values in the slot, so the query matches the
+        range exactly.  Otherwise, the edge cells are left out if
+        `conservative` is true (giving a subset of the range), or included
+        without checking (giving a superset of the range).
+
+        """
+        precision_step = self._get_precision_step(field, prefix)
+        if begin is None:
+            lo = 0
+        else:
+            lo = convert_value_to_trie_key(begin)
+        if end is None:
+            hi = (1L << TRIE_KEY_BITS) - 1
+        else:
+            hi = convert_value_to_trie_key(end)
+        if lo > hi:
+            return Query(xapian.Query(), _conn=self,
+                         _ranges=query_ranges) * 0, self._RANGE_EXACT
+
+        terms = []
+        edges = []
+        def add_cells(lo, hi, shift):
+            if shift == 0:
+                # No terms are stored for single values, so use the smallest
+                # cells holding the values.
+                cells, shift = edges, precision_step
+            else:
+                cells = terms
+            cell, last = lo >> shift, hi >> shift
+            while cell <= last:
+                cells.append(convert_trie_cell_to_term(prefix, shift, cell))
+                cell += 1
+
+        shift = 0
+        while True:
+            diff = 1L << (shift + precision_step)
+            mask = ((1L << precision_step) - 1) << shift
+            has_lower = (lo & mask) != 0
+            has_upper = (hi & mask) != mask
+            next_lo = (lo + diff if has_lower else lo) & ~mask
+            next_hi = (hi - diff if has_upper else hi) & ~mask
+            if shift + precision_step >= TRIE_KEY_BITS or next_lo > next_hi:
+                add_cells(lo, hi, shift)
+                break
+            if has_lower:
+                add_cells(lo, lo | mask, shift)
+            if has_upper:
+                add_cells(hi & ~mask, hi, shift)
+            lo, hi = next_lo, next_hi
+            shift += precision_step
+
+        if len(edges) == 0:
+            conservative, exact = True, True
+        if conservative and not exact:
+            if len(terms) == 0:
+                return Query(_conn=self, _ranges=query_ranges) * 0, \
+                       self._RANGE_NONE
+            edges = []
+        xapq = xapian.Query(xapian.Query.OP_OR, terms)
+        if len(edges) != 0:
+            edgeq = xapian.Query(xapian.Query.OP_OR, edges)
+            if exact:
+                slot, marshalled_begin, marshalled_end = query_ranges[0]
+                if marshalled_begin is None:
+                    checkq = xapian.Query(xapian.Query.OP_VALUE_LE, slot,
+                                          marshalled_end)
+                elif marshalled_end is None:
+                    checkq = xapian.Query(xapian.Query.OP_VALUE_GE, slot,
+                                          marshalled_begin)
+                else:
+                    checkq = xapian.Query(xapian.Query.OP_VALUE_RANGE, slot,
+                                          marshalled_begin, marshalled_end)
+                edgeq = xapian.Query(xapian.Query.OP_FILTER, edgeq, checkq)
+            xapq = xapian.Query(xapian.Query.OP_OR, xapq, edgeq)
+        q = Query(xapq, _conn=self, _ranges=query_ranges) * 0
+        if exact:
+            return q, self._RANGE_EXACT
+        if conservative:
+            return q, self._RANGE_SUBSET
+        return q, self._RANGE_SUPERSET
+
     def _range_accel_query(self, field, begin, end, prefix, ranges,
-                           conservative, query_ranges):
+                           conservative, query_ranges, exact=False):
         """Construct a range acceleration query.
 
         Returns a 2-tuple containing:
@@ -509,6 +1646,11 @@ class SearchConnection(object):
         generated query, and used in relevant_data() to check if a document
         matches the range.
 
+        If `ranges` is 'auto', the automatically generated range terms are
+        used.  In this case, if `exact` is True, the query returned will be
+        exact, using checks on the values in the slot from `query_ranges` for
+        documents near the ends of the range.
+
         """
         if begin is not None:
             begin = float(begin)
@@ -522,6 +1664,11 @@ class SearchConnection(object):
                          _serialised=self._make_parent_func_repr("query_all"),
                          _ranges=query_ranges) * 0, self._RANGE_EXACT
 
+        if ranges == 'auto':
+            return self._build_range_query_trie(field, prefix, begin, end,
+                                                conservative, exact,
+                                                query_ranges)
+
         if conservative:
             return self._build_range_query_cons(prefix, begin, end,
                                                 ranges, query_ranges)
@@ -608,7 +1755,10 @@ class SearchConnection(object):
 
         The 'accelerate' parameter is used only if approx is False.  If true,
         the resulting query will be an exact range search, but will attempt to
-        use the range terms to perform the search faster.
+        use the range terms to perform the search faster.  If the field's
+        ranges are 'auto', the range terms are used for all of the range
+        except the ends, so only the values of documents near the ends of the
+        range need to be checked.
 
         """
         if self._index is None:
@@ -675,7 +1825,8 @@ class SearchConnection(object):
         if accelerate and ranges is not None:
             accel_query, accel_type = \
                 self._range_accel_query(field, begin, end, range_accel_prefix,
-                                        ranges, conservative, query_ranges)
+                                        ranges, conservative, query_ranges,
+                                        exact=True)
         else:
             accel_type = self._RANGE_NONE
 
@@ -760,6 +1911,13 @@ class SearchConnection(object):
         performance improvements (provided a number of ranges are excluded),
         whereas for exact searches it is still necessary to test each document.
 
+        Exact searches read the values of the documents in blocks from the
+        value stream for the field, rather than reading each document, and
+        calculate the differences for a whole block at once if numpy is
+        installed and the formula can be applied to arrays.  Every document
+        is matched: documents with no value for the field are treated as
+        having a value of minus infinity, so usually have a weight of 0.
+
         If the 'approx' parameter tests true, then the ranges for the
         field are used to approximate differences. This is less accurate
         but likely to be much faster. It is necessary that 'ranges'
@@ -796,6 +1954,11 @@ class SearchConnection(object):
             if not ranges:
                 errors.SearchError("Cannot do approximate difference search "
                                    "on fields with no ranges")
+            if ranges == 'auto':
+                # The automatically generated ranges can't be used to
+                # approximate differences, so do an exact search.
+                return self.query_difference(field, val, purpose, False, num,
+                                             difference_func)
             if isinstance(difference_func, basestring):
                 difference_func = eval('lambda x, y: ' + difference_func)
             result = self._difference_accel_query(ranges, range_accel_prefix,
@@ -804,21 +1967,13 @@ class SearchConnection(object):
             return result
         else:
             # not approx
-            # NOTE - very slow: needs to be implemented in C++.
-            if isinstance(difference_func, basestring):
-                difference_func = eval('lambda x, y: ' + difference_func)
-            class DifferenceWeight(ExternalWeightSource):
-                " An exteral weighting source for differences"
-                def get_maxweight(self):
-                    return 1.0
-
-                def get_weight(self, doc):
-                    doc_val = xapian.sortable_unserialise(
-                            doc.get_value(field, purpose))
-                    difference = difference_func(val, doc_val)
-                    return 1.0 / (abs(difference) + 1.0)
-
-            result = self.query_external_weight(DifferenceWeight())
+            try:
+                self._field_mappings.get_slot(field, purpose)
+            except KeyError:
+                return Query(xapian.Query(), _conn=self,
+                             _serialised=serialised)
+            result = self.query_external_weight(
+                _DifferenceWeightSource(field, purpose, val, difference_func))
             result._set_serialised(serialised)
             return result
 
@@ -868,6 +2023,13 @@ class SearchConnection(object):
 
         `k1` and `k2` control how the weights varies with distance.
 
+        If the field was indexed with the 'cells' parameter of the
+        GEOLOCATION action, and a `max_range` is given, only the documents in
+        the grid cells near the centre have their distance calculated.  The
+        cells are only used if every document with a location in the field
+        was indexed with them, so documents indexed before the parameter was
+        set must be reindexed for searches to be accelerated.
+
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
@@ -877,12 +2039,13 @@ class SearchConnection(object):
         metric = xapian.GreatCircleMetric()
 
         # Build the list of coordinates
-        coords = xapian.LatLongCoords()
         if isinstance(centre, basestring):
-            coords.insert(xapian.LatLongCoord.parse_latlong(centre))
-        else:
-            for coord in centre:
-                coords.insert(xapian.LatLongCoord.parse_latlong(coord))
+            centre = (centre, )
+        centres = [xapian.LatLongCoord.parse_latlong(coord)
+                   for coord in centre]
+        coords = xapian.LatLongCoords()
+        for coord in centres:
+            coords.insert(coord)
 
         # Get the slot
         try:
@@ -895,13 +2058,137 @@ class SearchConnection(object):
         # Make the posting source
         postingsource = xapian.LatLongDistancePostingSource(
             slot, coords, metric, max_range, k1, k2)
-
-        result = Query(xapian.Query(postingsource),
+        xapq = xapian.Query(postingsource)
+
+        # Restrict the search to the cells around the centres.
+        cell_prefix = self._get_geo_cell_prefix(field)
+        if max_range > 0 and cell_prefix is not None:
+            terms = geocells.covering_terms(cell_prefix,
+                [(coord.latitude, coord.longitude) for coord in centres],
+                max_range)
+            if terms is not None:
+                xapq = xapian.Query(xapian.Query.OP_FILTER, xapq,
+                                    xapian.Query(xapian.Query.OP_OR, terms))
+
+        result = Query(xapq,
                        _refs=[postingsource, coords, metric],
                        _conn=self)
         result._set_serialised(serialised)
         return result
 
+    def query_nearest(self, field, centre, k, k1=1000.0, k2=1.0):
+        """Create a query which returns the documents nearest to a point.
+
+        `field`, `centre`, `k1` and `k2` are as for query_distance().  The
+        resulting query returns documents in order of distance, like
+        query_distance(), but is limited to a range which contains the `k`
+        nearest documents (and possibly a few more): searching for the top
+        `k` results returns the `k` nearest documents.
+
+        If the field was indexed with the 'cells' parameter of the
+        GEOLOCATION action (for every document with a location in the
+        field), the range is found by searching the grid cells
+        around the centre, expanding the range until at least `k` documents
+        are found within it, so the distances of documents far from the
+        centre are never calculated.  Otherwise, this is equivalent to
+        query_distance() with no maximum range.
+
+        The range is calculated when the query is created, so the query
+        should be recreated when the connection is reopened.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if k < 1:
+            raise errors.SearchError("Number of documents must be at least 1")
+        serialised = self._make_parent_func_repr("query_nearest")
+        if isinstance(centre, basestring):
+            centre = (centre, )
+        centre = list(centre)
+        max_range = self._find_nearest_range(field, centre, k)
+        result = self.query_distance(field, centre, max_range, k1, k2)
+        result._set_serialised(serialised)
+        return result
+
+    def _find_nearest_range(self, field, centre, k):
+        """Find a range containing at least `k` documents for query_nearest().
+
+        Returns 0 if no range can be found (ie, the search must cover all the
+        documents).
+
+        """
+        prefix = self._get_geo_cell_prefix(field)
+        if prefix is None:
+            return 0
+        points = []
+        for coord in centre:
+            coord = xapian.LatLongCoord.parse_latlong(coord)
+            points.append((coord.latitude, coord.longitude))
+
+        # Start with the height of a cell at the finest level, and expand
+        # the range until it contains enough documents.
+        max_range = geocells.EARTH_RADIUS * \
+            math.radians(180.0 / (1 << geocells.CELL_LEVELS[-1]))
+        while True:
+            terms = geocells.covering_terms(prefix, points, max_range)
+            if terms is None:
+                return 0
+            while True:
+                try:
+                    # The number of documents in the cells is an upper
+                    # bound on the number within the range, so only check
+                    # the range when there may be enough.
+                    candidates = sum(self._index.get_termfreq(term)
+                                     for term in terms)
+                    found = 0
+                    if candidates >= k:
+                        query = self.query_distance(field, centre, max_range)
+                        enq = self._make_enquire(query)
+                        mset = enq.get_mset(0, 0, k)
+                        found = mset.get_matches_lower_bound()
+                    break
+                except xapian.DatabaseModifiedError, e:
+                    self.reopen()
+            if found >= k:
+                return max_range
+            max_range *= 4
+
+    def _get_geo_cell_prefix(self, field):
+        """Get the prefix of the grid cell terms for a geolocation field.
+
+        Returns None if the field wasn't indexed with cell terms, or if some
+        documents with a location in the field don't have them (for example,
+        because they were indexed before the 'cells' parameter was set).
+
+        """
+        try:
+            actions = self._field_actions[field]._actions
+        except KeyError:
+            return None
+        for kwargs in actions.get(FieldActions.GEOLOCATION, ()):
+            prefix = kwargs.get('_cell_prefix')
+            if prefix is not None:
+                break
+        else:
+            return None
+        try:
+            slot = self._field_mappings.get_slot(field, 'loc')
+        except KeyError:
+            return None
+        while True:
+            try:
+                try:
+                    located = self._index.get_value_freq(slot)
+                except xapian.UnimplementedError:
+                    return None
+                marked = self._index.get_termfreq(geocells.marker_term(prefix))
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        if marked < located:
+            return None
+        return prefix
+
     def query_image_similarity(self, field, image=None, docid=None, xapid=None):
         """Create an image similarity query.
         
@@ -1061,7 +2348,7 @@ class SearchConnection(object):
                     self._range_accel_query(field, val[0], val[1],
                                             range_accel_prefix,
                                             ranges, conservative,
-                                            query_ranges)
+                                            query_ranges, exact=True)
             else:
                 accel_type = self._RANGE_NONE
 
@@ -1276,11 +2563,14 @@ class SearchConnection(object):
         combined with other queries.
 
         """
+        profile = self._make_profile(False)
+        profile.start_phase('query_parse')
         qp = self._prepare_queryparser(allow, deny, default_op, default_allow,
                                        default_deny)
         result = self._query_parse_with_fallback(qp, string, allow_wildcards)
         serialised = self._make_parent_func_repr("query_parse")
         result._set_serialised(serialised)
+        profile.end_phase()
         return result
 
     def query_field(self, field, value=None, default_op=OP_AND,
@@ -1436,14 +2726,8 @@ class SearchConnection(object):
         eterms, prefixes = self._get_eterms(ids, allow, deny, maxterms)
         terms = []
         for term in eterms:
-            pos = 0
-            for char in term:
-                if not char.isupper():
-                    break
-                pos += 1
-            field = prefixes[term[:pos]]
-            value = term[pos:]
-            terms.append((field, value))
+            prefix = _get_term_prefix(term)
+            terms.append((prefixes[prefix], term[len(prefix):]))
         return terms
 
     def _get_eterms(self, ids, allow, deny, simterms):
@@ -1509,6 +2793,18 @@ class SearchConnection(object):
                 newids.append(doc)
         ids = newids
 
+        # Use the stored top terms, or a cached result, if possible.
+        # Expands involving temporary documents are never cached.
+        if tempdb is None:
+            if len(ids) == 1:
+                eterms = self._get_top_terms(ids[0], prefixes, simterms)
+                if eterms is not None:
+                    return eterms, prefixes
+            key = (tuple(sorted(ids)), tuple(sorted(prefixes)), simterms)
+            eterms = self._expand_cache.get(key)
+            if eterms is not None:
+                return eterms, prefixes
+
         # Repeat the expand until we don't get a DatabaseModifiedError
         while True:
             try:
@@ -1516,22 +2812,35 @@ class SearchConnection(object):
                 break;
             except xapian.DatabaseModifiedError, e:
                 self.reopen()
+        if tempdb is None:
+            self._expand_cache.set(key, eterms)
         return eterms, prefixes
 
-    class _ExpandDecider(xapian.ExpandDecider):
-        def __init__(self, prefixes):
-            xapian.ExpandDecider.__init__(self)
-            self._prefixes = prefixes
+    def _get_top_terms(self, id, prefixes, simterms):
+        """Get the top terms stored for a document at indexing time.
 
-        def __call__(self, term):
-            pos = 0
-            for char in term:
-                if not char.isupper():
-                    break
-                pos += 1
-            if term[:pos] in self._prefixes:
-                return True
-            return False
+        Returns the first `simterms` stored terms with one of the given
+        prefixes, or None if there aren't enough stored terms (see
+        IndexerConnection.set_top_terms_count()).
+
+        """
+        key = '_xappy_top_terms:' + id
+        while True:
+            try:
+                for shard in self._shards:
+                    data = shard.get_metadata(key)
+                    if data:
+                        break
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        if not data:
+            return None
+        terms = [term for term in _cPickle.loads(data)
+                 if _get_term_prefix(term) in prefixes]
+        if len(terms) < simterms:
+            return None
+        return terms[:simterms]
 
     def _perform_expand(self, ids, prefixes, simterms, tempdb):
         """Perform an expand operation to get the terms for a similarity
@@ -1563,7 +2872,7 @@ class SearchConnection(object):
             except StopIteration:
                 pass
 
-        expanddecider = self._ExpandDecider(prefixes)
+        expanddecider = _ExpandDecider(prefixes)
         # The USE_EXACT_TERMFREQ gets the term frequencies from the combined
         # database, not from the database which the relevant document is found
         # in.  This has a performance penalty, but this should be minimal in
@@ -1586,8 +2895,25 @@ class SearchConnection(object):
         doesn't matter too much, or for experimenting with new weight schemes
         offline before indexing them.
 
+        If the source sets its `slots` member, the weights are instead
+        calculated by calls to its get_weights() method for batches of
+        documents, using only the values of the documents.  This is much
+        faster, and usable with large databases.
+
         """
         serialised = self._make_parent_func_repr("query_external_weight")
+        if getattr(source, 'slots', None) is not None:
+            try:
+                slots = [self._field_mappings.get_slot(field, purpose)
+                         for field, purpose in source.slots]
+            except KeyError:
+                raise errors.SearchError("Field %r has no value slot for %r" %
+                                         (field, purpose))
+            postingsource = _BatchExternalWeightPostingSource(source, slots)
+            return Query(xapian.Query(postingsource),
+                         _refs=[postingsource], _conn=self,
+                         _serialised=serialised)
+
         class ExternalWeightPostingSource(xapian.PostingSource):
             """A xapian posting source reading from an ExternalWeightSource.
 
@@ -1688,6 +3014,65 @@ class SearchConnection(object):
                      _conn=self,
                      _serialised = self._make_parent_func_repr("query_id"))
 
+    def query_id_set(self, ids):
+        """A query which matches documents with any of a set of ids.
+
+        This is similar to query_id(), but is suitable for large sets of
+        document IDs (for example, for filtering results to the documents
+        which a user has permission to see).  The IDs are resolved to xapian
+        document IDs once, by looking them up in sorted order, and the
+        resulting sorted array of document IDs is used directly in the
+        match.  The resolved set is cached, so passing the same set of IDs
+        again (until the connection is reopened) doesn't repeat the lookup.
+
+        IDs which aren't in the database are ignored.  The query returns a
+        weight of 0 for each document, so is normally used as a filter.
+
+        When searching several shards, this falls back to the same query as
+        query_id(), since the matching can't then be done in python.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if isinstance(ids, basestring):
+            ids = (ids,)
+        ids = tuple(sorted(set(ids)))
+        serialised = self._make_parent_func_repr("query_id_set")
+        if len(self._shards) > 1:
+            return Query(xapian.Query(xapian.Query.OP_OR,
+                                      ['Q' + id for id in ids]),
+                         _conn=self, _serialised=serialised)
+        ps = _DocidSetPostingSource(self._resolve_id_set(ids))
+        return Query(xapian.Query(ps), _refs=[ps], _conn=self,
+                     _serialised=serialised)
+
+    def _resolve_id_set(self, ids):
+        """Get a sorted array of the xapids for a sorted tuple of ids.
+
+        """
+        key = '\0'.join(ids)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        key = md5(key).digest()
+        xapids = self._id_set_cache.get(key)
+        if xapids is not None:
+            return xapids
+        while True:
+            try:
+                xapids = array.array('I')
+                for id in ids:
+                    pl = self._index.postlist('Q' + id)
+                    try:
+                        xapids.append(pl.next().docid)
+                    except StopIteration:
+                        pass
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        xapids = array.array('I', sorted(set(xapids)))
+        self._id_set_cache.set(key, xapids)
+        return xapids
+
     def query_from_evalable(self, serialised):
         """Create a query from an serialised evalable repr string.
 
@@ -1733,6 +3118,28 @@ class SearchConnection(object):
         documents are matched by the corrected query before suggesting it to
         users.
 
+        Corrections (including the lack of a correction) are cached, so
+        repeated calls with the same arguments are fast until the connection
+        is reopened.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        key = (querystr, _make_hashable(allow), _make_hashable(deny),
+               default_op, _make_hashable(default_allow),
+               _make_hashable(default_deny), bool(allow_wildcards))
+        corrected = self._spell_cache.get(key)
+        if corrected is None:
+            corrected = self._spell_correct(querystr, allow, deny, default_op,
+                                            default_allow, default_deny,
+                                            allow_wildcards)
+            self._spell_cache.set(key, corrected)
+        return corrected
+
+    def _spell_correct(self, querystr, allow, deny, default_op,
+                       default_allow, default_deny, allow_wildcards):
+        """Correct a query spelling, without using the cache.
+
         """
         qp = self._prepare_queryparser(allow, deny, default_op, default_allow,
                                        default_deny)
@@ -2019,7 +3426,7 @@ class SearchConnection(object):
                     facetfieldnames.append(field)
         return facetfieldnames
 
-    def _make_facet_matchspies(self, facetfieldnames):
+    def _make_facet_matchspies(self, facetfieldnames, facet_options=None):
         # Set facetspies to {}, even if no facet fields are found, to
         # distinguish from no facet calculation being performed.  (This
         # will prevent an error being thrown when the list of suggested
@@ -2036,14 +3443,184 @@ class SearchConnection(object):
                 if action == FieldActions.FACET:
                     slot = self._field_mappings.get_slot(field, 'facet')
                     facettype = self._field_type_from_kwargslist(kwargslist)
+                    quantiles = None
+                    if facet_options is not None:
+                        quantiles = facet_options.get(field, {}) \
+                                                 .get('quantiles')
                     if facettype == 'string':
                         facetspy = xapian.MultiValueCountMatchSpy(slot)
+                    elif facettype == 'float' and quantiles is not None:
+                        facetspy = QuantileMatchSpy(slot, quantiles)
                     else:
                         facetspy = xapian.ValueCountMatchSpy(slot)
                     facetspies[slot] = facetspy
                     facetfields.append((field, slot, facettype))
         return facetspies, facetfields
 
+    def add_facet_view(self, name, query):
+        """Add a facet view, for which facet values are precomputed.
+
+        A facet view is a query whose facet values are calculated once (over
+        all the documents matching it) and stored: subsequent searches for
+        exactly that query (as identified by its serialised form) which ask
+        for facets use the stored values instead of counting the facets
+        during the match.  This is useful for queries which are used very
+        often to start browsing, such as a filter on a category.  A search
+        for query_all() always uses stored values, without needing to add a
+        view.
+
+        The stored values are recalculated (the next time they're needed)
+        when the connection is reopened.  Facets aren't read from views for
+        searches with a match decider, or with percentage or weight cutoffs.
+
+        - `name` is the name of the view, which may be used to remove it.
+        - `query` is the query to precompute facets for: it must be
+          serialisable.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        self._facet_views[name] = self._get_filter_key(query)
+
+    def remove_facet_view(self, name):
+        """Remove a facet view added by add_facet_view().
+
+        Raises KeyError if there is no view with the given name.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        key = self._facet_views.pop(name)
+        if key not in self._facet_views.itervalues():
+            for cachekey in self._facet_view_cache.keys():
+                if cachekey[0] == key:
+                    self._facet_view_cache.remove(cachekey)
+
+    def _get_facet_view_key(self, query):
+        """Get the key of the facet view matching a query.
+
+        Returns None if the query isn't the query of a facet view.
+
+        """
+        if not isinstance(query, Query):
+            return None
+        key = query.evalable_repr()
+        if key is None:
+            return None
+        if self._query_all_key is None:
+            self._query_all_key = self.query_all().evalable_repr()
+        if key == self._query_all_key or key in self._facet_views.itervalues():
+            return key
+        return None
+
+    def _get_view_facets(self, key, query, facetfieldnames,
+                         desired_num_of_categories, facet_options=None):
+        """Get the facet values stored for a facet view.
+
+        Any facets which haven't been calculated for the view are calculated,
+        by a single match over all the documents matching the view's query.
+        Values are stored separately for each setting of the 'quantiles'
+        facet option, since it changes how the values are counted (the other
+        options are applied when the values are read from the results).
+
+        Returns a list of (fieldname, values) pairs.
+
+        """
+        if facet_options is None:
+            facet_options = {}
+        view_facets = []
+        missing = []
+        for fieldname in facetfieldnames:
+            quantiles = facet_options.get(fieldname, {}).get('quantiles')
+            values = self._facet_view_cache.get((key, fieldname,
+                                                 desired_num_of_categories,
+                                                 quantiles))
+            if values is None:
+                missing.append(fieldname)
+            else:
+                view_facets.append((fieldname, values))
+        if len(missing) == 0:
+            return view_facets
+
+        facetspies, facetfields = self._make_facet_matchspies(missing,
+                                                              facet_options)
+        if len(facetfields) == 0:
+            return view_facets
+        while True:
+            try:
+                enq = self._make_enquire(query)
+                enq.set_weighting_scheme(xapian.BoolWeight())
+                for facetspy in facetspies.itervalues():
+                    enq.add_matchspy(facetspy)
+                enq.get_mset(0, 0, self._index.get_doccount())
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        facets = FacetResults(facetspies, facetfields, None, None,
+                              desired_num_of_categories, None)
+        for fieldname, slot, facettype in facetfields:
+            values = facets.get_facet(fieldname)
+            quantiles = facet_options.get(fieldname, {}).get('quantiles')
+            self._facet_view_cache.set((key, fieldname,
+                                        desired_num_of_categories,
+                                        quantiles), values)
+            view_facets.append((fieldname, values))
+        return view_facets
+
+    def _get_facet_sample_rate(self, query, sample_size):
+        """Get the proportion of the matches to count facets on.
+
+        Returns None if the query is estimated to match no more than
+        `sample_size` documents, so that facets should be counted on all the
+        matches.
+
+        """
+        if sample_size <= 0:
+            raise errors.SearchError("facet_sample_size must be positive: %r"
+                                     % sample_size)
+        estimate = self.count(query)
+        if estimate <= sample_size:
+            return None
+        return float(sample_size) / estimate
+
+    def _count_facet_sample(self, query, facetspies, sample_rate):
+        """Run facet matchspies on a random sample of the matches of a query.
+
+        Each matching document is in the sample with probability
+        `sample_rate`.  The sample is seeded from the query, so the same
+        query always gives the same sample.
+
+        """
+        if isinstance(query, xapian.Query):
+            xapq = query
+        else:
+            xapq = query._get_xapian_query()
+        seed = int(md5(xapq.get_description()).hexdigest()[:16], 16)
+        doccount = self._index.get_doccount()
+        while True:
+            try:
+                source = _SamplePostingSource(sample_rate, seed)
+                enq = self._make_enquire(xapian.Query(
+                    xapian.Query.OP_FILTER, xapq, xapian.Query(source)))
+                enq.set_weighting_scheme(xapian.BoolWeight())
+                for facetspy in facetspies.itervalues():
+                    enq.add_matchspy(facetspy)
+                enq.get_mset(0, 0, doccount)
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+
+    def _supports_time_limit(self):
+        """Check whether searches on this connection can have a time limit.
+
+        If xapian doesn't support time limits directly, a python posting
+        source is used to stop the match, which can't be used with several
+        shards.
+
+        """
+        return hasattr(xapian.Enquire, 'set_time_limit') or \
+               len(self._shards) <= 1
+
     def _make_enquire(self, query):
         if not isinstance(query, xapian.Query):
             xapq = query._get_xapian_query()
@@ -2055,11 +3632,29 @@ class SearchConnection(object):
         return enq
 
     def _apply_sort_parameters(self, enq, sortby):
+        if isinstance(sortby, self._SortByKeysThenDocid):
+            keymaker = self._make_sort_keymaker(sortby.sortby)
+            enq.set_sort_by_key(keymaker, False)
+            enq.set_docid_order(enq.ASCENDING)
+            enq._keymaker = keymaker
+            return
         if isinstance(sortby, basestring):
             params = self._get_sort_slot_and_dir(sortby)
             if len(params) == 2:
                 enq.set_sort_by_value_then_relevance(*params)
                 return
+        keymaker = self._make_sort_keymaker(sortby)
+        enq.set_sort_by_key_then_relevance(keymaker, False)
+        enq._keymaker = keymaker
+
+    def _make_sort_keymaker(self, sortby):
+        """Make a KeyMaker for the sort specified by a sortby parameter.
+
+        Sorting in ascending order of the keys it generates gives the order
+        requested.
+
+        """
+        if isinstance(sortby, basestring):
             sortby = [sortby]
         if isinstance(sortby, self.SortByGeolocation):
             # Get the slot
@@ -2076,12 +3671,10 @@ class SearchConnection(object):
                 for coord in sortby.centre:
                     coords.insert(xapian.LatLongCoord.parse_latlong(coord))
 
-            # Make and use the keymaker
+            # Make the keymaker
             metric = xapian.GreatCircleMetric()
             keymaker = xapian.LatLongDistanceKeyMaker(slot, coords, metric)
-            enq.set_sort_by_key_then_relevance(keymaker, False)
-            enq._keymaker = keymaker
-            enq._metric = metric
+            keymaker._metric = metric
         else:
             keymaker = xapian.MultiValueKeyMaker()
             for field in sortby:
@@ -2092,8 +3685,7 @@ class SearchConnection(object):
                     # backwards compatibility
                     params = params[:2]
                     keymaker.add_value(*params)
-            enq.set_sort_by_key_then_relevance(keymaker, False)
-            enq._keymaker = keymaker
+        return keymaker
 
     def _apply_collapse_parameters(self, enq, collapse, collapse_max):
         try:
@@ -2113,7 +3705,8 @@ class SearchConnection(object):
                percentcutoff=None, weightcutoff=None,
                query_type=None, weight_params=None, collapse_max=1,
                stats_checkatleast=0, facet_checkatleast=0,
-               facet_desired_num_of_categories=7):
+               facet_desired_num_of_categories=7, time_limit=None,
+               profile=False, facet_options=None, facet_sample_size=None):
         """Perform a search, for documents matching a query.
 
         - `query` is the query to perform.
@@ -2166,6 +3759,54 @@ class SearchConnection(object):
           names are "k1", "k2", "k3", "b", "min_normlen".  Any unrecognised
           names will be ignored.  For documentation of the parameters, see the
           docs/weighting.rst document.
+        - `time_limit` is the maximum time (in seconds) to spend on the match.
+          If the match takes longer than this, it is stopped early and the
+          results found so far are returned: such results will be flagged as
+          partial (see SearchResults.is_partial), the estimates of the number
+          of matches will not be marked as exact, and any facet counts will
+          only reflect the documents checked.  None means no time limit.
+          Note that if the installed version of xapian doesn't support time
+          limits directly, they're not supported for connections to several
+          shards, and a SearchError is raised if a time limit is given.
+        - `profile` is a boolean - if True, the time spent in each phase of
+          the search is recorded, and is available from the `profile`
+          attribute of the results (see xappy.SearchProfile).  Searches are
+          always profiled if a profile aggregator has been set with
+          set_profile_aggregator().
+        - `facet_options` is a dictionary mapping from facet field name to a
+          dictionary of options controlling which values are returned for
+          that facet.  The options are:
+
+           - 'top_k': if set, only this number of the most frequent values
+             are returned.  This avoids building a list of all the values of
+             facets with very many values.
+           - 'min_count': only values with at least this frequency are
+             returned (default 0).
+           - 'sort': the order of the returned values: 'value' (the default)
+             for the order of the values, or 'count' for decreasing
+             frequency.
+           - 'quantiles': for float facets, if set, the ranges are calculated
+             from a quantile sketch of this size (at least 2; 200 is a
+             reasonable choice), rather than from a count of every distinct
+             value.  This uses a fixed amount of memory, however many
+             distinct values the matching documents have, but the counts
+             are estimates.  The ranges are chosen from the estimated
+             counts in the same way as for other float facets.
+
+          The values of each facet are only calculated when they are first
+          requested from the results.
+        - `facet_sample_size` is the approximate number of matching documents
+          to count facets on.  If set, and the query matches more documents
+          than this, facets are counted on a random sample of the matching
+          documents (chosen by a hash of their document IDs), in a separate
+          match, and the counts are scaled up to estimate the counts for all
+          the matches (see SearchResults.get_facet_intervals() for the
+          accuracy of the estimates).  The sample depends only on the query,
+          so the same facets are returned for each page of results.  It must
+          be positive.  Facets
+          are counted on all the matches (subject to `facet_checkatleast`) if
+          the connection is to several shards, or if a percentage or weight
+          cutoff is set.
 
         If neither 'allowfacets' or 'denyfacets' is specified, all fields
         holding facets will be considered (but see 'usesubfacets').
@@ -2173,6 +3814,15 @@ class SearchConnection(object):
         """
         if self._index is None:
             raise errors.SearchError("SearchConnection has been closed")
+        if facet_options is not None:
+            _check_facet_options(facet_options)
+        if facet_sample_size is not None and facet_sample_size <= 0:
+            raise errors.SearchError("facet_sample_size must be positive: %r"
+                                     % facet_sample_size)
+        if time_limit is not None and not self._supports_time_limit():
+            raise errors.SearchError("Time limits are not supported for "
+                                     "searches over several shards with "
+                                     "this version of xapian")
 
         if checkatleast == -1:
             checkatleast = self._index.get_doccount()
@@ -2180,6 +3830,7 @@ class SearchConnection(object):
             stats_checkatleast = self._index.get_doccount()
         if facet_checkatleast == -1:
             facet_checkatleast = self._index.get_doccount()
+        profile = self._make_profile(profile)
 
         # Check if we've got a cached query.
         queryid = None
@@ -2190,6 +3841,7 @@ class SearchConnection(object):
                 uncached_query = query._get_original_query()
 
         # Prepare the facet spies.
+        profile.start_phase('facet_fields')
         if getfacets:
             if 'facets' in _checkxapian.missing_features:
                 raise errors.SearchError("Facets unsupported with this release of xapian")
@@ -2199,7 +3851,19 @@ class SearchConnection(object):
             facetfieldnames = set()
 
         # Get whatever information we can from the cache.
+        profile.start_phase('cache_lookup')
         cache_hits, cache_stats, cache_facets = None, (None, None, None), None
+        view_facets = None
+        if len(facetfieldnames) != 0 and queryid is None and \
+           percentcutoff is None and weightcutoff is None:
+            # Use the precomputed facets if the query is a facet view.
+            viewkey = self._get_facet_view_key(query)
+            if viewkey is not None:
+                view_facets = self._get_view_facets(viewkey, query,
+                    facetfieldnames, facet_desired_num_of_categories,
+                    facet_options)
+                for fieldname, values in view_facets:
+                    facetfieldnames.remove(fieldname)
         if queryid is not None:
             if sortby is None and collapse is None:
                 # Get the ordering of the requested hits.  Ask for one more, so
@@ -2221,12 +3885,24 @@ class SearchConnection(object):
                         for fieldname, valfreqs in cache_facets:
                             facetfieldnames.remove(fieldname)
 
+        profile.start_phase('enquire_setup')
         if getfacets:
             facetspies, facetfields = \
-                self._make_facet_matchspies(facetfieldnames)
+                self._make_facet_matchspies(facetfieldnames, facet_options)
         else:
             facetspies, facetfields = None, []
 
+        # Work out whether to count facets on a sample of the matches.
+        sample_rate = None
+        if facet_sample_size is not None and len(facetfields) != 0 and \
+           len(self._shards) <= 1 and \
+           percentcutoff is None and weightcutoff is None:
+            if self._facet_sample_rate is not None:
+                sample_rate = self._facet_sample_rate
+            else:
+                sample_rate = self._get_facet_sample_rate(query,
+                                                          facet_sample_size)
+
         # Work out how many results we need.
         real_maxitems = 0
         need_to_search = False
@@ -2251,7 +3927,7 @@ class SearchConnection(object):
             need_to_search = True
             checkatleast = max(checkatleast, stats_checkatleast)
 
-        if len(facetfields) != 0:
+        if len(facetfields) != 0 and sample_rate is None:
             checkatleast = max(checkatleast, facet_checkatleast)
             need_to_search = True
 
@@ -2259,16 +3935,35 @@ class SearchConnection(object):
         # getting term weights
         need_to_search = True
 
+        deadline_source = None
+        count_spy = None
         if need_to_search:
             # Build up the xapian enquire object
-            enq = self._make_enquire(query)
+            if time_limit is not None and \
+               not hasattr(xapian.Enquire, 'set_time_limit'):
+                # No support for time limits in xapian - stop the match by
+                # filtering with a posting source which ends at the deadline.
+                deadline_source = _DeadlinePostingSource(time.time() +
+                                                         time_limit)
+                enq = self._make_enquire(xapian.Query(
+                    xapian.Query.OP_FILTER, query._get_xapian_query(),
+                    xapian.Query(deadline_source)))
+            else:
+                enq = self._make_enquire(query)
+                if time_limit is not None:
+                    enq.set_time_limit(time_limit)
             if sortby is not None:
                 self._apply_sort_parameters(enq, sortby)
             if collapse is not None:
                 collapse_slotnum = self._apply_collapse_parameters(enq, collapse, collapse_max)
-            if getfacets:
+            if getfacets and sample_rate is None:
                 for facetspy in facetspies.itervalues():
                     enq.add_matchspy(facetspy)
+            if isinstance(profile, SearchProfile) and \
+               'facets' not in _checkxapian.missing_features:
+                # Count the documents examined by the match.
+                count_spy = xapian.ValueCountMatchSpy(self._profile_slot)
+                enq.add_matchspy(count_spy)
 
             # Set percentage and weight cutoffs
             if percentcutoff is not None or weightcutoff is not None:
@@ -2282,16 +3977,37 @@ class SearchConnection(object):
             self.__set_weight_params(enq, weight_params)
 
             # Repeat the search until we don't get a DatabaseModifiedError
+            profile.start_phase('match')
             while True:
+                match_start = time.time()
                 try:
-                    mset = enq.get_mset(startrank, real_maxitems, checkatleast)
+                    mset = enq.get_mset(startrank, real_maxitems,
+                                        checkatleast)
                     break
                 except xapian.DatabaseModifiedError, e:
                     self.reopen()
+
+            # Check whether the match was stopped by the time limit.
+            partial = False
+            if deadline_source is not None:
+                partial = deadline_source.expired
+            elif time_limit is not None:
+                # Xapian doesn't report whether the time limit stopped the
+                # match, but a match which was stopped early doesn't have
+                # exact bounds on the number of matches.  Only the final
+                # attempt is timed, so time spent on attempts which were
+                # retried after a DatabaseModifiedError doesn't count.
+                partial = (time.time() - match_start >= time_limit and
+                           mset.get_matches_lower_bound() !=
+                           mset.get_matches_upper_bound())
         else:
             mset = None
+            partial = False
 
         # Build the search results:
+        profile.start_phase('facets')
+        if sample_rate is not None:
+            self._count_facet_sample(query, facetspies, sample_rate)
         if getfacets:
             # The facet results don't depend on anything else.
             facet_hierarchy = None
@@ -2300,10 +4016,12 @@ class SearchConnection(object):
             facets = FacetResults(facetspies, facetfields, facet_hierarchy,
                                   self._facet_query_table.get(query_type),
                                   facet_desired_num_of_categories,
-                                  cache_facets)
+                                  cache_facets, facet_options,
+                                  view_facets, sample_rate)
         else:
             facets = NoFacetResults()
 
+        profile.start_phase('results')
         if need_to_search:
             weightgetter = MSetTermWeightGetter(mset)
         else:
@@ -2328,9 +4046,308 @@ class SearchConnection(object):
 
         # Statistics on the number of matching documents.
         stats = ResultStats(mset, cache_stats)
+        if partial:
+            upper_bound, estimated = None, None
+            if deadline_source is not None:
+                # Documents after the last one checked might also match;
+                # extrapolate the estimate from the proportion checked.
+                lower_bound = mset.get_matches_lower_bound()
+                unchecked = max(0, deadline_source.lastdocid -
+                                deadline_source.current)
+                upper_bound = min(deadline_source.doccount,
+                                  max(mset.get_matches_upper_bound(),
+                                      lower_bound + unchecked))
+                estimated = upper_bound
+                if deadline_source.current > 0:
+                    estimated = int(lower_bound * deadline_source.lastdocid /
+                                    float(deadline_source.current))
+                estimated = max(lower_bound, min(upper_bound, estimated))
+            stats.set_partial(upper_bound, estimated)
+
+        results = SearchResults(self, query, self._field_mappings,
+                                facets, ordering, stats, context)
+        profile.end_phase()
+        if isinstance(profile, SearchProfile):
+            if isinstance(facets, FacetResults):
+                facets.profile = profile
+            if count_spy is not None:
+                profile.documents_examined = count_spy.get_total()
+            for field, slot, facettype in facetfields:
+                facetspy = facetspies.get(slot)
+                if facetspy is not None:
+                    profile.matchspy_counts[field] = facetspy.get_total()
+            results.profile = profile
+        return results
+
+    def count(self, query, exact=False):
+        """Count the documents matching a query.
+
+        This is faster than performing a search just to get the number of
+        matching documents, since no results are built.
+
+        - `query` is the query to count the matches of.
+        - `exact` is a boolean.  If True, the exact number of matching
+          documents is returned (which may require checking every matching
+          document).  If False, an estimate is returned, which is calculated
+          as cheaply as possible (and is exact in many cases).
+
+        The count is found, in order of preference:
+
+         - from the term frequency, if the query is a single term (or matches
+           all documents, or no documents): this is always exact.
+         - from the statistics stored by the cache manager, if the query has
+           been cached (in exact mode, only if the stored bounds are equal).
+         - by running a match with boolean weighting, without retrieving any
+           results.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+
+        # Check if we've got a cached query.
+        queryid = None
+        if self.cache_manager is not None and \
+           hasattr(query, '_get_queryid'):
+            queryid = query._get_queryid()
+
+        if isinstance(query, xapian.Query):
+            xapq = query
+        else:
+            xapq = query._get_xapian_query()
+
+        result = self._count_from_termfreq(xapq)
+        if result is not None:
+            return result
 
-        return SearchResults(self, query, self._field_mappings,
-                             facets, ordering, stats, context)
+        if queryid is not None:
+            lower, upper, estimated = self.cache_manager.get_stats(queryid)
+            if exact:
+                if lower is not None and lower == upper:
+                    return lower
+            elif estimated is not None:
+                return estimated
+
+        while True:
+            try:
+                enq = xapian.Enquire(self._index)
+                enq.set_query(xapq)
+                enq.set_weighting_scheme(xapian.BoolWeight())
+                enq.set_docid_order(enq.DONT_CARE)
+                if exact:
+                    checkatleast = self._index.get_doccount()
+                else:
+                    checkatleast = 0
+                mset = enq.get_mset(0, 0, checkatleast)
+                break
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+        if exact:
+            return mset.get_matches_lower_bound()
+        return mset.get_matches_estimated()
+
+    def _count_from_termfreq(self, xapq):
+        """Count the matches of a query from a term frequency.
+
+        Returns None if the query isn't a single term (possibly with its
+        weight scaled), or a query matching all or no documents.
+
+        """
+        if xapq.empty():
+            return 0
+        term = _get_single_term(xapq)
+        if term is None:
+            return None
+        while True:
+            try:
+                if term == '':
+                    return self._index.get_doccount()
+                return self._index.get_termfreq(term)
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+
+    def search_after(self, query, count, cursor=None, sortby=None,
+                     collapse=None, collapse_max=1, **kwargs):
+        """Get a page of results, starting after the position of a cursor.
+
+        This is an alternative to calling search() with increasing values of
+        `startrank`, for paging deeply through a result set.
+
+        - `query` is the query to perform.
+        - `count` is the number of results to return.
+        - `cursor` is None to get the first page of results, or the
+          `next_cursor` attribute of the results of the previous page.
+        - `sortby`, `collapse` and `collapse_max` are as for search(), and
+          must be the same for each page.  Any other keyword arguments are
+          passed to search().
+
+        The results have a `next_cursor` attribute, holding a cursor for the
+        next page, or None if there are no more results.  Cursors are opaque
+        strings, which are only valid for the same query and parameters, and
+        for the same revision of the database.
+
+        If `sortby` is given (and isn't a SortByGeolocation), and `collapse`
+        isn't, the cursor records the sort keys and document ID of the last
+        result returned, and each page is found by searching only for the
+        documents after it, so later pages cost about the same as the first.
+        Results with equal sort keys are returned in order of document ID
+        (rather than in order of relevance, as search() returns them).
+        Otherwise, the cursor just records the number of results returned,
+        and each page is found with search().
+
+        When resuming from a sort key, the `matches_*` statistics of the
+        results only count the documents which aren't before the cursor.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        if count < 0:
+            raise errors.SearchError("count must not be negative")
+
+        if isinstance(sortby, self.SortByGeolocation):
+            sortspec = ('geo', sortby.fieldname, sortby.centre)
+            keyslots = None
+        else:
+            sortspec = sortby
+            keyslots = self._get_cursor_key_slots(sortby)
+        if collapse is not None:
+            # Whether a document is collapsed depends on the documents before
+            # it, so the search can't start at the cursor's sort key.
+            keyslots = None
+        spec = _cursor.spec_hash(str(query), sortspec, collapse,
+                                 collapse_max)
+        if cursor is None:
+            state = _cursor.CursorState()
+        else:
+            state = _cursor.decode(cursor, spec)
+            if state.keys is not None and (keyslots is None or
+                                           len(state.keys) != len(keyslots)):
+                raise errors.SearchError("Invalid cursor: wrong number of "
+                                         "sort keys")
+
+        if keyslots is None:
+            # Get the page by its offset.
+            results = self.search(query, state.offset, state.offset + count,
+                                  sortby=sortby, collapse=collapse,
+                                  collapse_max=collapse_max, **kwargs)
+            if results.more_matches:
+                newstate = _cursor.CursorState(state.offset + len(results))
+                results.next_cursor = _cursor.encode(newstate, spec)
+            return results
+
+        resumeq = query
+        if state.keys is not None:
+            afterq, source = self._after_cursor_query(keyslots, state)
+            resumeq = Query(xapian.Query(xapian.Query.OP_FILTER,
+                                         query._get_xapian_query(), afterq),
+                            _refs=[query, source], _conn=self)
+        results = self.search(resumeq, 0, count,
+                              sortby=self._SortByKeysThenDocid(sortby),
+                              **kwargs)
+        mset = results._ordering.mset
+        results._hits = None
+        results._ordering = ReorderedMSetResultOrdering(
+            mset, range(len(mset)), results._ordering.context, state.offset)
+        if results.more_matches and len(mset) != 0:
+            hit = mset.get_hit(len(mset) - 1)
+            doc = hit.document
+            newstate = _cursor.CursorState(state.offset + len(mset),
+                                           [doc.get_value(slot)
+                                            for slot, ascending in keyslots],
+                                           hit.docid)
+            results.next_cursor = _cursor.encode(newstate, spec)
+        return results
+
+    class _SortByKeysThenDocid(object):
+        """A sort, used by search_after(), which orders documents with equal
+        sort keys by document ID, rather than by relevance.
+
+        """
+        def __init__(self, sortby):
+            self.sortby = sortby
+
+    def _get_cursor_key_slots(self, sortby):
+        """Get the slots and directions of the keys of a sort.
+
+        Returns a list of (slot, ascending) pairs, or None if the results
+        aren't sorted by a value.
+
+        """
+        if sortby is None:
+            return None
+        if isinstance(sortby, basestring):
+            sortby = [sortby]
+        keyslots = []
+        for field in sortby:
+            params = self._get_sort_slot_and_dir(field)
+            keyslots.append((params[0], not params[1]))
+        return keyslots
+
+    def _after_cursor_query(self, keyslots, state):
+        """Get a query matching the documents sorted after a cursor.
+
+        `keyslots` is the list of (slot, ascending) pairs for the sort keys,
+        and `state` is the CursorState holding the values of the keys and the
+        document ID of the last result returned.  Returns a tuple of (the
+        xapian query, the posting source it uses).
+
+        """
+        # Documents with no value in a slot sort last in either direction,
+        # but the value range operators only match documents with a value, so
+        # they have to be matched separately.
+        alldocs = xapian.Query('')
+        subqs = []
+        equal = []
+        for (slot, ascending), key in zip(keyslots, state.keys):
+            noval = xapian.Query(xapian.Query.OP_AND_NOT, alldocs,
+                                 xapian.Query(xapian.Query.OP_VALUE_GE,
+                                              slot, '\x00'))
+            if key == '':
+                # Nothing sorts after a missing value.
+                equal.append(noval)
+                continue
+            if ascending:
+                afterq = xapian.Query(xapian.Query.OP_OR,
+                                      xapian.Query(xapian.Query.OP_VALUE_GE,
+                                                   slot, key + '\x00'),
+                                      noval)
+            else:
+                afterq = xapian.Query(xapian.Query.OP_AND_NOT, alldocs,
+                                      xapian.Query(xapian.Query.OP_VALUE_GE,
+                                                   slot, key))
+            subqs.append(xapian.Query(xapian.Query.OP_AND, equal + [afterq]))
+            equal.append(xapian.Query(xapian.Query.OP_VALUE_RANGE,
+                                      slot, key, key))
+        # Documents with equal keys are ordered by document ID.
+        source = _DocidRangePostingSource(state.docid + 1,
+                                          self._index.get_lastdocid())
+        subqs.append(xapian.Query(xapian.Query.OP_AND,
+                                  equal + [xapian.Query(source)]))
+        return xapian.Query(xapian.Query.OP_OR, subqs), source
+
+    def set_profile_aggregator(self, aggregator):
+        """Set an aggregator to collect profiles of searches.
+
+        `aggregator` should be a xappy.ProfileAggregator, or None to stop
+        collecting profiles.  While an aggregator is set, all searches on the
+        connection are profiled (see the `profile` parameter of search()), and
+        the time spent in each phase is added to the aggregator, as is the
+        time spent parsing queries with query_parse().
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        self._profile_aggregator = aggregator
+
+    def _make_profile(self, profile):
+        """Make the profile to record the phases of an operation in.
+
+        If `profile` is False, and no aggregator is set, returns a profile
+        which records nothing.
+
+        """
+        if profile or self._profile_aggregator is not None:
+            return SearchProfile(self._profile_aggregator)
+        return _NullSearchProfile()
 
     def iterids(self):
         """Get an iterator which returns all the ids in the database.
@@ -2366,7 +4383,7 @@ class SearchConnection(object):
             raise errors.SearchError("SearchConnection has been closed")
         return DocumentIter(self, self._index.postlist(''))
 
-    def get_document(self, docid=None, xapid=None):
+    def get_document(self, docid=None, xapid=None, shard=None):
         """Get the document with the specified unique ID.
 
         This should usually be called with the `docid` parameter set to the
@@ -2379,6 +4396,10 @@ class SearchConnection(object):
         Exactly one of the `docid` and `xapid` parameters should be set to
         non-None.
 
+        If the connection is searching several shards, `shard` may be set to
+        the index of a shard: the `docid` or `xapid` is then looked up in that
+        shard only.  (The same document ID may be used in several shards.)
+
         Raises a KeyError if there is no such document.  Otherwise, it returns
         a ProcessedDocument.
 
@@ -2388,10 +4409,15 @@ class SearchConnection(object):
         if docid is not None and xapid is not None:
             raise errors.SearchError("Only one of docid and xapid "
                                       "should be set")
+        db = self._index
+        if shard is not None:
+            if shard < 0 or shard >= len(self._shards):
+                raise errors.SearchError("Shard %r doesn't exist" % shard)
+            db = self._shards[shard]
         while True:
             try:
                 if docid is not None:
-                    postlist = self._index.postlist('Q' + docid)
+                    postlist = db.postlist('Q' + docid)
                     try:
                         plitem = postlist.next()
                     except StopIteration:
@@ -2409,6 +4435,8 @@ class SearchConnection(object):
                 if xapid is None:
                     raise errors.SearchError("Either docid or xapid must be "
                                               "set")
+                if shard is not None:
+                    xapid = self._get_combined_xapid(shard, xapid)
 
                 result = ProcessedDocument(self._field_mappings)
                 result._doc = self._index.get_document(xapid)
@@ -2416,6 +4444,33 @@ class SearchConnection(object):
             except xapian.DatabaseModifiedError, e:
                 self.reopen()
 
+    def _fetch_documents(self, xapids):
+        """Read the documents with the specified xapian document IDs.
+
+        The documents are read in docid order, so that they're read in a
+        single ordered pass over the database.  Returns a dictionary mapping
+        from xapid to xapian.Document: documents which don't exist are
+        omitted.
+
+        """
+        if self._index is None:
+            raise errors.SearchError("SearchConnection has been closed")
+        xapids = list(set(xapids))
+        xapids.sort()
+        while True:
+            try:
+                docs = {}
+                for xapid in xapids:
+                    try:
+                        doc = self._index.get_document(xapid)
+                    except xapian.DocNotFoundError:
+                        continue
+                    doc.get_data()
+                    docs[xapid] = doc
+                return docs
+            except xapian.DatabaseModifiedError, e:
+                self.reopen()
+
     def iter_synonyms(self, prefix=""):
         """Get an iterator over the synonyms.
 
@@ -0,0 +1,593 @@
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""searchpool.py: A pool of search connections, for concurrent searching.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+import Queue
+import sys
+import threading
+import time
+
+import errors
+from query import Query
+from searchconnection import SearchConnection
+
+_log = logging.getLogger('xappy.searchpool')
+
+class SearchRequest(object):
+    """A handle on a request which has been submitted to a SearchPool.
+
+    The request will be performed by one of the pool's worker threads.  The
+    methods of this object may be used to wait for the request to complete, to
+    get its result, or to cancel it.
+
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    TIMED_OUT = 'timed_out'
+
+    def __init__(self, pool, func, args, deadline):
+        self._pool = pool
+        self._func = func
+        self._args = args
+        self.deadline = deadline
+        self.state = self.PENDING
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._result = None
+        self._exc_info = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._callbacks = []
+
+    def _start(self):
+        """Mark the request as running.
+
+        Returns False if the request has been cancelled, or its deadline has
+        already passed, in which case it should not be performed.  If the
+        deadline has passed, the request is marked as timed out, but waiters
+        are not woken until _finish() is called.
+
+        """
+        self._lock.acquire()
+        try:
+            if self.state != self.PENDING:
+                return False
+            now = time.time()
+            if self.deadline is not None and now >= self.deadline:
+                self.state = self.TIMED_OUT
+                self._exc_info = (errors.SearchTimeoutError,
+                    errors.SearchTimeoutError("Deadline passed before the "
+                                              "request was started"), None)
+                self.end_time = now
+                return False
+            self.state = self.RUNNING
+            self.start_time = now
+            return True
+        finally:
+            self._lock.release()
+
+    def _run(self, conn, exc_info=None):
+        """Perform the request, using the given connection.
+
+        If `exc_info` is supplied, the request is not performed, but fails
+        with the given exception instead.  Waiters are not woken until
+        _finish() is called.
+
+        """
+        if exc_info is None:
+            try:
+                self._result = self._func(conn, self, *self._args)
+            except:
+                exc_info = sys.exc_info()
+        self._exc_info = exc_info
+        self._lock.acquire()
+        try:
+            self.state = self.DONE
+            self.end_time = time.time()
+        finally:
+            self._lock.release()
+
+    def _finish(self):
+        """Wake up any waiters, and call the completion callbacks.
+
+        """
+        self._finished.set()
+        self._lock.acquire()
+        try:
+            callbacks = self._callbacks
+            self._callbacks = []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                _log.exception("Unhandled exception in callback for "
+                               "SearchRequest")
+
+    def remaining_time(self):
+        """Get the time remaining before the deadline of the request.
+
+        Returns None if the request has no deadline, or the number of seconds
+        (which may be 0) before the deadline is reached otherwise.
+
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def cancel(self):
+        """Cancel the request.
+
+        Only requests which have not yet started can be cancelled: returns True
+        if the request was cancelled, False otherwise.
+
+        """
+        self._lock.acquire()
+        try:
+            if self.state != self.PENDING:
+                return False
+            self.state = self.CANCELLED
+            self._exc_info = (errors.SearchCancelledError,
+                errors.SearchCancelledError("Request was cancelled"), None)
+            self.end_time = time.time()
+        finally:
+            self._lock.release()
+        self._pool._record_finished(self)
+        self._finish()
+        return True
+
+    def done(self):
+        """Return True if the request has finished (including if it was
+        cancelled or timed out).
+
+        """
+        return self._finished.isSet()
+
+    def wait(self, timeout=None):
+        """Wait for the request to finish.
+
+        `timeout` is the maximum number of seconds to wait for, or None to
+        wait indefinitely.  Returns True if the request has finished, False if
+        the timeout expired first.
+
+        """
+        self._finished.wait(timeout)
+        return self._finished.isSet()
+
+    def result(self, timeout=None):
+        """Get the result of the request, waiting for it to finish if needed.
+
+        `timeout` is the maximum number of seconds to wait for, or None to
+        wait indefinitely.  If the wait times out, a SearchTimeoutError is
+        raised (but the request is not cancelled).
+
+        If the request raised an exception, the exception is raised again
+        here.
+
+        """
+        if not self.wait(timeout):
+            raise errors.SearchTimeoutError("Timed out waiting for request")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, callback):
+        """Add a function to be called when the request finishes.
+
+        The callback is passed the request as its only argument.  It will
+        usually be called from one of the pool's worker threads, so
+        applications using an event loop should use the loop's mechanism for
+        passing control back to the loop thread (for example,
+        `reactor.callFromThread` in twisted).  If the request has already
+        finished, the callback is called immediately.
+
+        """
+        self._lock.acquire()
+        try:
+            if not self._finished.isSet():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback(self)
+
+
+def _resolve_query(conn, query):
+    """Get a query for use with a pooled connection.
+
+    """
+    if isinstance(query, basestring):
+        return conn.query_from_evalable(query)
+    return query(conn)
+
+def _do_search(conn, request, query, startrank, endrank, prefetch, kwargs):
+    """Perform a search on a pooled connection.
+
+    """
+    if request.deadline is not None and 'time_limit' not in kwargs and \
+       conn._supports_time_limit():
+        kwargs = dict(kwargs)
+        kwargs['time_limit'] = request.remaining_time()
+    results = conn.search(_resolve_query(conn, query), startrank, endrank,
+                          **kwargs)
+    if prefetch:
+        results.prefetch()
+    return results
+
+def _do_search_batch(conn, request, searches, prefetch):
+    """Perform a batch of searches on a pooled connection.
+
+    """
+    result = []
+    for query, startrank, endrank, kwargs in searches:
+        result.append(_do_search(conn, request, query, startrank, endrank,
+                                 prefetch, kwargs))
+    return result
+
+def _do_get_document(conn, request, docid, xapid):
+    """Get a document from a pooled connection.
+
+    """
+    doc = conn.get_document(docid, xapid)
+    doc.data
+    return doc
+
+def _do_call(conn, request, func, args, kwargs):
+    """Call an arbitrary function with a pooled connection.
+
+    """
+    return func(conn, *args, **kwargs)
+
+
+class SearchPool(object):
+    """A pool of search connections, used to perform searches concurrently.
+
+    The pool holds a fixed number of worker threads, each of which has its own
+    SearchConnection to the index.  Requests submitted to the pool are queued,
+    and performed by the first available worker; the methods which submit
+    requests return immediately with a SearchRequest object, which can be used
+    to wait for the result.  Thus, at most `size` requests are performed at
+    once, however many are submitted.
+
+    Queries must be passed to the pool in a form which can be rebuilt for the
+    worker's own connection: either as a Query object which can be serialised
+    (see Query.evalable_repr()), as a serialised query string, or as a
+    callable which takes a SearchConnection and returns a Query.
+
+    """
+    def __init__(self, indexpath, size=4, maxqueued=0):
+        """Create a new pool of search connections.
+
+        - `indexpath` is the path to the index to search.
+        - `size` is the number of connections (and worker threads) to use.
+        - `maxqueued` is the maximum number of requests which may be waiting
+          to be performed.  If more requests than this are submitted, the
+          excess requests will be refused with a SearchError.  A value of 0
+          means that there is no limit.
+
+        """
+        if size < 1:
+            raise errors.SearchError("SearchPool size must be at least 1")
+        self._indexpath = indexpath
+        self._queue = Queue.Queue(maxqueued)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'timed_out': 0,
+            'refused': 0,
+            'running': 0,
+            'max_queue_depth': 0,
+            'total_wait_time': 0.0,
+            'total_run_time': 0.0,
+        }
+
+        conns = []
+        try:
+            for i in xrange(size):
+                conns.append(SearchConnection(indexpath))
+        except:
+            for conn in conns:
+                conn.close()
+            raise
+
+        self._reopen_needed = [False] * size
+        self._workers = []
+        for i, conn in enumerate(conns):
+            thread = threading.Thread(target=self._worker, args=(i, conn))
+            thread.setDaemon(True)
+            self._workers.append(thread)
+            thread.start()
+
+    def _worker(self, num, conn):
+        """The main loop of a worker thread.
+
+        """
+        try:
+            while True:
+                request = self._queue.get()
+                if request is None:
+                    break
+                # If the connection can't be reopened, the request fails
+                # with the error, and the reopen is tried again for the next
+                # request.
+                reopen_error = None
+                if self._reopen_needed[num]:
+                    try:
+                        conn.reopen()
+                        self._reopen_needed[num] = False
+                    except:
+                        reopen_error = sys.exc_info()
+                if not request._start():
+                    if request.state == request.TIMED_OUT:
+                        self._record_finished(request)
+                        request._finish()
+                    continue
+                self._lock.acquire()
+                try:
+                    self._stats['running'] += 1
+                finally:
+                    self._lock.release()
+                request._run(conn, reopen_error)
+                self._record_finished(request)
+                request._finish()
+        finally:
+            conn.close()
+
+    def _record_finished(self, request):
+        """Update the statistics for a finished request.
+
+        """
+        self._lock.acquire()
+        try:
+            stats = self._stats
+            if request.state == request.DONE:
+                stats['running'] -= 1
+                if request._exc_info is None:
+                    stats['completed'] += 1
+                else:
+                    stats['failed'] += 1
+                stats['total_wait_time'] += \
+                    request.start_time - request.submit_time
+                stats['total_run_time'] += \
+                    request.end_time - request.start_time
+            elif request.state == request.CANCELLED:
+                stats['cancelled'] += 1
+            elif request.state == request.TIMED_OUT:
+                stats['timed_out'] += 1
+        finally:
+            self._lock.release()
+
+    def _submit(self, func, args, timeout):
+        """Submit a request to the pool.
+
+        """
+        if self._closed:
+            raise errors.SearchError("SearchPool has been closed")
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        request = SearchRequest(self, func, args, deadline)
+        try:
+            self._queue.put_nowait(request)
+        except Queue.Full:
+            self._lock.acquire()
+            try:
+                self._stats['refused'] += 1
+            finally:
+                self._lock.release()
+            raise errors.SearchError("SearchPool queue is full")
+        self._lock.acquire()
+        try:
+            self._stats['submitted'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'],
+                                                 self._queue.qsize())
+        finally:
+            self._lock.release()
+        return request
+
+    @staticmethod
+    def _check_query(query):
+        """Convert a query to a form which can be passed to a worker.
+
+        """
+        if isinstance(query, Query):
+            serialised = query.evalable_repr()
+            if serialised is None:
+                raise errors.SearchError("Query cannot be serialised, so "
+                                         "cannot be used with a SearchPool: "
+                                         "pass a callable instead")
+            return serialised
+        if isinstance(query, basestring) or callable(query):
+            return query
+        raise errors.SearchError("Unsupported query type for SearchPool: %r" %
+                                 query)
+
+    def search(self, query, startrank, endrank, timeout=None, prefetch=True,
+               **kwargs):
+        """Submit a search to the pool.
+
+        - `query` is the query to perform (see the class documentation for
+          the forms accepted).
+        - `startrank` and `endrank` are as for SearchConnection.search().
+        - `timeout` is the number of seconds within which the request must
+          be completed: if it is still queued when this expires, it is not
+          performed, and its result will be a SearchTimeoutError.  Otherwise,
+          the remaining time is used as the `time_limit` of the search
+          (unless a `time_limit` is supplied explicitly, or the connection
+          doesn't support time limits), so a search which is running when
+          the deadline passes returns partial results.  None means no
+          deadline.
+        - `prefetch` is a flag: if True, the documents for the hits are read
+          by the worker (see SearchResults.prefetch()), so that no further
+          database access is needed to display the results.
+
+        Any other keyword arguments are passed to SearchConnection.search().
+
+        Returns a SearchRequest, whose result will be a SearchResults object.
+
+        """
+        query = self._check_query(query)
+        return self._submit(_do_search, (query, startrank, endrank, prefetch,
+                                         kwargs), timeout)
+
+    def search_batch(self, searches, timeout=None, prefetch=True):
+        """Submit several searches to the pool, to be performed together.
+
+        `searches` is a sequence of tuples of (query, startrank, endrank,
+        kwargs), where kwargs is a dict of keyword arguments to pass to
+        SearchConnection.search() (and may be omitted).  The searches are all
+        performed by a single worker, avoiding the overhead of handing each
+        one to a worker separately.
+
+        Returns a SearchRequest, whose result will be a list of SearchResults
+        objects, in the same order as `searches`.
+
+        """
+        checked = []
+        for search in searches:
+            if len(search) == 3:
+                query, startrank, endrank = search
+                kwargs = {}
+            else:
+                query, startrank, endrank, kwargs = search
+            checked.append((self._check_query(query), startrank, endrank,
+                            kwargs))
+        return self._submit(_do_search_batch, (checked, prefetch), timeout)
+
+    def get_document(self, docid=None, xapid=None, timeout=None):
+        """Submit a request to get a document from the index.
+
+        Returns a SearchRequest, whose result will be the ProcessedDocument
+        (as returned by SearchConnection.get_document()).
+
+        """
+        return self._submit(_do_get_document, (docid, xapid), timeout)
+
+    def call(self, func, *args, **kwargs):
+        """Submit a request to call an arbitrary function with a connection.
+
+        The function will be called with a SearchConnection as its first
+        argument, followed by the supplied positional and keyword arguments.
+        The function must not keep a reference to the connection after it
+        returns.
+
+        A `timeout` keyword argument may be supplied, which is used as for
+        search() (and not passed to the function).
+
+        Returns a SearchRequest, whose result will be the return value of the
+        function.
+
+        """
+        timeout = kwargs.pop('timeout', None)
+        return self._submit(_do_call, (func, args, kwargs), timeout)
+
+    def reopen(self):
+        """Reopen all the connections in the pool.
+
+        Each worker will reopen its connection before performing its next
+        request, so requests submitted after this call will see the latest
+        flushed revision of the index.  If a connection can't be reopened,
+        the next request performed by its worker fails with the error, and
+        the reopen is tried again before the following request.
+
+        """
+        for i in xrange(len(self._reopen_needed)):
+            self._reopen_needed[i] = True
+
+    def get_stats(self):
+        """Get statistics about the requests made to the pool.
+
+        Returns a dictionary holding the following items:
+
+         - `workers`: the number of workers in the pool.
+         - `queued`: the number of requests currently waiting to be started.
+         - `running`: the number of requests currently being performed.
+         - `max_queue_depth`: the largest number of requests which have been
+           waiting at once.
+         - `submitted`: the number of requests accepted by the pool.
+         - `refused`: the number of requests refused because the queue was
+           full.
+         - `completed`: the number of requests which completed successfully.
+         - `failed`: the number of requests which raised an exception.
+         - `cancelled`: the number of requests which were cancelled.
+         - `timed_out`: the number of requests which were not started before
+           their deadline.
+         - `mean_wait_time`: the average time (in seconds) that performed
+           requests waited before being started.
+         - `mean_run_time`: the average time (in seconds) taken to perform
+           requests.
+
+        """
+        self._lock.acquire()
+        try:
+            result = dict(self._stats)
+        finally:
+            self._lock.release()
+        performed = result['completed'] + result['failed']
+        if performed:
+            result['mean_wait_time'] = result['total_wait_time'] / performed
+            result['mean_run_time'] = result['total_run_time'] / performed
+        else:
+            result['mean_wait_time'] = 0.0
+            result['mean_run_time'] = 0.0
+        del result['total_wait_time']
+        del result['total_run_time']
+        result['workers'] = len(self._workers)
+        result['queued'] = self._queue.qsize()
+        return result
+
+    def close(self):
+        """Close the pool.
+
+        Requests which are still waiting to be performed are cancelled, the
+        worker threads are stopped once any requests they are performing have
+        finished, and the connections are closed.
+
+        It is permissible to call close() multiple times, but only the first
+        call will have any effect.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if request is not None:
+                request.cancel()
+        for thread in self._workers:
+            self._queue.put(None)
+        for thread in self._workers:
+            thread.join()
@@ -534,6 +534,16 @@ class SearchResult(ProcessedDocument):
             results.append(highlighter.highlight(text, query, hl, strip_tags))
         return results
 
+    def _get_shard(self):
+        return self._conn.get_shard(self._doc.get_docid())[0]
+    shard = property(_get_shard, doc=
+    """The index of the shard holding the document.
+
+    This is the index in the list of database paths passed to the
+    SearchConnection (and is always 0 for a connection to a single database).
+
+    """)
+
     def __repr__(self):
         return ('<SearchResult(rank=%d, id=%r, data=%r)>' %
                 (self.rank, self.id, self.data))
@@ -554,8 +564,21 @@ class SearchResults(object):
         self._field_mappings = field_mappings
         self._facets = facets
 
+        # List of hits which have been read by prefetch(), or None.
+        self._hits = None
+
+        # Flag, set when the documents for the hits have been read in a batch.
+        self._fetched = False
+
+        # The SearchProfile of the search, if it was profiled, or None.
+        self.profile = None
+
+        # The cursor for the next page of results, if the search was performed
+        # with SearchConnection.search_after(), or None.
+        self.next_cursor = None
+
     def _cluster(self, num_clusters, maxdocs, fields=None,
-                 assume_single_value=False):
+                 assume_single_value=False, method='singlelink'):
         """Cluster results based on similarity.
 
         Note: this method is experimental, and will probably disappear or
@@ -565,9 +588,24 @@ class SearchResults(object):
         too few results, there will be exaclty this number of clusters in the
         result.
 
+        `method` selects the clustering algorithm:
+
+         - 'singlelink' (the default) uses xapian's single-link clusterer,
+           which takes time quadratic in `maxdocs`.
+         - 'kmeans' builds a vector for each of the top `maxdocs` documents
+           (from the sketches of the fields, if they all have the SKETCH
+           action, or by hashing their terms otherwise), and clusters them
+           with k-means, which takes time linear in `maxdocs`.  This
+           requires numpy.  Only the top `maxdocs` documents are assigned to
+           clusters, and there may be fewer than `num_clusters` clusters if
+           many documents are identical.
+
+        Returns a dictionary mapping from cluster number to a list of the
+        ranks of the documents in the cluster.
+
         """
         return self._ordering._cluster(num_clusters, maxdocs, fields,
-                                       assume_single_value)
+                                       assume_single_value, method)
 
     def _reorder_by_collapse(self, highest_possible_percentage = 50.0):
         """Reorder the result by the values in the slot used to collapse on.
@@ -578,12 +616,30 @@ class SearchResults(object):
         pick a value for the top hit.  This variable specifies that percentage.
 
         """
+        self._hits = None
         self._ordering = self._ordering._reorder_by_collapse(highest_possible_percentage)
 
+    def _reorder_by_keys(self, keyfunc, highest_possible_percentage = 50.0):
+        """Reorder the result to diversify the values of a key.
+
+        This works like _reorder_by_collapse(), but the categories to
+        diversify are given by calling `keyfunc` with each hit (a
+        SearchResult), rather than by the collapse values.  `keyfunc` must
+        return a hashable value.
+
+        The new order is calculated lazily, so if only the first few hits are
+        accessed, only those positions are calculated.
+
+        """
+        keys = [keyfunc(hit) for hit in self]
+        self._hits = None
+        self._ordering = self._ordering._reorder_by_keys(keys, highest_possible_percentage)
+
     def _reorder_by_clusters(self, clusters):
         """Reorder the results based on some clusters.
 
         """
+        self._hits = None
         self._ordering = self._ordering._reorder_by_clusters(clusters)
 
     def _reorder_by_similarity(self, count, maxcount, max_similarity,
@@ -596,10 +652,18 @@ class SearchResults(object):
         similarity to the previous document before a document is moved down the
         result set.
 
+        If all the `fields` have the SKETCH action, the sketches stored for
+        them are compared instead of the termlists of the documents, which is
+        much faster.  The sketches give an estimate of the cosine similarity
+        of the documents, so the same `max_similarity` may be used either way.
+        When comparing sketches, each document is compared with all the
+        documents already chosen, rather than just the previous one.
+
         Note: this method is experimental, and will probably disappear or
         change in the future.
 
         """
+        self._hits = None
         self._ordering = self._ordering._reorder_by_similarity(count, maxcount,
                                                                max_similarity,
                                                                fields)
@@ -688,6 +752,8 @@ class SearchResults(object):
     """)
 
     def _estimate_is_exact(self):
+        if self._stats.partial:
+            return False
         return self._stats.get_lower_bound() == \
                self._stats.get_upper_bound()
     estimate_is_exact = property(_estimate_is_exact, doc=
@@ -700,12 +766,69 @@ class SearchResults(object):
     documents is different from the number given by the `matches_estimated`
     property.
 
+    This always returns false if the results are partial.
+
+    """)
+
+    def _get_is_partial(self):
+        return self._stats.partial
+    is_partial = property(_get_is_partial, doc=
+    """Check whether the search was stopped early by its time limit.
+
+    If this returns true, the match was stopped before all the matching
+    documents had been checked (see the `time_limit` parameter of
+    SearchConnection.search()).  The hits returned are the best found in the
+    documents which were checked, and any facet counts only reflect those
+    documents.
+
     """)
 
+    def prefetch(self):
+        """Read the documents for all the hits in the results into memory.
+
+        Normally, the documents for each hit are read from the database when
+        the hit is first accessed.  After calling this method, the hits are
+        held in memory, so subsequent accesses to them (including accesses from
+        other threads) will not need to read from the database.
+
+        """
+        if self._hits is not None:
+            return
+        if self.profile is not None:
+            self.profile.start_phase('materialise')
+        self._fetch()
+        hits = []
+        for hit in self:
+            # Reading the data forces the document to be read.
+            hit.data
+            hits.append(hit)
+        self._hits = hits
+        if self.profile is not None:
+            self.profile.end_phase()
+
+    def _fetch(self):
+        """Read the documents for all the hits in a single batch.
+
+        This is done when the results are first iterated over, since all the
+        documents will then be read.  Reading them in a batch (in docid order)
+        is much faster than reading them one at a time in rank order when they
+        aren't already cached.  The document data is still only decoded when
+        each field is accessed.
+
+        """
+        if self._fetched:
+            return
+        self._fetched = True
+        fetch = getattr(self._ordering, 'fetch', None)
+        if fetch is not None:
+            fetch()
+
     def get_hit(self, index):
         """Get the hit with a given index.
 
         """
+        if self._hits is not None:
+            return self._hits[index]
         return self._ordering.get_hit(index)
 
     def __getitem__(self, index_or_slice):
@@ -724,6 +847,9 @@ class SearchResults(object):
         The iterator returns the results in increasing order of rank.
 
         """
+        if self._hits is not None:
+            return iter(self._hits)
+        self._fetch()
         return self._ordering.get_iter()
 
     def __len__(self):
@@ -753,6 +879,47 @@ class SearchResults(object):
         """
         return self._facets.get_facets()
 
+    def get_facet(self, field):
+        """Get the facet values calculated for a single field.
+
+        This returns a sequence of 2-tuples holding the suggested values or
+        ranges for the field, as for get_facets().  Unlike get_facets(), only
+        the values for this field are calculated (if they haven't been
+        already), so this is faster when only a few of the facets calculated
+        by the search are displayed.
+
+        Raises KeyError if the facet wasn't calculated by the search.
+
+        """
+        return self._facets.get_facet(field)
+
+    def get_facet_intervals(self, field):
+        """Get confidence intervals for the counts of a single facet.
+
+        This returns a sequence of 2-tuples holding the values or ranges for
+        the field, as for get_facet(), and a (lower, upper) tuple bounding the
+        count for each value.  If the facet was counted on a sample of the
+        matches (see the `facet_sample_size` parameter of
+        SearchConnection.search()), the bounds are an approximate 95%
+        confidence interval; otherwise, the counts are exact, and both bounds
+        are equal to the count.
+
+        Raises KeyError if the facet wasn't calculated by the search.
+
+        """
+        return self._facets.get_facet_intervals(field)
+
+    def _get_facet_sample_rate(self):
+        return getattr(self._facets, 'sample_rate', None)
+    facet_sample_rate = property(_get_facet_sample_rate, doc=
+    """The proportion of the matching documents which facets were counted on.
+
+    This is None if facets were counted on all the matching documents (or
+    weren't counted).  Otherwise, the facet counts are estimates, scaled up
+    from the counts in a random sample of the matches.
+
+    """)
+
     def get_suggested_facets(self, maxfacets=5, desired_num_of_categories=None,
                              required_facets=None):
         """Get a suggested set of facets, to present to the user.
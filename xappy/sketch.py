@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 agent
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""sketch.py: SimHash sketches of the terms in a document.
+
+A sketch is a 64 bit hash of a weighted set of terms, built such that the
+proportion of bits which differ between the sketches of two sets of terms
+approximates the angle between them: similar documents have sketches which
+differ in only a few bits.  Sketches are calculated at indexing time by the
+SKETCH field action, and stored in a value slot, so that the similarity of
+search results can be compared without reading their termlists.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+import struct
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+# The number of bits in a sketch.
+SKETCH_BITS = 64
+
+# The number of bits set in each byte value.
+_byte_bits = [0] * 256
+for _i in xrange(1, 256):
+    _byte_bits[_i] = _byte_bits[_i >> 1] + (_i & 1)
+del _i
+
+def _term_bits(term):
+    """Get the 64 bit hash of a term.
+
+    md5 is used (rather than the builtin hash()) so that the hash is the same
+    on all platforms.
+
+    """
+    return struct.unpack('>Q', md5(term).digest()[:8])[0]
+
+def add_terms(counts, terms):
+    """Add a weighted set of terms to the counts used to build a sketch.
+
+    `counts` is a list of SKETCH_BITS numbers (initially all 0), which is
+    modified in place.  `terms` is an iterable of (term, wdf) pairs.  The
+    weight of each term is 1 + log(wdf), so that repeated terms don't
+    dominate the sketch.
+
+    """
+    for term, wdf in terms:
+        if wdf <= 0:
+            continue
+        weight = 1.0 + math.log(wdf)
+        bits = _term_bits(term)
+        for i in xrange(SKETCH_BITS):
+            if bits & (1 << i):
+                counts[i] += weight
+            else:
+                counts[i] -= weight
+
+def make_sketch(counts):
+    """Make a sketch from the counts built by add_terms().
+
+    """
+    sketch = 0
+    for i in xrange(SKETCH_BITS):
+        if counts[i] > 0:
+            sketch |= 1 << i
+    return sketch
+
+def serialise(sketch):
+    """Serialise a sketch, for storing in a value slot.
+
+    """
+    return struct.pack('>Q', sketch)
+
+def unserialise(value):
+    """Unserialise a sketch read from a value slot.
+
+    Returns None if the value is empty (ie, if the document had no sketch).
+
+    """
+    if len(value) != 8:
+        return None
+    return struct.unpack('>Q', value)[0]
+
+def similarity(sketch1, sketch2):
+    """Get the similarity of two sketches.
+
+    This is an estimate of the cosine similarity of the sets of terms which
+    the sketches were made from: the proportion of bits which differ
+    estimates the angle between them, as a fraction of pi.  Like the cosine
+    similarity of term weights, it is 1.0 for identical sets of terms and
+    around 0 for unrelated ones.  Negative estimates are returned as 0.
+
+    """
+    diff = sketch1 ^ sketch2
+    count = 0
+    while diff:
+        count += _byte_bits[diff & 0xff]
+        diff >>= 8
+    return max(0.0, math.cos(math.pi * count / SKETCH_BITS))
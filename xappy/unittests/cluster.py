@@ -74,5 +74,43 @@ class TestCluster(TestCase):
                           2: [16, 17, 18, 19, 20, 21, 22, 23],
                           3: [24, 25, 26, 27, 28, 29, 30, 31]})
 
+    def test_cluster_kmeans(self):
+        """Test clustering with k-means.
+
+        """
+        results = self.sconn.query_all().search(0, 100)
+        self.assertRaises(xappy.SearchError, results._cluster, 4, 100,
+                          method='foo')
+        if xappy.clustering.numpy is None:
+            self.assertRaises(xappy.SearchError, results._cluster, 4, 100,
+                              method='kmeans')
+            return
+
+        clusters = results._cluster(4, 100, 'num', method='kmeans')
+        self.assertEqual(clusters,
+                         {0: [0, 1, 2, 3, 4, 5, 6, 7],
+                          1: [8, 9, 10, 11, 12, 13, 14, 15],
+                          2: [16, 17, 18, 19, 20, 21, 22, 23],
+                          3: [24, 25, 26, 27, 28, 29, 30, 31]})
+
+        # Identical documents are never split, so there are only as many
+        # clusters as distinct values.
+        clusters = results._cluster(10, 100, 'num', method='kmeans')
+        self.assertEqual(len(clusters), 4)
+
+        # Only the top maxdocs documents are clustered.
+        clusters = results._cluster(4, 12, 'num', method='kmeans')
+        self.assertEqual(clusters,
+                         {0: [0, 1, 2, 3, 4, 5, 6, 7],
+                          1: [8, 9, 10, 11]})
+
+        clusters = results._cluster(5, 100, 'text', method='kmeans')
+        self.assert_(1 < len(clusters) <= 5)
+        ranks = []
+        for clusterid, clusterranks in clusters.iteritems():
+            ranks.extend(clusterranks)
+        self.assertEqual(sorted(ranks), range(32))
+        self.assertEqual(clusters[0][0], 0)
+
 if __name__ == '__main__':
     main()
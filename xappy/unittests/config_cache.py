@@ -0,0 +1,70 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestConfigCache(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        self.iconn = xappy.IndexerConnection(self.indexpath)
+        self.iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        self.iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        self.iconn.flush()
+
+    def post_test(self):
+        self.iconn.close()
+
+    def _add_doc(self, text):
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('text', text))
+        self.iconn.add(doc)
+        self.iconn.flush()
+
+    def test_config_cache(self):
+        """Test that parsed configurations are shared and reused.
+
+        """
+        sconn1 = xappy.SearchConnection(self.indexpath)
+        sconn2 = xappy.SearchConnection(self.indexpath)
+        actions = sconn1._field_actions
+        mappings = sconn1._field_mappings
+        self.assertTrue(sconn2._field_actions is actions)
+        self.assertTrue(sconn2._field_mappings is mappings)
+
+        # Reopening after a change which doesn't affect the configuration
+        # keeps the parsed configuration.
+        self._add_doc('hello world')
+        sconn1.reopen()
+        self.assertTrue(sconn1._field_actions is actions)
+        self.assertTrue(sconn1._field_mappings is mappings)
+        self.assertEqual(sconn1._next_docid, 1)
+        self.assertEqual(sconn1.query_parse('hello').search(0, 10).matches_estimated, 1)
+
+        # Changing the configuration causes it to be parsed again.
+        self.iconn.add_field_action('title', xappy.FieldActions.INDEX_FREETEXT)
+        self._add_doc('hello again')
+        sconn1.reopen()
+        self.assertFalse(sconn1._field_actions is actions)
+        self.assertTrue('title' in sconn1._field_actions)
+        self.assertFalse('title' in sconn2._field_actions)
+        sconn2.reopen()
+        self.assertTrue(sconn2._field_actions is sconn1._field_actions)
+        self.assertEqual(sconn2.query_parse('hello').search(0, 10).matches_estimated, 2)
+
+        sconn1.close()
+        sconn2.close()
+
+if __name__ == '__main__':
+    main()
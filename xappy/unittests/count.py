@@ -0,0 +1,88 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+
+class TestCount(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('cat', xappy.FieldActions.INDEX_EXACT)
+        for i in xrange(30):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'hello'))
+            if i % 2:
+                doc.fields.append(xappy.Field('text', 'odd'))
+            if i % 3 == 0:
+                doc.fields.append(xappy.Field('text', 'three'))
+            doc.fields.append(xappy.Field('cat', str(i % 4)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def check_count(self, query, expected):
+        self.assertEqual(self.sconn.count(query, exact=True), expected)
+        results = query.search(0, 0, checkatleast=-1)
+        self.assertEqual(results.matches_estimated, expected)
+        estimate = self.sconn.count(query)
+        self.assert_(results.matches_lower_bound <= estimate <=
+                     results.matches_upper_bound)
+
+    def test_count(self):
+        """Test counting the matches of queries.
+
+        """
+        sconn = self.sconn
+        self.check_count(sconn.query_all(), 30)
+        self.check_count(sconn.query_none(), 0)
+        self.check_count(sconn.query_field('text', 'odd'), 15)
+        self.check_count(sconn.query_field('cat', '1'), 8)
+        self.check_count(sconn.query_field('cat', '9'), 0)
+        self.check_count(sconn.query_field('text', 'odd') &
+                         sconn.query_field('text', 'three'), 5)
+        self.check_count(sconn.query_field('text', 'odd') |
+                         sconn.query_field('text', 'three'), 20)
+        self.check_count(sconn.query_field('text', 'hello').filter(
+                         sconn.query_field('cat', '2')), 7)
+        self.check_count(sconn.query_field('text', 'odd') * 2, 15)
+
+        # Single terms are counted from the term frequency.
+        self.assertEqual(sconn._count_from_termfreq(
+            sconn.query_field('text', 'odd')._get_xapian_query()), 15)
+        self.assertEqual(sconn._count_from_termfreq(
+            sconn.query_all()._get_xapian_query()), 30)
+        # Scaled weights (as for exact fields and facets) and term positions
+        # don't stop the term frequency being used.
+        self.assertEqual(sconn._count_from_termfreq(
+            sconn.query_field('cat', '1')._get_xapian_query()), 8)
+        self.assertEqual(sconn._count_from_termfreq(
+            (sconn.query_field('text', 'odd') * 2)._get_xapian_query()), 15)
+        self.assertEqual(sconn._count_from_termfreq(
+            (sconn.query_field('text', 'odd') &
+             sconn.query_field('text', 'three'))._get_xapian_query()), None)
+
+        q = sconn.query_all()
+        sconn.close()
+        self.assertRaises(xappy.SearchError, sconn.count, q)
+
+if __name__ == '__main__':
+    main()
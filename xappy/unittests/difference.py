@@ -115,5 +115,33 @@ class DifferenceSearchTest(TestCase):
     def test_cuttoff_facet_exact(self):
         self.cutoff_test(5, 'foo', 'collsort', False)
 
+    def test_difference_exact_weights(self):
+        """Test the weights returned by exact difference searches.
+
+        """
+        # The second formula can't be evaluated for an array of values, so
+        # is evaluated for each value separately.
+        for func in ("abs(x - y)", "max(x - y, y - x)"):
+            q = self.sconn.query_difference('foo', 3, 'collsort',
+                                            difference_func=func)
+            res = self.sconn.search(q, 0, 10)
+            self.assertEqual(len(res), 10)
+            for r in res:
+                expected = 1.0 / (abs(3 - float(r.data['foo'][0])) + 1.0)
+                self.assertAlmostEqual(r.weight, expected)
+
+        # Documents with no value are matched, with a weight of 0.
+        iconn = xappy.IndexerConnection(self.dbpath)
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('bar', 1))
+        iconn.add(doc)
+        iconn.close()
+        self.sconn.reopen()
+        q = self.sconn.query_difference('foo', 3, 'collsort')
+        res = self.sconn.search(q, 0, 20)
+        self.assertEqual(len(res), 11)
+        self.assertEqual(res[10].weight, 0)
+        self.assertEqual(res[10].data.get('foo'), None)
+
 if __name__ == '__main__':
     main()
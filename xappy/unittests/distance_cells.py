@@ -0,0 +1,169 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+class DistanceCellsTest(TestCase):
+    """Tests for distance searches using grid cell terms.
+
+    """
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION,
+                               cells=True)
+        iconn.add_field_action('plain', xappy.FieldActions.GEOLOCATION)
+        rnd = random.Random(17)
+        for i in xrange(300):
+            if i % 3 == 0:
+                # Points near London.
+                lat, lon = rnd.uniform(51, 52), rnd.uniform(-1, 1)
+            elif i % 3 == 1:
+                # Points near the antimeridian.
+                lat, lon = rnd.uniform(-20, -15), rnd.uniform(178, 182)
+                if lon > 180:
+                    lon -= 360
+            else:
+                lat, lon = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('loc', '%f %f' % (lat, lon)))
+            doc.fields.append(xappy.Field('plain', '%f %f' % (lat, lon)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.dbpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def _ids(self, field, centre, max_range):
+        query = self.sconn.query_distance(field, centre, max_range=max_range)
+        return [r.id for r in query.search(0, 1000)]
+
+    def test_cells(self):
+        """Test that searches using cells give the same results.
+
+        """
+        self.assertNotEqual(self.sconn._get_geo_cell_prefix('loc'), None)
+        self.assertEqual(self.sconn._get_geo_cell_prefix('plain'), None)
+        tests = [
+            ('51.5 0', 1000),
+            ('51.5 0', 20000),
+            ('51.5 0', 100000),
+            ('-17 180', 50000),
+            ('-17 -179.9', 150000),
+            (('51.5 0', '-17 179'), 80000),
+            ('89 10', 500000),
+            ('0 0', 5000000),
+            ('0 0', 30000000),
+        ]
+        for centre, max_range in tests:
+            expected = self._ids('plain', centre, max_range)
+            self.assertEqual(self._ids('loc', centre, max_range), expected)
+        self.assertTrue(len(self._ids('loc', '-17 180', 150000)) > 0)
+
+    def test_nearest(self):
+        """Test searching for the nearest documents.
+
+        """
+        tests = [
+            ('51.5 0', 1),
+            ('51.5 0', 10),
+            ('51.5 0', 150),
+            ('-17 180', 5),
+            ('-17 -179.99', 20),
+            (('51.5 0', '-17 179'), 30),
+            ('-89 0', 3),
+            ('0 0', 300),
+        ]
+        for centre, k in tests:
+            expected = self.sconn.query_distance('plain', centre).search(0, k)
+            query = self.sconn.query_nearest('loc', centre, k)
+            results = query.search(0, k)
+            self.assertEqual([r.id for r in results],
+                             [r.id for r in expected])
+            # Without cells, the result is the same.
+            query = self.sconn.query_nearest('plain', centre, k)
+            self.assertEqual([r.id for r in query.search(0, k)],
+                             [r.id for r in expected])
+
+        query = self.sconn.query_nearest('loc', '51.5 0', 3)
+        query2 = self.sconn.query_from_evalable(query.evalable_repr())
+        self.assertEqual([r.id for r in query2.search(0, 3)],
+                         [r.id for r in query.search(0, 3)])
+        self.assertRaises(xappy.SearchError, self.sconn.query_nearest,
+                          'loc', '51.5 0', 0)
+
+    def test_config(self):
+        """Test that adding GEOLOCATION actions twice keeps one action.
+
+        """
+        iconn = xappy.IndexerConnection(os.path.join(self.tempdir, 'db2'))
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION)
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION,
+                               cells=True)
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION)
+        actions = iconn._field_actions['loc']._actions
+        self.assertEqual(len(actions[xappy.FieldActions.GEOLOCATION]), 1)
+        self.assertTrue(actions[xappy.FieldActions.GEOLOCATION][0]['cells'])
+        iconn.close()
+
+    def test_added_cells(self):
+        """Test turning on cell terms for a field which has documents.
+
+        """
+        dbpath = os.path.join(self.tempdir, 'db3')
+        iconn = xappy.IndexerConnection(dbpath)
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION)
+        for i, loc in enumerate(('51.5 0', '51.51 0.01')):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('loc', loc))
+            iconn.add(doc)
+        iconn.close()
+
+        # Documents indexed before the cells were turned on don't have cell
+        # terms, so the cells aren't used until they're reindexed.
+        iconn = xappy.IndexerConnection(dbpath)
+        iconn.add_field_action('loc', xappy.FieldActions.GEOLOCATION,
+                               cells=True)
+        doc = xappy.UnprocessedDocument()
+        doc.id = '2'
+        doc.fields.append(xappy.Field('loc', '51.52 0'))
+        iconn.add(doc)
+        iconn.flush()
+        sconn = xappy.SearchConnection(dbpath)
+        self.assertEqual(sconn._get_geo_cell_prefix('loc'), None)
+        query = sconn.query_distance('loc', '51.5 0', max_range=10000)
+        self.assertEqual([r.id for r in query.search(0, 10)],
+                         ['0', '1', '2'])
+
+        for i, loc in enumerate(('51.5 0', '51.51 0.01')):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('loc', loc))
+            iconn.replace(doc)
+        iconn.close()
+        sconn.reopen()
+        self.assertNotEqual(sconn._get_geo_cell_prefix('loc'), None)
+        query = sconn.query_distance('loc', '51.5 0', max_range=10000)
+        self.assertEqual([r.id for r in query.search(0, 10)],
+                         ['0', '1', '2'])
+        sconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -76,5 +76,45 @@ class TestDiversity(TestCase):
                          [3, 15, 23, 31, 7, 11, 19, 27, 17, 13, 5, 25, 14, 21,
                          26, 6, 30, 22, 9, 1])
 
+    def test_diversity_keys(self):
+        """Test reordering for diversity by other keys.
+
+        """
+        q = self.sconn.query_parse('termA termB', default_op=xappy.Query.OP_OR)
+        results = q.search(0, 100, collapse='num', collapse_max=5)
+        expected = [3, 15, 23, 31, 7, 11, 19, 27, 17, 13, 5, 25, 14, 21,
+                    26, 6, 30, 22, 9, 1]
+
+        # Reordering by the stored value gives the same order as by the
+        # collapse key.
+        results._reorder_by_keys(lambda hit: hit.data['num'][0])
+        self.assertEqual(len(results), 20)
+        self.assertEqual([int(results[i].data['i'][0]) for i in xrange(3)],
+                         expected[:3])
+        self.assertEqual([int(hit.data['i'][0]) for hit in results], expected)
+
+        # Keys which are all the same leave the order unchanged.
+        results = q.search(0, 100, collapse='num', collapse_max=5)
+        origorder = [int(hit.data['i'][0]) for hit in results]
+        results._reorder_by_keys(lambda hit: 0)
+        self.assertEqual([int(hit.data['i'][0]) for hit in results],
+                         origorder)
+
+    def test_diversify(self):
+        """Test the diversify function directly.
+
+        """
+        from xappy.diversity import diversify, LazyOrder
+        keys = ['a', 'a', 'a', 'b', 'b', 'c']
+        relevances = [0.9, 0.8, 0.7, 0.6, 0.5, 0.1]
+        utilities = {'a': 0.5, 'b': 0.4, 'c': 0.1}
+        order = list(diversify(keys, relevances, utilities))
+        self.assertEqual(order, [0, 3, 4, 1, 5, 2])
+        lazy = LazyOrder(diversify(keys, relevances, utilities), len(keys))
+        self.assertEqual(lazy[1], 3)
+        self.assertEqual(len(lazy._items), 2)
+        self.assertEqual(lazy[-1], 2)
+        self.assertEqual(list(lazy), order)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,96 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestFacetSampling(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_EXACT)
+        iconn.add_field_action('category', xappy.FieldActions.FACET)
+        for i in xrange(2000):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'all'))
+            doc.fields.append(xappy.Field('category', 'abcd'[i % 4]))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_sampled_facets(self):
+        query = self.sconn.query_field('text', 'all')
+        results = query.search(0, 10, getfacets=True, facet_sample_size=200)
+        self.assertEqual(results.facet_sample_rate, 0.1)
+        self.assertEqual(results.matches_estimated, 2000)
+        facet = results.get_facet('category')
+        self.assertEqual([value for value, count in facet],
+                         ['a', 'b', 'c', 'd'])
+        intervals = results.get_facet_intervals('category')
+        for (value, count), (value2, (lower, upper)) in zip(facet, intervals):
+            self.assertEqual(value, value2)
+            self.assert_(abs(count - 500) < 250)
+            self.assert_(lower < count < upper)
+            self.assert_(upper - lower < 600)
+
+        # The sample is the same for each page of results.
+        results = query.search(10, 20, getfacets=True, facet_sample_size=200)
+        self.assertEqual(results.get_facet('category'), facet)
+
+        # Facets are counted exactly if the sample would hold all the
+        # matches.
+        results = query.search(0, 10, getfacets=True, facet_sample_size=2000)
+        self.assertEqual(results.facet_sample_rate, None)
+        self.assertEqual(results.get_facet('category'),
+                         (('a', 500), ('b', 500), ('c', 500), ('d', 500)))
+        self.assertEqual(results.get_facet_intervals('category'),
+                         (('a', (500, 500)), ('b', (500, 500)),
+                          ('c', (500, 500)), ('d', (500, 500))))
+
+        results = query.search(0, 10)
+        self.assertRaises(xappy.SearchError, results.get_facet_intervals,
+                          'category')
+        self.assertRaises(xappy.SearchError, query.search, 0, 10,
+                          getfacets=True, facet_sample_size=0)
+
+    def test_sample_source(self):
+        """Test that the sample doesn't depend on how it's accessed.
+
+        """
+        from xappy.searchconnection import _SamplePostingSource
+        def sample(skip):
+            source = _SamplePostingSource(0.25, 12345)
+            source.init(self.sconn._index)
+            docids = []
+            source.next(0)
+            while not source.at_end():
+                docids.append(source.get_docid())
+                source.skip_to(source.get_docid() + skip, 0)
+            return docids
+        docids = sample(1)
+        self.assert_(400 < len(docids) < 600)
+        checker = _SamplePostingSource(0.25, 12345)
+        self.assertEqual(docids, [docid for docid in xrange(1, 2001)
+                                  if checker.check(docid, 0)])
+        skipped = sample(7)
+        self.assert_(len(skipped) < len(docids))
+        self.assertEqual([docid for docid in skipped
+                          if docid not in docids], [])
+
+if __name__ == '__main__':
+    main()
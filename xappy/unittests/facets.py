@@ -100,5 +100,92 @@ class TestFacets(TestCase):
                          }
                         )
 
+    def test_facet_options(self):
+        query = self.sconn.query_facet('category', 'instrument')
+        results = query.search(0, 10, getfacets=True, facet_options={
+            'make': {'top_k': 2, 'sort': 'count'},
+            'type': {'min_count': 2},
+            'colour': {'top_k': 2},
+            'strings': {'sort': 'count', 'min_count': 1},
+        })
+
+        # Facets are only calculated when requested.
+        self.assertEqual(results.get_facet('make'),
+                         (('yamaha', 2), ('gretsch', 1)))
+        self.assert_('colour' in results._facets._pending)
+        self.assert_('make' not in results._facets._pending)
+        self.assertEqual(results.get_facet('type'),
+                         (('bass guitar', 2), ('drums', 2)))
+        self.assertRaises(KeyError, results.get_facet, 'foo')
+
+        self.assertEqual(results.get_facets(),
+                         {
+                            'category': (('instrument', 5),),
+                            'colour': (('black', 1), ('blue', 1)),
+                            'strings': (((4.0, 4.0), 1), ((5.0, 5.0), 1)),
+                            'species': (),
+                            'type': (('bass guitar', 2), ('drums', 2)),
+                            'make': (('yamaha', 2), ('gretsch', 1)),
+                         }
+                        )
+        self.assertEqual(results._facets._pending, {})
+
+        self.assertRaises(xappy.SearchError, query.search, 0, 10,
+                          getfacets=True,
+                          facet_options={'make': {'foo': 1}})
+        self.assertRaises(xappy.SearchError, query.search, 0, 10,
+                          getfacets=True,
+                          facet_options={'make': {'sort': 'foo'}})
+
+    def test_facet_views(self):
+        query = self.sconn.query_facet('category', 'instrument')
+        results = query.search(0, 10, getfacets=True)
+        expected = results.get_facets()
+        expected_scores = results._facets.facetscore
+        self.sconn.add_facet_view('instruments', query)
+
+        # The first search calculates the facets for the view, and later
+        # searches use the stored values, without counting facets.
+        for i in xrange(2):
+            results = query.search(0, 10, getfacets=True)
+            self.assertEqual(results._facets.facetspies, {})
+            self.assertEqual(results.get_facets(), expected)
+            self.assertEqual([r.id for r in results],
+                             ['0', '1', '2', '3', '4'])
+        self.assertEqual(len(self.sconn._facet_view_cache), len(facets))
+        self.assertEqual(results._facets.facetscore, expected_scores)
+        results = query.search(0, 10, getfacets=True,
+                               facet_options={'make': {'top_k': 1}})
+        self.assertEqual(results.get_facet('make'), (('yamaha', 2),))
+
+        # query_all() is always a view.
+        results = self.sconn.query_all().search(0, 10, getfacets=True)
+        self.assertEqual(results._facets.facetspies, {})
+        self.assertEqual(results.get_facets(), expected)
+
+        # The stored values are recalculated when the connection is
+        # reopened.
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('category', 'instrument'))
+        doc.fields.append(xappy.Field('make', 'Yamaha'))
+        self.iconn.add(doc)
+        self.iconn.flush()
+        self.sconn.reopen()
+        self.assertEqual(len(self.sconn._facet_view_cache), 0)
+        results = query.search(0, 10, getfacets=True)
+        self.assertEqual(results.get_facet('make'),
+                         (('gretsch', 1), ('musicman', 1), ('stagg', 1),
+                          ('yamaha', 3)))
+
+        # Facets aren't read from the view after it's removed.
+        self.sconn.remove_facet_view('instruments')
+        self.assertRaises(KeyError, self.sconn.remove_facet_view,
+                          'instruments')
+        results = query.search(0, 10, getfacets=True)
+        self.assertNotEqual(results._facets.facetspies, {})
+        self.assertEqual(results.get_facet('make'),
+                         (('gretsch', 1), ('musicman', 1), ('stagg', 1),
+                          ('yamaha', 3)))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+from xappy.cache_search_results import CacheResultOrdering
+from xappy.searchresults import SearchResultContext
+
+class TestFetchDocuments(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        for i in xrange(20):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('text', 'hello %d' % i))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_fetch_documents(self):
+        """Test reading a batch of documents.
+
+        """
+        docs = self.sconn._fetch_documents([3, 1, 2, 1, 999])
+        self.assertEqual(sorted(docs.keys()), [1, 2, 3])
+        for xapid, doc in docs.iteritems():
+            self.assertEqual(doc.get_data(),
+                             self.sconn.get_document(xapid=xapid)._doc.get_data())
+
+    def test_mset_results(self):
+        """Test that iterating over results reads the documents in a batch.
+
+        """
+        results = self.sconn.query_field('text', 'hello').search(0, 10)
+        self.assertEqual(results._fetched, False)
+        ids = [hit.id for hit in results]
+        self.assertEqual(results._fetched, True)
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(ids, [results.get_hit(i).id for i in xrange(10)])
+        self.assertEqual([hit.data['text'] for hit in results],
+                         [['hello %s' % docid] for docid in ids])
+
+        results = self.sconn.query_field('text', 'hello').search(5, 15)
+        results.prefetch()
+        self.assertEqual(results._fetched, True)
+        self.assertEqual(len(results), 10)
+
+    def test_cache_results(self):
+        """Test reading the documents for a cached ordering in a batch.
+
+        """
+        context = SearchResultContext(self.sconn, self.sconn._field_mappings,
+                                      None, None)
+        ordering = CacheResultOrdering(context, [5, 3, 9], 0)
+        ordering.fetch()
+        self.assertEqual(sorted(ordering.docs.keys()), [3, 5, 9])
+        it = ordering.get_iter()
+        self.assertEqual([it.next().id for i in xrange(3)], ['4', '2', '8'])
+        self.assertEqual(ordering.get_hit(1).data['text'], ['hello 2'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import xapian
+
+class TestFilterCache(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('group', xappy.FieldActions.INDEX_EXACT)
+        for i in xrange(100):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('text', 'doc %s' %
+                                          ('even', 'odd')[i % 2]))
+            doc.fields.append(xappy.Field('group', 'g%d' % (i % 7)))
+            if i == 42:
+                doc.fields.append(xappy.Field('group', 'special'))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.dbpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def _ids(self, query):
+        return [r.id for r in query.search(0, 200)]
+
+    def check_filter(self, query, filter):
+        expected = self._ids(self.sconn.query_filter(query, filter))
+        result = self._ids(self.sconn.query_filter(query, filter, cache=True))
+        self.assertEqual(result, expected)
+        expected = self._ids(self.sconn.query_filter(query, filter,
+                                                     exclude=True))
+        result = self._ids(self.sconn.query_filter(query, filter,
+                                                   exclude=True, cache=True))
+        self.assertEqual(result, expected)
+
+    def test_filter(self):
+        """Test that cached filters match the same documents.
+
+        """
+        query = self.sconn.query_field('text', 'doc')
+        odd = self.sconn.query_field('text', 'odd')
+        # Dense filters are held as bitmaps, sparse ones as lists of ids.
+        self.check_filter(query, odd)
+        self.check_filter(odd, self.sconn.query_field('group', 'g3'))
+        self.check_filter(query, self.sconn.query_field('group', 'special'))
+        self.check_filter(query, self.sconn.query_field('group', 'missing'))
+        self.check_filter(query, self.sconn.query_all())
+
+        cached = self.sconn.query_cached_filter(odd)
+        query2 = self.sconn.query_from_evalable(cached.evalable_repr())
+        self.assertEqual(sorted(self._ids(query2)), sorted(self._ids(odd)))
+
+        self.assertRaises(xappy.SearchError, self.sconn.query_cached_filter,
+                          xappy.Query(xapian.Query('odd')))
+
+    def test_stats(self):
+        """Test the cache statistics, eviction and pinning.
+
+        """
+        g = [self.sconn.query_field('group', 'g%d' % i) for i in xrange(7)]
+        self.sconn.query_cached_filter(g[0])
+        self.sconn.query_cached_filter(g[0])
+        stats = self.sconn.get_filter_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['entries'], 1)
+
+        # Only allow room for two entries.
+        self.sconn._filter_cache.maxsize = stats['size'] * 2
+        self.sconn.pin_filter(g[0])
+        for query in g[1:]:
+            self.sconn.query_cached_filter(query)
+        stats = self.sconn.get_filter_cache_stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['pinned'], 1)
+        self.assertEqual(stats['evictions'], 5)
+        self.sconn.query_cached_filter(g[0])
+        self.assertEqual(self.sconn.get_filter_cache_stats()['hits'], 2)
+
+        # Reopening without any changes to the database keeps the entries,
+        # if the revision of the database can be checked.
+        if hasattr(xapian.Database, 'get_revision'):
+            self.sconn.reopen()
+            self.assertEqual(self.sconn.get_filter_cache_stats()['entries'], 2)
+
+        # Reopening after changes discards the entries, but not the pins.
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.delete('3')
+        iconn.close()
+        self.sconn.reopen()
+        stats = self.sconn.get_filter_cache_stats()
+        self.assertEqual(stats['entries'], 0)
+        self.assertEqual(stats['pinned'], 1)
+        self.sconn.unpin_filter(g[0])
+        self.assertEqual(self.sconn.get_filter_cache_stats()['pinned'], 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+from xappy.lrucache import LRUCache
+
+class TestLRUCache(TestCase):
+    def test_order(self):
+        """Test that the least recently used entries are discarded.
+
+        """
+        cache = LRUCache(3)
+        for key in 'abc':
+            cache.set(key, key.upper())
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('d', 'D')
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+        self.assertEqual(cache.get('b'), None)
+
+        # Pinned entries are kept, even if they're the least recently used.
+        cache.pin('c')
+        cache.get('a')
+        cache.set('e', 'E')
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'e'])
+        self.assertEqual(cache.evictions, 2)
+
+        cache.remove('a')
+        self.assertEqual(sorted(cache.keys()), ['c', 'e'])
+        self.assertEqual(cache.size, 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.set('f', 'F')
+        self.assertEqual(cache.keys(), ['f'])
+        self.assertTrue(cache.is_pinned('c'))
+
+    def test_sizes(self):
+        """Test the sizes of entries.
+
+        """
+        cache = LRUCache(10, len)
+        cache.set('a', 'x' * 11)
+        self.assertEqual(len(cache), 0)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 4)
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+if __name__ == '__main__':
+    main()
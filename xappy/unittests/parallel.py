@@ -0,0 +1,167 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestParallelSearch(TestCase):
+    def pre_test(self):
+        self.paths = []
+        for shard in xrange(2):
+            path = os.path.join(self.tempdir, 'shard%d' % shard)
+            self.paths.append(path)
+            iconn = xappy.IndexerConnection(path)
+            iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+            iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+            iconn.add_field_action('num', xappy.FieldActions.SORTABLE,
+                                   type='float')
+            iconn.add_field_action('colour', xappy.FieldActions.FACET)
+            iconn.add_field_action('colour', xappy.FieldActions.COLLAPSE)
+            iconn.add_field_action('size', xappy.FieldActions.FACET,
+                                   type='float')
+            for i in xrange(15):
+                doc = xappy.UnprocessedDocument()
+                doc.fields.append(xappy.Field('text', 'doc %s %s' %
+                                              (' word' * (i % 4),
+                                               ('even', 'odd')[i % 2])))
+                doc.fields.append(xappy.Field('num', str(i * 2 + shard)))
+                doc.fields.append(xappy.Field('colour',
+                                              ('red', 'blue', 'green')[i % 3]))
+                doc.fields.append(xappy.Field('size', str(i * 1.5 + shard)))
+                iconn.add(doc)
+            iconn.flush()
+            iconn.close()
+        self.sconn = xappy.SearchConnection(self.paths[0])
+        self.pconn = xappy.ParallelSearchConnection(self.paths[0],
+                                                    processes=3)
+
+    def post_test(self):
+        self.pconn.close()
+        self.sconn.close()
+
+    def check_same(self, sconn, pconn, query, startrank, endrank, **kwargs):
+        expected = sconn.search(query, startrank, endrank, checkatleast=-1,
+                                **kwargs)
+        results = pconn.search(query, startrank, endrank, checkatleast=-1,
+                               **kwargs)
+        self.assertEqual(results.startrank, expected.startrank)
+        self.assertEqual(results.endrank, expected.endrank)
+        self.assertEqual(results.matches_estimated,
+                         expected.matches_estimated)
+        self.assertEqual(results.more_matches, expected.more_matches)
+        self.assertEqual([round(r.weight, 6) for r in results],
+                         [round(r.weight, 6) for r in expected])
+        if kwargs.get('sortby') is not None:
+            self.assertEqual([r.id for r in results],
+                             [r.id for r in expected])
+        else:
+            self.assertEqual(sorted(r.id for r in results),
+                             sorted(r.id for r in expected))
+        return results, expected
+
+    def test_search(self):
+        """Test that parallel searches give the same results as normal ones.
+
+        """
+        query = self.sconn.query_parse('word odd')
+        self.check_same(self.sconn, self.pconn, query, 0, 10)
+        self.check_same(self.sconn, self.pconn, query, 3, 6)
+        self.check_same(self.sconn, self.pconn, query.evalable_repr(), 0, 5)
+        self.check_same(self.sconn, self.pconn, self.sconn.query_all(), 0, 20,
+                        sortby='-num')
+        self.check_same(self.sconn, self.pconn, self.sconn.query_all(), 0, 20,
+                        sortby='num')
+
+        results, expected = self.check_same(self.sconn, self.pconn,
+                                            self.sconn.query_all(), 0, 10,
+                                            getfacets=True)
+        self.assertEqual(results.get_facets()['colour'],
+                         expected.get_facets()['colour'])
+        # Float facet ranges are calculated in the same way as for a normal
+        # search.
+        self.assertEqual(results.get_facets()['size'],
+                         expected.get_facets()['size'])
+
+        # Facet options are applied to the summed counts.
+        options = {'colour': {'top_k': 2, 'sort': 'count'},
+                   'size': {'min_count': 3}}
+        results, expected = self.check_same(self.sconn, self.pconn,
+                                            self.sconn.query_all(), 0, 10,
+                                            getfacets=True,
+                                            facet_options=options)
+        self.assertEqual(len(results.get_facet('colour')), 2)
+        self.assertEqual(results.get_facets(), expected.get_facets())
+
+        # The workers count facets on a sample of the same proportion of
+        # their matches, and the proportion is reported in the results.
+        results = self.pconn.search(self.sconn.query_all(), 0, 10,
+                                    getfacets=True, facet_sample_size=5)
+        self.assertAlmostEqual(results.facet_sample_rate, 5 / 15.0)
+        for value, (lower, upper) in results.get_facet_intervals('colour'):
+            self.assert_(lower < upper)
+
+        results = self.pconn.search(self.sconn.query_all(), 0, 10,
+                                    collapse='colour')
+        self.assertEqual(len(results), 3)
+
+    def test_unserialisable(self):
+        """Test that unserialisable queries are refused.
+
+        """
+        import xapian
+        self.assertRaises(xappy.SearchError, self.pconn.search,
+                          xappy.Query(xapian.Query('odd')), 0, 10)
+
+    def test_errors(self):
+        """Test that errors in the workers are passed back.
+
+        """
+        self.assertRaises(xappy.SearchError, self.pconn.search,
+                          self.sconn.query_all(), 0, 10, collapse='missing')
+        # The workers should still be usable.
+        self.check_same(self.sconn, self.pconn, self.sconn.query_all(), 0, 10)
+
+    def test_shards(self):
+        """Test parallel searches over several shards.
+
+        """
+        sconn = xappy.SearchConnection(self.paths)
+        pconn = xappy.ParallelSearchConnection(self.paths, processes=4)
+        try:
+            # Only one worker is used for each shard.
+            self.assertEqual(len(pconn._workers), 2)
+            self.check_same(sconn, pconn, sconn.query_all(), 0, 30,
+                            sortby='num')
+            self.check_same(sconn, pconn, sconn.query_all(), 5, 12,
+                            sortby='-num')
+
+            # The weights are calculated from the statistics of each shard,
+            # so may differ, but the same documents are matched.
+            query = sconn.query_parse('word even')
+            expected = sconn.search(query, 0, 30, checkatleast=-1)
+            results = pconn.search(query, 0, 30, checkatleast=-1)
+            self.assertEqual(results.matches_estimated,
+                             expected.matches_estimated)
+            self.assertEqual(sorted(r.id for r in results),
+                             sorted(r.id for r in expected))
+            results = pconn.search(query, 0, 30, getfacets=True)
+            self.assertEqual(results.get_facets()['colour'],
+                             sconn.search(query, 0, 30,
+                                          getfacets=True).get_facets()['colour'])
+        finally:
+            pconn.close()
+            sconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestProfiling(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('colour', xappy.FieldActions.FACET)
+        for i in xrange(20):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'doc %s' %
+                                          ('even', 'odd')[i % 2]))
+            doc.fields.append(xappy.Field('colour', ('red', 'blue')[i % 3 == 0]))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.dbpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_profile(self):
+        """Test profiling a single search.
+
+        """
+        query = self.sconn.query_parse('odd')
+        results = query.search(0, 5)
+        self.assertEqual(results.profile, None)
+
+        results = query.search(0, 5, checkatleast=-1, getfacets=True,
+                               profile=True)
+        profile = results.profile
+        names = [name for name, wall, cpu in profile.phases]
+        self.assertEqual(names, ['facet_fields', 'cache_lookup',
+                                 'enquire_setup', 'match', 'facets',
+                                 'results'])
+        for name, wall, cpu in profile.phases:
+            self.assertTrue(wall >= 0)
+        self.assertEqual(profile.documents_examined, 10)
+        self.assertEqual(profile.matchspy_counts, {'colour': 10})
+        self.assertAlmostEqual(profile.total_wall,
+                               sum(profile.get_phase(name)[0]
+                                   for name in names))
+
+        results.prefetch()
+        self.assertEqual(profile.phases[-1][0], 'materialise')
+
+        # The facet values are calculated when they're first read.
+        results.get_facet('colour')
+        self.assertEqual(profile.phases[-1][0], 'facet_calc')
+        count = len(profile.phases)
+        results.get_facet('colour')
+        self.assertEqual(len(profile.phases), count)
+
+    def test_aggregator(self):
+        """Test collecting profiles with an aggregator.
+
+        """
+        aggregator = xappy.ProfileAggregator(maxsamples=3)
+        self.sconn.set_profile_aggregator(aggregator)
+        for i in xrange(5):
+            self.sconn.query_parse('even').search(0, 5)
+        self.assertEqual(aggregator.phases(),
+                         ['cache_lookup', 'enquire_setup', 'facet_fields',
+                          'facets', 'match', 'query_parse', 'results'])
+        summary = aggregator.summary()
+        self.assertEqual(summary['match']['count'], 3)
+        self.assertEqual(sorted(summary['match']['wall'].keys()), [50, 90, 99])
+        self.assertEqual(aggregator.percentiles('missing'), {})
+
+        self.sconn.set_profile_aggregator(None)
+        self.assertEqual(self.sconn.query_parse('even').search(0, 5).profile,
+                         None)
+
+    def test_percentiles(self):
+        """Test the calculation of percentiles.
+
+        """
+        aggregator = xappy.ProfileAggregator()
+        for i in xrange(1, 101):
+            aggregator.add_phase('match', i, i / 10.0)
+        self.assertEqual(aggregator.percentiles('match', (1, 50, 90, 100)),
+                         {1: 1, 50: 50, 90: 90, 100: 100})
+        self.assertEqual(aggregator.percentiles('match', (50,), cpu=True),
+                         {50: 5.0})
+        aggregator.clear()
+        self.assertEqual(aggregator.phases(), [])
+
+if __name__ == '__main__':
+    main()
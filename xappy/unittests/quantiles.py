@@ -0,0 +1,110 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+import bisect
+from xappy.quantiles import QuantileSketch
+
+class TestQuantiles(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_EXACT)
+        iconn.add_field_action('price', xappy.FieldActions.FACET,
+                               type='float')
+        iconn.add_field_action('small', xappy.FieldActions.FACET,
+                               type='float')
+        rnd = random.Random(1)
+        for i in xrange(1000):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'all'))
+            doc.fields.append(xappy.Field('price',
+                                          '%.2f' % rnd.uniform(0, 100)))
+            doc.fields.append(xappy.Field('small', str(i % 3)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_sketch(self):
+        sketch = QuantileSketch(100)
+        rnd = random.Random(2)
+        items = [rnd.random() for i in xrange(20000)]
+        for item in items:
+            sketch.add(item)
+        items.sort()
+
+        # The memory used is bounded, and the weights account for all the
+        # items added.
+        self.assertEqual(sketch.count, 20000)
+        self.assert_(len(sketch) < 400)
+        self.assertEqual(sum([weight for item, weight
+                              in sketch.weighted_items()]), 20000)
+
+        for fraction in (0.01, 0.1, 0.5, 0.9, 0.99):
+            rank = bisect.bisect(items, sketch.quantile(fraction))
+            self.assert_(abs(rank / 20000.0 - fraction) < 0.02)
+
+    def test_facets(self):
+        # Use a query which isn't a facet view (as query_all() is), so that
+        # the facets are counted by the match.
+        query = self.sconn.query_field('text', 'all')
+        options = {'price': {'quantiles': 50}, 'small': {'quantiles': 2000}}
+        results = query.search(0, 10, getfacets=True, facet_options=options)
+        spy = results._facets.facetspies[
+            self.sconn._field_mappings.get_slot('price', 'facet')]
+        self.assert_(isinstance(spy, xappy.quantiles.QuantileMatchSpy))
+
+        # Until the sketch fills up, it holds all the values exactly.
+        self.assertEqual(results.get_facet('small'),
+                         (((0.0, 0.0), 334), ((1.0, 1.0), 333),
+                          ((2.0, 2.0), 333)))
+
+        # With many distinct values, the ranges are chosen from the estimated
+        # counts in the same way as for exactly counted values.
+        spy_values = spy.get_values()
+        self.assertEqual(sum(spy_values.itervalues()), 1000)
+        self.assert_(len(spy_values) < 1000)
+        price = results.get_facet('price')
+        self.assertEqual(price, tuple(xappy.mset_search_results.
+                                      _float_facet_ranges(spy_values, 7)))
+        self.assert_(1 < len(price) <= 7)
+        self.assertEqual(sum([count for r, count in price]), 1000)
+        for (start, end), count in price:
+            self.assert_(0 <= start <= end <= 100)
+        for i in xrange(len(price) - 1):
+            self.assert_(price[i][0][1] < price[i + 1][0][0])
+
+        self.assertRaises(xappy.SearchError, query.search, 0, 10,
+                          getfacets=True,
+                          facet_options={'price': {'quantiles': 1}})
+
+        # Facet views use the sketch too, and store its values separately
+        # from the exact values.
+        allquery = self.sconn.query_all()
+        results = allquery.search(0, 10, getfacets=True,
+                                  facet_options=options)
+        self.assertEqual(results._facets.facetspies, {})
+        self.assertEqual(results.get_facet('price'), price)
+        results = allquery.search(0, 10, getfacets=True)
+        exact = query.search(0, 10, getfacets=True).get_facet('price')
+        self.assertEqual(results.get_facet('price'), exact)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestQueryIdSet(TestCase):
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        for i in xrange(100):
+            doc = xappy.UnprocessedDocument()
+            doc.id = 'doc%d' % i
+            doc.fields.append(xappy.Field('text', ('even', 'odd')[i % 2]))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.dbpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def _ids(self, query):
+        return set(r.id for r in query.search(0, 200))
+
+    def test_id_set(self):
+        """Test filtering by a set of document ids.
+
+        """
+        ids = set('doc%d' % i for i in xrange(0, 100, 3))
+        query = self.sconn.query_id_set(ids)
+        self.assertEqual(self._ids(query), ids)
+
+        # Unknown ids are ignored.
+        query = self.sconn.query_id_set(['doc1', 'missing', 'doc5'])
+        self.assertEqual(self._ids(query), set(['doc1', 'doc5']))
+        self.assertEqual(self._ids(self.sconn.query_id_set([])), set())
+
+        # Filtering another query, in both directions.
+        odd = self.sconn.query_field('text', 'odd')
+        expected = set(id for id in ids if int(id[3:]) % 2 == 1)
+        self.assertEqual(self._ids(odd.filter(self.sconn.query_id_set(ids))),
+                         expected)
+        self.assertEqual(self._ids(self.sconn.query_id_set(ids).filter(odd)),
+                         expected)
+        self.assertEqual(self._ids(odd.and_not(self.sconn.query_id_set(ids))),
+                         self._ids(odd) - expected)
+
+    def test_cache(self):
+        """Test that resolved sets are cached until the connection is reopened.
+
+        """
+        ids = ['doc%d' % i for i in xrange(10)]
+        self.sconn.query_id_set(ids)
+        stats = self.sconn._id_set_cache.get_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 0)
+        self.sconn.query_id_set(reversed(ids))
+        self.assertEqual(self.sconn._id_set_cache.get_stats()['hits'], 1)
+
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.delete('doc3')
+        iconn.flush()
+        iconn.close()
+        self.sconn.reopen()
+        self.assertEqual(len(self.sconn._id_set_cache), 0)
+        self.assertEqual(self._ids(self.sconn.query_id_set(ids)),
+                         set(ids) - set(['doc3']))
+
+    def test_serialise(self):
+        """Test serialising id set queries.
+
+        """
+        query = self.sconn.query_id_set(iter(['doc4', 'doc2']))
+        query2 = self.sconn.query_from_evalable(query.evalable_repr())
+        self.assertEqual(self._ids(query2), set(['doc2', 'doc4']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+class RangeAutoTest(TestCase):
+    """Tests for automatically generated range acceleration terms.
+
+    """
+    def pre_test(self):
+        self.dbpath = os.path.join(self.tempdir, 'db')
+        iconn = xappy.IndexerConnection(self.dbpath)
+        iconn.add_field_action('price', xappy.FieldActions.SORTABLE,
+                               type='float', ranges='auto')
+        iconn.add_field_action('size', xappy.FieldActions.FACET,
+                               type='float', ranges='auto', precision_step=8)
+        rnd = random.Random(42)
+        self.values = {}
+        for i in xrange(200):
+            price = round(rnd.uniform(-50, 1000), rnd.randint(0, 2))
+            size = rnd.randint(0, 20) * 0.5
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('price', price))
+            doc.fields.append(xappy.Field('size', size))
+            iconn.add(doc)
+            self.values[str(i)] = (price, size)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.dbpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def _ids(self, query):
+        return set(r.id for r in query.search(0, 1000))
+
+    def _expected(self, field, begin, end):
+        index = {'price': 0, 'size': 1}[field]
+        result = set()
+        for docid, values in self.values.iteritems():
+            value = values[index]
+            if (begin is None or begin <= value) and \
+               (end is None or value <= end):
+                result.add(docid)
+        return result
+
+    def test_query_range(self):
+        """Test range searches using the automatic range terms.
+
+        """
+        rnd = random.Random(7)
+        prices = [values[0] for values in self.values.itervalues()]
+        tests = [(None, 100), (100, None), (0, 0), (-50, 1000), (10, 9),
+                 (prices[0], prices[0])]
+        for i in xrange(20):
+            begin, end = sorted((rnd.uniform(-60, 1010),
+                                 rnd.uniform(-60, 1010)))
+            tests.append((begin, end))
+
+        for begin, end in tests:
+            expected = self._expected('price', begin, end)
+            self.assertEqual(self._ids(self.sconn.query_range('price', begin,
+                                                              end)),
+                             expected)
+            self.assertEqual(self._ids(self.sconn.query_range('price', begin,
+                                                              end,
+                                                              accelerate=False)),
+                             expected)
+            subset = self._ids(self.sconn.query_range('price', begin, end,
+                approx=True, conservative=True))
+            superset = self._ids(self.sconn.query_range('price', begin, end,
+                approx=True, conservative=False))
+            self.assertTrue(subset <= expected)
+            self.assertTrue(expected <= superset)
+
+    def test_query_facet(self):
+        """Test facet range searches using the automatic range terms.
+
+        """
+        for begin, end in ((0, 5), (2.5, 2.5), (3.2, 7.9), (-1, 100)):
+            expected = self._expected('size', begin, end)
+            self.assertEqual(self._ids(self.sconn.query_facet('size',
+                                                              (begin, end))),
+                             expected)
+            subset = self._ids(self.sconn.query_facet('size', (begin, end),
+                approx=True, conservative=True))
+            self.assertTrue(subset <= expected)
+
+    def test_serialise(self):
+        """Test that the queries can be serialised.
+
+        """
+        query = self.sconn.query_range('price', 10, 200)
+        query2 = self.sconn.query_from_evalable(query.evalable_repr())
+        self.assertEqual(self._ids(query), self._ids(query2))
+
+    def test_invalid(self):
+        """Test that invalid precision steps are rejected.
+
+        """
+        iconn = xappy.IndexerConnection(os.path.join(self.tempdir, 'db2'))
+        self.assertRaises(xappy.IndexerError, iconn.add_field_action, 'foo',
+                          xappy.FieldActions.SORTABLE, type='float',
+                          ranges='auto', precision_step=0)
+        self.assertRaises(xappy.IndexerError, iconn.add_field_action, 'foo',
+                          xappy.FieldActions.SORTABLE, type='float',
+                          ranges=[(0, 1)], precision_step=4)
+        iconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+
+class TestSearchAfter(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('num', xappy.FieldActions.SORTABLE, type='float')
+        iconn.add_field_action('num', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('pair', xappy.FieldActions.SORTABLE, type='float')
+        iconn.add_field_action('pair', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('i', xappy.FieldActions.SORTABLE, type='float')
+        iconn.add_field_action('cat', xappy.FieldActions.COLLAPSE)
+        iconn.add_field_action('cat', xappy.FieldActions.STORE_CONTENT)
+
+        for i in xrange(33):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('text', 'common'))
+            if i % 2:
+                doc.fields.append(xappy.Field('text', 'odd'))
+            if i < 30:
+                doc.fields.append(xappy.Field('num', str(i % 7)))
+                doc.fields.append(xappy.Field('pair', str(i // 2)))
+            doc.fields.append(xappy.Field('i', str(i)))
+            doc.fields.append(xappy.Field('cat', str(i % 3)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def get_pages(self, query, count, **kwargs):
+        """Get all the pages of results, using cursors.
+
+        """
+        pages = []
+        cursor = None
+        while True:
+            results = self.sconn.search_after(query, count, cursor, **kwargs)
+            pages.append([hit.id for hit in results])
+            cursor = results.next_cursor
+            if cursor is None:
+                return pages
+            self.assertEqual(len(results), count)
+
+    def check_pages(self, query, count, keyfield=None, **kwargs):
+        """Check that paging gives the same results as a single search.
+
+        """
+        pages = self.get_pages(query, count, **kwargs)
+        ids = sum(pages, [])
+        self.assertEqual(len(ids), len(set(ids)))
+        for page in pages[:-1]:
+            self.assertEqual(len(page), count)
+
+        full = self.sconn.search(query, 0, 100, **kwargs)
+        self.assertEqual(sorted(ids), sorted([hit.id for hit in full]))
+        if keyfield is not None:
+            # Documents with equal keys may be in a different order.
+            keys = []
+            for docid in ids:
+                doc = self.sconn.get_document(docid)
+                keys.append(doc.data.get(keyfield))
+            self.assertEqual(keys, [hit.data.get(keyfield) for hit in full])
+        return pages
+
+    def test_sorted(self):
+        """Test paging through sorted results.
+
+        """
+        q = self.sconn.query_field('text', 'common')
+        self.check_pages(q, 4, 'num', sortby='num')
+        self.check_pages(q, 4, 'num', sortby='-num')
+        self.check_pages(q, 5, 'num', sortby=['num', '-i'])
+        self.check_pages(q, 1, 'num', sortby='num')
+        self.check_pages(q, 50, 'num', sortby='num')
+        q = self.sconn.query_field('text', 'odd')
+        self.check_pages(q, 3, 'num', sortby='-num')
+
+    def test_ties(self):
+        """Test that results with equal keys are returned in docid order.
+
+        """
+        q = self.sconn.query_field('text', 'common')
+        ids = sum(self.get_pages(q, 2, sortby='num'), [])
+        expected = sorted(range(30), key=lambda i: (i % 7, i)) + [30, 31, 32]
+        self.assertEqual(ids, [str(i) for i in expected])
+        ids = sum(self.get_pages(q, 3, sortby=['-num', 'pair']), [])
+        expected = sorted(range(30), key=lambda i: (-(i % 7), i // 2, i)) + \
+                   [30, 31, 32]
+        self.assertEqual(ids, [str(i) for i in expected])
+
+        # The cursor only records the last result, so it doesn't grow as
+        # the results are paged through.
+        cursor = None
+        sizes = []
+        while True:
+            results = self.sconn.search_after(q, 1, cursor, sortby='num')
+            cursor = results.next_cursor
+            if cursor is None:
+                break
+            sizes.append(len(cursor))
+        self.assertEqual(len(sizes), 32)
+        self.assert_(max(sizes) - min(sizes) <= 8)
+
+    def test_collapse(self):
+        """Test paging through collapsed results.
+
+        """
+        q = self.sconn.query_field('text', 'common')
+        self.check_pages(q, 4, 'pair', sortby='pair', collapse='cat')
+        self.check_pages(q, 4, 'pair', sortby='-pair', collapse='cat',
+                         collapse_max=3)
+        pages = self.check_pages(q, 2, 'pair', sortby='pair', collapse='cat',
+                                 collapse_max=2)
+        self.assertEqual(sum(pages, []), ['0', '1', '2', '3', '4', '5'])
+
+    def test_relevance(self):
+        """Test paging through results in relevance order.
+
+        """
+        q = self.sconn.query_field('text', 'common') | \
+            self.sconn.query_field('text', 'odd')
+        pages = self.check_pages(q, 4)
+        self.assertEqual(len(pages), 9)
+        self.check_pages(q, 4, collapse='cat')
+
+    def test_bad_cursor(self):
+        """Test that invalid cursors are rejected.
+
+        """
+        q = self.sconn.query_field('text', 'common')
+        results = self.sconn.search_after(q, 4, sortby='num')
+        cursor = results.next_cursor
+        self.assertNotEqual(cursor, None)
+        self.assertRaises(xappy.SearchError, self.sconn.search_after, q, 4,
+                          cursor, sortby='-num')
+        self.assertRaises(xappy.SearchError, self.sconn.search_after, q, 4,
+                          cursor[:-2], sortby='num')
+        self.assertRaises(xappy.SearchError, self.sconn.search_after, q, 4,
+                          'foo', sortby='num')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import xapian
+
+class TestSearchTimeLimit(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('cat', xappy.FieldActions.FACET)
+        for i in xrange(2000):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'word%d common' % (i % 7)))
+            doc.fields.append(xappy.Field('cat', 'cat%d' % (i % 3)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_no_time_limit_hit(self):
+        """Test that a generous time limit gives complete results.
+
+        """
+        query = self.sconn.query_parse('common')
+        results = query.search(0, 10, checkatleast=-1, getfacets=True,
+                               time_limit=60)
+        self.assertFalse(results.is_partial)
+        self.assertTrue(results.estimate_is_exact)
+        self.assertEqual(results.matches_estimated, 2000)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(dict(results.get_facets()['cat']),
+                         {'cat0': 667, 'cat1': 667, 'cat2': 666})
+
+    def test_fast_match(self):
+        """Test that a complete match isn't flagged as partial.
+
+        The match finishes, so the results are complete, even though the
+        time limit is too short for any match.
+
+        """
+        query = self.sconn.query_parse('missing')
+        results = query.search(0, 10, checkatleast=-1, getfacets=True,
+                               time_limit=0.000001)
+        self.assertFalse(results.is_partial)
+        self.assertTrue(results.estimate_is_exact)
+        self.assertEqual(results.matches_estimated, 0)
+        self.assertEqual(len(results), 0)
+
+    def test_time_limit_hit(self):
+        """Test that a tiny time limit gives partial results.
+
+        """
+        query = self.sconn.query_parse('common')
+        results = query.search(0, 10, checkatleast=-1, getfacets=True,
+                               time_limit=0.000001)
+        self.assertTrue(results.is_partial)
+        self.assertFalse(results.estimate_is_exact)
+        self.assertTrue(results.matches_lower_bound <= 2000)
+        self.assertTrue(results.matches_upper_bound <= 2000)
+        self.assertTrue(results.matches_lower_bound <=
+                        results.matches_estimated <=
+                        results.matches_upper_bound)
+        self.assertTrue(sum(count for value, count in
+                            results.get_facets()['cat']) <= 2000)
+
+    def test_shards(self):
+        """Test time limits on searches over several shards.
+
+        """
+        sconn = xappy.SearchConnection([self.indexpath, self.indexpath])
+        try:
+            query = sconn.query_parse('common')
+            if hasattr(xapian.Enquire, 'set_time_limit'):
+                results = query.search(0, 10, checkatleast=-1,
+                                       time_limit=60)
+                self.assertFalse(results.is_partial)
+                self.assertEqual(results.matches_estimated, 4000)
+            else:
+                # The time limit can't be applied, so is refused.
+                self.assertRaises(xappy.SearchError, query.search, 0, 10,
+                                  time_limit=60)
+        finally:
+            sconn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import threading
+import xapian
+
+class TestSearchPool(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+        for i in xrange(20):
+            doc = xappy.UnprocessedDocument()
+            doc.fields.append(xappy.Field('text', 'doc %d %s' %
+                                          (i, ('even', 'odd')[i % 2])))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+        self.pool = xappy.SearchPool(self.indexpath, size=2)
+
+    def post_test(self):
+        self.pool.close()
+        self.sconn.close()
+
+    def test_search(self):
+        """Test searching through a pool.
+
+        """
+        query = self.sconn.query_parse('odd')
+        expected = [r.id for r in query.search(0, 5)]
+
+        # Queries can be passed as Query objects, serialised strings, or
+        # callables.
+        requests = [
+            self.pool.search(query, 0, 5),
+            self.pool.search(query.evalable_repr(), 0, 5),
+            self.pool.search(lambda conn: conn.query_parse('odd'), 0, 5),
+        ]
+        for request in requests:
+            results = request.result(10)
+            self.assertTrue(request.done())
+            self.assertEqual(request.state, request.DONE)
+            self.assertEqual([r.id for r in results], expected)
+            self.assertEqual(results.matches_estimated, 10)
+
+        # Unserialisable queries are refused.
+        self.assertRaises(xappy.SearchError, self.pool.search,
+                          xappy.Query(xapian.Query('odd')), 0, 5)
+
+    def test_batch(self):
+        """Test submitting a batch of searches.
+
+        """
+        request = self.pool.search_batch([
+            (self.sconn.query_parse('odd'), 0, 3),
+            (self.sconn.query_parse('even'), 0, 3, {'checkatleast': -1}),
+        ])
+        odd, even = request.result(10)
+        self.assertEqual(len(odd), 3)
+        self.assertEqual(even.matches_lower_bound, 10)
+        self.assertEqual(even.matches_upper_bound, 10)
+
+        doc = self.pool.get_document(odd[0].id).result(10)
+        self.assertEqual(doc.data, odd[0].data)
+
+    def test_errors(self):
+        """Test that errors are passed back to the caller.
+
+        """
+        request = self.pool.search('conn.query_all()', 0, 5,
+                                   collapse='missing')
+        self.assertRaises(xappy.SearchError, request.result, 10)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['failed'], 1)
+
+    def test_reopen_errors(self):
+        """Test that errors when reopening fail the request.
+
+        """
+        pool = xappy.SearchPool(self.indexpath, size=1)
+        try:
+            def fail():
+                raise xappy.SearchError("Reopen failed")
+            conn = pool.call(lambda conn: conn).result(10)
+            conn.reopen = fail
+            pool.reopen()
+            request = pool.search('conn.query_all()', 0, 5)
+            self.assertRaises(xappy.SearchError, request.result, 10)
+            self.assertEqual(request.state, request.DONE)
+
+            # The worker is still running, and tries the reopen again.
+            del conn.reopen
+            results = pool.search('conn.query_all()', 0, 5).result(10)
+            self.assertEqual(results.matches_estimated, 20)
+            stats = pool.get_stats()
+            self.assertEqual(stats['failed'], 1)
+            self.assertEqual(stats['running'], 0)
+        finally:
+            pool.close()
+
+    def test_cancel_and_deadline(self):
+        """Test cancelling requests, and requests which miss their deadline.
+
+        """
+        # Block both workers, so that subsequent requests are queued.
+        release = threading.Event()
+        started = threading.Semaphore(0)
+        def block(conn):
+            started.release()
+            release.wait()
+            return conn.get_doccount()
+        blockers = [self.pool.call(block), self.pool.call(block)]
+        started.acquire()
+        started.acquire()
+
+        cancelled = self.pool.search('conn.query_all()', 0, 10)
+        expired = self.pool.search('conn.query_all()', 0, 10, timeout=0)
+        performed = self.pool.search('conn.query_all()', 0, 10)
+        called = []
+        cancelled.add_done_callback(called.append)
+
+        self.assertFalse(cancelled.wait(0.01))
+        self.assertRaises(xappy.SearchTimeoutError, cancelled.result, 0.01)
+        self.assertEqual(self.pool.get_stats()['queued'], 3)
+        self.assertTrue(cancelled.cancel())
+        self.assertEqual(called, [cancelled])
+        self.assertFalse(cancelled.cancel())
+
+        release.set()
+        for request in blockers:
+            self.assertEqual(request.result(10), 20)
+        self.assertRaises(xappy.SearchCancelledError, cancelled.result, 10)
+        self.assertRaises(xappy.SearchTimeoutError, expired.result, 10)
+        self.assertEqual(len(performed.result(10)), 10)
+        self.assertFalse(performed.cancel())
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['submitted'], 5)
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(stats['timed_out'], 1)
+        self.assertEqual(stats['queued'], 0)
+        self.assertTrue(stats['max_queue_depth'] >= 3)
+
+    def test_queue_limit(self):
+        """Test that requests are refused when the queue is full.
+
+        """
+        pool = xappy.SearchPool(self.indexpath, size=1, maxqueued=1)
+        release = threading.Event()
+        started = threading.Event()
+        def block(conn):
+            started.set()
+            release.wait()
+        pool.call(block)
+        started.wait()
+        pool.call(block)
+        self.assertRaises(xappy.SearchError, pool.call, block)
+        self.assertEqual(pool.get_stats()['refused'], 1)
+        release.set()
+        pool.close()
+        self.assertRaises(xappy.SearchError, pool.call, block)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+
+class TestShards(TestCase):
+    def pre_test(self):
+        self.paths = []
+        for shard in xrange(2):
+            path = os.path.join(self.tempdir, 'shard%d' % shard)
+            self.paths.append(path)
+            iconn = xappy.IndexerConnection(path)
+            iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+            iconn.add_field_action('text', xappy.FieldActions.STORE_CONTENT)
+            iconn.add_field_action('colour', xappy.FieldActions.FACET)
+            for i in xrange(5):
+                doc = xappy.UnprocessedDocument()
+                doc.id = 's%dd%d' % (shard, i)
+                doc.fields.append(xappy.Field('text', 'doc %d shard%d' %
+                                              (i, shard)))
+                doc.fields.append(xappy.Field('colour',
+                                              ('red', 'blue')[i % 2]))
+                iconn.add(doc)
+            iconn.flush()
+            iconn.close()
+        self.sconn = xappy.SearchConnection(self.paths)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_search(self):
+        """Test searching over several shards.
+
+        """
+        self.assertEqual(self.sconn.get_doccount(), 10)
+        results = self.sconn.query_parse('doc').search(0, 10, getfacets=True)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results.matches_estimated, 10)
+        self.assertEqual(dict(results.get_facets()['colour']),
+                         {'red': 6, 'blue': 4})
+
+        results = self.sconn.query_parse('shard1').search(0, 10)
+        self.assertEqual(sorted([r.id for r in results]),
+                         ['s1d0', 's1d1', 's1d2', 's1d3', 's1d4'])
+        for result in results:
+            self.assertEqual(result.shard, 1)
+            shard, xapid = self.sconn.get_shard(result._doc.get_docid())
+            self.assertEqual(shard, 1)
+            doc = self.sconn.get_document(xapid=xapid, shard=1)
+            self.assertEqual(doc.id, result.id)
+
+    def test_get_document(self):
+        """Test getting documents from a particular shard.
+
+        """
+        self.assertEqual(self.sconn.get_document('s0d3').id, 's0d3')
+        self.assertEqual(self.sconn.get_document('s0d3', shard=0).id, 's0d3')
+        self.assertRaises(KeyError, self.sconn.get_document, 's0d3', shard=1)
+        self.assertRaises(xappy.SearchError, self.sconn.get_document, 's0d3',
+                          shard=2)
+        self.assertEqual(self.sconn.get_shard(1), (0, 1))
+        self.assertEqual(self.sconn.get_shard(2), (1, 1))
+        self.assertEqual(self.sconn.get_shard(5), (0, 3))
+
+    def test_incompatible(self):
+        """Test that shards with incompatible configurations are refused.
+
+        """
+        path = os.path.join(self.tempdir, 'other')
+        iconn = xappy.IndexerConnection(path)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_EXACT)
+        iconn.flush()
+        iconn.close()
+        self.assertRaises(xappy.SearchError, xappy.SearchConnection,
+                          [self.paths[0], path])
+
+    def test_cache(self):
+        """Test that cached orderings aren't combined across shards.
+
+        """
+        managers = []
+        for shard, path in enumerate(self.paths):
+            manager = xappy.cachemanager.XapianCacheManager(
+                os.path.join(self.tempdir, 'cache%d' % shard))
+            queryid = manager.get_or_make_queryid('q')
+            manager.set_hits(queryid, [1, 2, 3])
+            manager.set_stats(queryid, 3, 3, 3)
+            manager.flush()
+            managers.append(manager)
+        sharded = xappy.cachemanager.ShardedCacheManager(managers)
+        self.assertEqual(sharded.get_queryid('q'), queryid)
+        self.assertEqual(sharded.get_hits(queryid), [])
+        self.assertEqual(sharded.get_hits(queryid, 0, 2), [])
+        self.assertEqual(sharded.get_stats(queryid), (6, 6, 6))
+        sharded.close()
+
+if __name__ == '__main__':
+    main()
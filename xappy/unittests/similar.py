@@ -69,5 +69,107 @@ class TestSimilar(TestCase):
             self.assertEqual(i1.id, i2.id)
             self.assertAlmostEqual(i1.weight, i2.weight)
 
+    def test_expand_cache(self):
+        """Test that expand results are cached until the connection is reopened.
+
+        """
+        expected = self.sconn.significant_terms('12')
+        stats = self.sconn._expand_cache.get_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(self.sconn.significant_terms('12'), expected)
+        self.assertEqual(self.sconn._expand_cache.get_stats()['hits'], 1)
+
+        # Expands of unstored documents aren't cached.
+        self.sconn.significant_terms(self.docs['12'])
+        self.assertEqual(self.sconn._expand_cache.get_stats()['entries'], 1)
+
+        iconn = xappy.IndexerConnection(self.indexpath)
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('text', 'termA'))
+        iconn.add(doc)
+        iconn.close()
+        self.sconn.reopen()
+        self.assertEqual(len(self.sconn._expand_cache), 0)
+        self.assertEqual(self.sconn.significant_terms('12'), expected)
+
+class TestSimilarTopTerms(TestCase):
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('tag', xappy.FieldActions.INDEX_EXACT)
+        iconn.set_top_terms_count(3)
+        for i in xrange(32):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            if i % 2:
+                doc.fields.append(xappy.Field('text', 'termA'))
+            if (i / 2) % 2:
+                doc.fields.append(xappy.Field('text', 'termB'))
+            if i >= 8:
+                doc.fields.append(xappy.Field('text', 'termC'))
+            if i >= 24:
+                doc.fields.append(xappy.Field('text', 'termE'))
+            doc.fields.append(xappy.Field('tag', 'tag%d' % (i % 3)))
+            iconn.add(doc)
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def test_top_terms(self):
+        """Test that the top terms stored at indexing time are used.
+
+        """
+        # termA and termB are equally frequent, so may come in either order.
+        terms = self.sconn.significant_terms('27', 3)
+        self.assertEqual(terms[0], ('text', 'terme'))
+        self.assertEqual(sorted(terms[1:]),
+                         [('text', 'terma'), ('text', 'termb')])
+        self.assertEqual(self.sconn.significant_terms('27', 2), terms[:2])
+        self.assertEqual(self.sconn._expand_cache.get_stats()['misses'], 0)
+
+        # Asking for more terms than are stored needs an expand.
+        self.assertEqual(len(self.sconn.significant_terms('27', 4)), 4)
+        self.assertEqual(self.sconn._expand_cache.get_stats()['misses'], 1)
+
+        # Deleting and replacing documents updates the stored terms.
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.delete('27')
+        doc = xappy.UnprocessedDocument()
+        doc.id = '1'
+        doc.fields.append(xappy.Field('text', 'termE'))
+        iconn.replace(doc)
+        iconn.close()
+        self.sconn.reopen()
+        self.assertEqual(self.sconn.get_metadata('_xappy_top_terms:27'), '')
+        self.assertEqual(self.sconn.significant_terms('1', 1),
+                         [('text', 'terme')])
+
+        # With a count of 0, no terms are stored for new documents, and the
+        # terms for replaced documents are removed.
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.set_top_terms_count(0)
+        doc = xappy.UnprocessedDocument()
+        doc.id = 'new'
+        doc.fields.append(xappy.Field('text', 'termE'))
+        iconn.add(doc)
+        self.assertEqual(iconn._top_terms_pending, set())
+        doc = xappy.UnprocessedDocument()
+        doc.id = '1'
+        doc.fields.append(xappy.Field('text', 'termA'))
+        iconn.replace(doc)
+        self.assertEqual(iconn._top_terms_pending, set())
+        iconn.close()
+        self.sconn.reopen()
+        metadata_keys = list(self.sconn._index.metadata_keys())
+        self.assertEqual(self.sconn.get_metadata('_xappy_top_terms:1'), '')
+        self.assertEqual(self.sconn.get_metadata('_xappy_top_terms:new'), '')
+        self.assertTrue('_xappy_top_terms:26' in metadata_keys)
+        self.assertFalse('_xappy_top_terms:1' in metadata_keys)
+        self.assertFalse('_xappy_top_terms:new' in metadata_keys)
+
 if __name__ == '__main__':
     main()
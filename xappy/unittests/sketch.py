@@ -0,0 +1,117 @@
+# Copyright (C) 2026 agent
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+from xappytest import *
+import random
+
+
+class TestSketch(TestCase):
+    texts = (
+        'apple banana cherry damson elder fig grape',
+        'apple banana cherry damson elder fig grape',
+        'zebra yak walrus vulture unicorn tiger',
+        'apple banana cherry damson elder fig grape',
+        'red orange yellow green blue indigo violet',
+        'one two three four five six',
+    )
+
+    def pre_test(self):
+        self.indexpath = os.path.join(self.tempdir, 'foo')
+        iconn = xappy.IndexerConnection(self.indexpath)
+        iconn.add_field_action('num', xappy.FieldActions.SORTABLE, type='float')
+        iconn.add_field_action('num', xappy.FieldActions.STORE_CONTENT)
+        iconn.add_field_action('text', xappy.FieldActions.INDEX_FREETEXT)
+        iconn.add_field_action('text', xappy.FieldActions.SKETCH)
+        iconn.add_field_action('text2', xappy.FieldActions.SKETCH)
+
+        for i, text in enumerate(self.texts):
+            doc = xappy.UnprocessedDocument()
+            doc.id = str(i)
+            doc.fields.append(xappy.Field('num', str(i)))
+            doc.fields.append(xappy.Field('text', text))
+            doc.fields.append(xappy.Field('text2', text))
+            iconn.add(doc)
+
+        # The sketch covers all the instances of a field.
+        doc = xappy.UnprocessedDocument()
+        doc.id = 'split'
+        doc.fields.append(xappy.Field('num', '100'))
+        doc.fields.append(xappy.Field('text', 'zebra yak walrus'))
+        doc.fields.append(xappy.Field('text', 'vulture unicorn tiger'))
+        iconn.add(doc)
+
+        iconn.flush()
+        iconn.close()
+        self.sconn = xappy.SearchConnection(self.indexpath)
+
+    def post_test(self):
+        self.sconn.close()
+
+    def get_sketch(self, docid, field='text'):
+        slot = self.sconn._field_mappings.get_slot(field, 'sketch')
+        doc = self.sconn.get_document(docid)
+        return xappy.sketch.unserialise(doc._doc.get_value(slot))
+
+    def test_sketches(self):
+        """Test the sketches stored for documents.
+
+        """
+        self.assertEqual(self.get_sketch('0'), self.get_sketch('1'))
+        self.assertEqual(self.get_sketch('2'), self.get_sketch('split'))
+        self.assertEqual(xappy.sketch.similarity(self.get_sketch('0'),
+                                                 self.get_sketch('1')), 1.0)
+        self.assert_(xappy.sketch.similarity(self.get_sketch('0'),
+                                             self.get_sketch('2')) < 0.9)
+
+        # The similarity estimates the cosine of the angle between the
+        # documents: sketches differing in half their bits are unrelated.
+        self.assertAlmostEqual(xappy.sketch.similarity(0, 0xffffffff), 0.0)
+        self.assertAlmostEqual(xappy.sketch.similarity(0, 0xffff), 0.5 ** 0.5)
+        self.assertEqual(xappy.sketch.similarity(0, 0xffffffffffffffff), 0.0)
+
+    def test_reorder(self):
+        """Test reordering by similarity using the sketches.
+
+        """
+        q = self.sconn.query_all()
+        results = q.search(0, 10, sortby='num')
+        self.assertEqual([int(hit.data['num'][0]) for hit in results],
+                         [0, 1, 2, 3, 4, 5, 100])
+        results._reorder_by_similarity(3, 100, 0.9, 'text')
+        self.assertEqual([int(hit.data['num'][0]) for hit in results],
+                         [0, 2, 4, 1, 3, 5, 100])
+
+        # Each document is compared with all the documents already chosen,
+        # not just the previous one.
+        results = q.search(0, 10, sortby='num')
+        results._reorder_by_similarity(10, 100, 0.9, 'text')
+        self.assertEqual([int(hit.data['num'][0]) for hit in results],
+                         [0, 2, 4, 5, 1, 3, 100])
+
+        # The similarity for several fields is the average of the similarity
+        # for each field (and the last document has no sketch for text2).
+        results = q.search(0, 10, sortby='num')
+        results._reorder_by_similarity(10, 100, 0.9, ['text', 'text2'])
+        self.assertEqual([int(hit.data['num'][0]) for hit in results],
+                         [0, 2, 4, 5, 100, 1, 3])
+
+        # maxcount limits the documents which are moved.
+        results = q.search(0, 10, sortby='num')
+        results._reorder_by_similarity(10, 3, 0.9, 'text')
+        self.assertEqual([int(hit.data['num'][0]) for hit in results],
+                         [0, 2, 1, 3, 4, 5, 100])
+
+if __name__ == '__main__':
+    main()
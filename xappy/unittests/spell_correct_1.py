@@ -37,5 +37,31 @@ class TestSpellCorrect(TestCase):
         query = 'brunore-brunore'
         self.assertEqual('bruno-bruno', self.sconn.spell_correct(query))
 
+    def test_spell_cache(self):
+        """Test that corrections, and the lack of them, are cached.
+
+        """
+        self.assertEqual('bruno', self.sconn.spell_correct('brunore'))
+        self.assertEqual('guy', self.sconn.spell_correct('guy'))
+        self.assertEqual('bruno', self.sconn.spell_correct('brunore'))
+        self.assertEqual('guy', self.sconn.spell_correct('guy'))
+        stats = self.sconn._spell_cache.get_stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hits'], 2)
+
+        # Different settings are cached separately.
+        self.assertEqual('bruno', self.sconn.spell_correct('brunore',
+                                                           allow=['name']))
+        self.assertEqual(self.sconn._spell_cache.get_stats()['misses'], 3)
+
+        # Reopening clears the cache, since the spelling data may change.
+        iconn = xappy.IndexerConnection(self.indexpath)
+        doc = xappy.UnprocessedDocument()
+        doc.fields.append(xappy.Field('name', 'brunorex'))
+        iconn.add(doc)
+        iconn.close()
+        self.sconn.reopen()
+        self.assertEqual(len(self.sconn._spell_cache), 0)
+
 if __name__ == '__main__':
     main()
@@ -50,6 +50,23 @@ class ExternalWeightConstant(xappy.ExternalWeightSource):
     def get_weight(self, doc):
         return self.value
 
+class ExternalWeightBatch(xappy.ExternalWeightSource):
+    """An external weight source which reads values in batches.
+
+    """
+    def __init__(self, field, purpose, batch_size):
+        xappy.ExternalWeightSource.__init__(self)
+        self.slots = [(field, purpose)]
+        self.batch_size = batch_size
+        self.batches = []
+
+    def get_maxweight(self):
+        return 10
+
+    def get_weights(self, xapids, values):
+        self.batches.append(list(xapids))
+        return [xapian.sortable_unserialise(val) for val in values[0]]
+
 class TestWeightExternal(TestCase):
     def pre_test(self):
         self.indexpath = os.path.join(self.tempdir, 'foo')
@@ -107,5 +124,33 @@ class TestWeightExternal(TestCase):
         r = self.sconn.search(q, 0, 10)
         self.assertEqual([int(i.id) for i in r], [3])
 
+    def test_weight_batches(self):
+        """Check a search using batches of values from an external source.
+
+        """
+        s = ExternalWeightBatch('weight', 'weight', 2)
+        q = self.sconn.query_external_weight(s)
+        r = self.sconn.search(q, 0, 10)
+        self.assertEqual([int(i.id) for i in r], [4, 3, 2, 1, 0])
+        self.assertEqual([i.weight for i in r], [1.0, 0.75, 0.5, 0.25, 0])
+        self.assertEqual(s.batches, [[1, 2], [3, 4], [5]])
+
+        # Check that documents not needed by the match are skipped.
+        s = ExternalWeightBatch('weight', 'weight', 2)
+        q = self.sconn.query_field("exact", "3")
+        q = q.adjust(self.sconn.query_external_weight(s))
+        r = self.sconn.search(q, 0, 10)
+        self.assertEqual([int(i.id) for i in r], [3])
+        self.assertEqual(min(min(batch) for batch in s.batches), 4)
+
+        self.assertRaises(xappy.SearchError,
+                          self.sconn.query_external_weight,
+                          ExternalWeightBatch('name', 'weight', 2))
+
+        # Subclasses using slots must implement get_weights().
+        self.assertRaises(NotImplementedError,
+                          xappy.ExternalWeightSource().get_weights,
+                          [1], [['']])
+
 if __name__ == '__main__':
     main()